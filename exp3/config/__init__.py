@@ -7,6 +7,7 @@ from .settings import *
 
 __all__ = [
     'DATABASE_CONFIG',
+    'DATABASE_PROFILES',
     'SYSTEM_CONFIG',
     'PAGINATION_CONFIG',
     'PRODUCT_CATEGORIES',
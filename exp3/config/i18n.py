@@ -4,8 +4,82 @@ Internationalization (i18n) - 国际化支持
 """
 
 import os
+import re
 import json
-from typing import Dict, Optional
+import marshal
+import string
+from typing import Dict, Optional, FrozenSet, Any
+
+
+class _Template:
+    """
+    预编译的翻译文本
+    
+    Attributes:
+        text (str): 原始翻译文本
+        plain (bool): 不含花括号,任何参数下都原样返回
+        fields (Optional[FrozenSet[str]]): 引用的参数名;含位置参数、嵌套格式等写法时为 None
+        segments (Optional[List[str]]): 字面文本与参数名交替排列(偶数位为字面文本);
+            只含 {name} 形式的占位符时预先切分,否则为 None
+    """
+    
+    __slots__ = ('text', 'plain', 'fields', 'segments')
+    
+    def __init__(self, text: str):
+        self.text = text
+        self.plain = '{' not in text and '}' not in text
+        self.segments = None
+        self.fields = frozenset() if self.plain else self._parse(text)
+    
+    def _parse(self, text: str) -> Optional[FrozenSet[str]]:
+        names = set()
+        segments = ['']
+        try:
+            for literal, field, spec, conversion in string.Formatter().parse(text):
+                if segments is not None:
+                    segments[-1] += literal
+                if field is None:
+                    continue
+                name = re.split(r'[.\[]', field, 1)[0]
+                if not name or name.isdigit() or (spec and '{' in spec):
+                    return None
+                names.add(name)
+                if segments is not None and field == name and not spec and not conversion:
+                    segments.extend((name, ''))
+                else:
+                    segments = None
+        except ValueError:
+            return None
+        self.segments = segments
+        return frozenset(names)
+
+
+def compile_catalog(translations: Dict, prefix: str = '', catalog: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    将嵌套的翻译字典编译为 "点分隔键 -> 翻译" 的扁平映射
+    
+    字符串编译为 _Template;中间层级的字典与其他类型的值原样保留,
+    与逐层查找时 translate 的返回值一致。
+    
+    Args:
+        translations: 某一语言的翻译字典
+        prefix: 键前缀(递归使用)
+        catalog: 写入的目标映射(递归使用)
+        
+    Returns:
+        Dict[str, Any]: 扁平翻译目录
+    """
+    if catalog is None:
+        catalog = {}
+    for name, value in translations.items():
+        key = f"{prefix}{name}"
+        if isinstance(value, str):
+            catalog[key] = _Template(value)
+        else:
+            catalog[key] = value
+            if isinstance(value, dict):
+                compile_catalog(value, key + '.', catalog)
+    return catalog
 
 
 class I18n:
@@ -17,8 +91,18 @@ class I18n:
     # 默认语言
     DEFAULT_LANGUAGE = 'zh_CN'
     
-    # 翻译数据缓存
-    _translations_cache = None
+    # 翻译源文件与编译缓存目录(缓存按语言拆分,以源文件的修改时间和大小判断是否过期)
+    SOURCE_PATH = os.path.join(os.path.dirname(__file__), 'translations.json')
+    CACHE_DIR = os.path.join(os.path.dirname(__file__), '__pycache__')
+    
+    # 翻译数据缓存: {语言代码: 翻译字典},按需逐个语言加载
+    _translations_cache: Dict[str, Optional[Dict]] = {}
+    
+    # 编译后的扁平翻译目录缓存: {语言代码: {键: 翻译}}
+    _catalog_cache: Dict[str, Dict[str, Any]] = {}
+    
+    # 翻译修订号: 切换语言或重新加载翻译时递增,供渲染缓存判断是否失效
+    revision = 0
     
     def __init__(self, language: Optional[str] = None):
         """
@@ -29,6 +113,7 @@ class I18n:
         """
         self.current_language = language or self._get_system_language()
         self.translations = self._load_translations()
+        self.catalog = self._load_catalog()
     
     def _get_system_language(self) -> str:
         """
@@ -49,26 +134,97 @@ class I18n:
     
     def _load_translations(self) -> Dict:
         """
-        从 JSON 文件加载翻译数据
+        加载当前语言的翻译数据(文件中没有该语言时使用默认语言)
         
         Returns:
             Dict: 翻译字典
         """
-        # 使用缓存避免重复读取文件
-        if I18n._translations_cache is None:
-            json_path = os.path.join(os.path.dirname(__file__), 'translations.json')
-            try:
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    I18n._translations_cache = json.load(f)
-            except FileNotFoundError:
-                print(f"Warning: translations.json not found at {json_path}")
-                I18n._translations_cache = {}
-            except json.JSONDecodeError as e:
-                print(f"Warning: Error parsing translations.json: {e}")
-                I18n._translations_cache = {}
-        
-        return I18n._translations_cache.get(self.current_language, 
-                                            I18n._translations_cache.get(self.DEFAULT_LANGUAGE, {}))
+        translations = self._load_language(self.current_language)
+        if translations is None:
+            translations = self._load_language(self.DEFAULT_LANGUAGE)
+        return translations or {}
+    
+    @classmethod
+    def _load_language(cls, language: str) -> Optional[Dict]:
+        """
+        加载单个语言的翻译数据,已加载的语言直接返回缓存
+        
+        Args:
+            language: 语言代码
+            
+        Returns:
+            Optional[Dict]: 翻译字典,文件中没有该语言时为 None
+        """
+        if language not in I18n._translations_cache:
+            I18n._translations_cache[language] = cls._read_language(language)
+        return I18n._translations_cache[language]
+    
+    @classmethod
+    def _cache_path(cls, language: str) -> str:
+        return os.path.join(cls.CACHE_DIR, f'translations.{language}.marshal')
+    
+    @classmethod
+    def _read_language(cls, language: str) -> Optional[Dict]:
+        """
+        读取单个语言: 优先使用 marshal 编译缓存,缓存缺失或过期时解析 JSON 并重建所有语言的缓存
+        
+        Args:
+            language: 语言代码
+            
+        Returns:
+            Optional[Dict]: 翻译字典,文件中没有该语言时为 None
+        """
+        json_path = cls.SOURCE_PATH
+        try:
+            stat = os.stat(json_path)
+        except FileNotFoundError:
+            print(f"Warning: translations.json not found at {json_path}")
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        
+        try:
+            with open(cls._cache_path(language), 'rb') as f:
+                cached_stamp, translations = marshal.loads(f.read())
+            if cached_stamp == stamp:
+                return translations
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+        
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                all_translations = json.load(f)
+        except json.JSONDecodeError as e:
+            print(f"Warning: Error parsing translations.json: {e}")
+            return None
+        cls._write_caches(all_translations, stamp)
+        return all_translations.get(language)
+    
+    @classmethod
+    def _write_caches(cls, all_translations: Dict, stamp: tuple) -> None:
+        """为每种支持的语言写入编译缓存(目录不可写时跳过)"""
+        try:
+            os.makedirs(cls.CACHE_DIR, exist_ok=True)
+            for language in cls.SUPPORTED_LANGUAGES:
+                path = cls._cache_path(language)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    marshal.dump((stamp, all_translations.get(language)), f)
+                os.replace(tmp_path, path)
+        except OSError:
+            pass
+    
+    def _load_catalog(self) -> Dict[str, Any]:
+        """
+        获取当前语言的扁平翻译目录(每种语言只编译一次)
+        
+        Returns:
+            Dict[str, Any]: 扁平翻译目录
+        """
+        catalog = I18n._catalog_cache.get(self.current_language)
+        if catalog is None:
+            catalog = compile_catalog(self.translations)
+            I18n._catalog_cache[self.current_language] = catalog
+        return catalog
     
     def set_language(self, language: str) -> bool:
         """
@@ -85,8 +241,18 @@ class I18n:
         
         self.current_language = language
         self.translations = self._load_translations()
+        self.catalog = self._load_catalog()
+        I18n.revision += 1
         return True
     
+    def reload_translations(self) -> None:
+        """重新读取翻译数据(修改 translations.json 后调用,过期的编译缓存会自动重建)"""
+        I18n._translations_cache = {}
+        I18n._catalog_cache = {}
+        self.translations = self._load_translations()
+        self.catalog = self._load_catalog()
+        I18n.revision += 1
+    
     def t(self, key: str, **kwargs) -> str:
         """
         翻译函数（简写）
@@ -111,29 +277,38 @@ class I18n:
         Returns:
             str: 翻译后的文本
         """
-        # 按点分隔键，逐层查找
-        keys = key.split('.')
-        value = self.translations
-        
-        for k in keys:
-            if isinstance(value, dict):
-                value = value.get(k)
-            else:
-                value = None
-                break
+        # 扁平目录中直接查找完整的键
+        entry = self.catalog.get(key)
         
         # 如果找不到翻译，返回键本身
-        if value is None:
+        if entry is None:
             return key
+        if entry.__class__ is not _Template:
+            return entry
         
         # 如果有格式化参数，进行格式化
-        if kwargs and isinstance(value, str):
+        if not kwargs or entry.plain:
+            return entry.text
+        segments = entry.segments
+        if segments is not None:
+            # 按编译时切分好的片段拼接,不必每次重新解析模板
+            parts = segments[:]
             try:
-                return value.format(**kwargs)
+                for i in range(1, len(parts), 2):
+                    parts[i] = format(kwargs[parts[i]])
             except KeyError:
-                return value
-        
-        return value
+                # 缺少参数时与 str.format 抛出 KeyError 的处理一致,返回原文
+                return entry.text
+            return ''.join(parts)
+        if entry.fields is not None:
+            # 缺少参数时与 str.format 抛出 KeyError 的处理一致,返回原文
+            if entry.fields <= kwargs.keys():
+                return entry.text.format_map(kwargs)
+            return entry.text
+        try:
+            return entry.text.format(**kwargs)
+        except KeyError:
+            return entry.text
     
     def get_language_name(self, language: Optional[str] = None) -> str:
         """
@@ -210,3 +385,8 @@ def set_language(language: str) -> bool:
         bool: 是否成功
     """
     return get_i18n().set_language(language)
+
+
+def reload_translations() -> None:
+    """重新加载全局实例的翻译数据"""
+    get_i18n().reload_translations()
@@ -6,7 +6,67 @@ Configuration file for the Anime Shopping Mall System.
 # 数据库配置
 DATABASE_CONFIG = {
     'db_path': 'anime_mall.db',
-    'timeout': 30
+    'timeout': 30,                      # 锁等待秒数(sqlite3 connect timeout / busy_timeout)
+    'profile': 'balanced',              # 性能档位,见 DATABASE_PROFILES
+    'pragma_overrides': {},             # 覆盖档位中的个别 PRAGMA
+    # 连接池配置
+    'pool_size': 5,                     # 最大连接数
+    'pool_acquire_timeout': 10,         # 连接池耗尽时的最长等待秒数
+    'pool_health_check_interval': 30    # 空闲超过该秒数的连接借出前做健康检查
+}
+
+# 数据库性能档位
+# busy_timeout 为 None 时取 DATABASE_CONFIG['timeout'];
+# cache_size 为负数表示 KiB;checkpoint_interval 为 WAL 后台检查点间隔秒数(0 表示关闭)
+DATABASE_PROFILES = {
+    # 默认: WAL 读写并发 + NORMAL 同步,崩溃时最多丢失最近一次提交
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': None,
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 1000,
+        'checkpoint_interval': 60,
+        'checkpoint_mode': 'PASSIVE'
+    },
+    # 持久优先: 每次提交都 fsync
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': None,
+        'cache_size': -8000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'wal_autocheckpoint': 1000,
+        'checkpoint_interval': 30,
+        'checkpoint_mode': 'PASSIVE'
+    },
+    # 吞吐优先: 适用于压测/导入等可重建数据的场景
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'busy_timeout': None,
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 4000,
+        'checkpoint_interval': 120,
+        'checkpoint_mode': 'TRUNCATE'
+    },
+    # 兼容: 传统回滚日志模式(写操作会阻塞读操作)
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': None,
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'wal_autocheckpoint': 1000,
+        'checkpoint_interval': 0,
+        'checkpoint_mode': 'PASSIVE'
+    }
 }
 
 # 系统配置
@@ -37,6 +97,23 @@ PRODUCT_CATEGORIES = [
     '其他'
 ]
 
+# 商品配置
+PRODUCT_CONFIG = {
+    'view_flush_interval': 5.0,       # 浏览次数写回间隔(秒)
+    'view_flush_threshold': 500,      # 待写回浏览次数达到该值时立即写回
+    # "最受欢迎" 排序的热度权重: 浏览数 × views + 收藏数 × favorites + 成交件数 × sales
+    # 修改后运行 scripts/rebuild_popularity.py 重算已有商品
+    'popularity_weights': {'views': 1.0, 'favorites': 5.0, 'sales': 20.0},
+    # 搜索结果价格分面的区间边界: <50, 50-100, 100-200, 200-500, >=500
+    'search_price_buckets': [50, 100, 200, 500],
+    # 近期热门(滑动窗口)
+    'trending_window_minutes': 60,    # 分钟窗口桶数(最近一小时)
+    'trending_window_hours': 24,      # 小时窗口桶数(最近一天)
+    'trending_day_weight': 0.1,       # 小时窗口计数的权重
+    'trending_favorite_weight': 5.0,  # 一次收藏相当于多少次浏览
+    'trending_top_k': 50              # 每个分类保留的热门商品数
+}
+
 # 拍卖配置
 AUCTION_CONFIG = {
     'min_duration_hours': 1,
@@ -47,7 +124,10 @@ AUCTION_CONFIG = {
 # 消息配置
 MESSAGE_CONFIG = {
     'max_content_length': 1000,
-    'supported_types': ['text', 'voice', 'image', 'emoji']
+    'supported_types': ['text', 'voice', 'image', 'emoji'],
+    'outbox_dispatch_interval': 1.0,  # 服务通知投递间隔(秒)
+    'outbox_batch_size': 200,         # 每批投递的通知数
+    'render_cache_size': 1024         # 服务消息渲染缓存条数(LRU)
 }
 
 # 安全配置
@@ -4,5 +4,6 @@ Database package for the Anime Shopping Mall System.
 """
 
 from .db_manager import DatabaseManager
+from .connection_pool import ConnectionPool
 
-__all__ = ['DatabaseManager']
+__all__ = ['DatabaseManager', 'ConnectionPool']
@@ -0,0 +1,237 @@
+"""
+Connection Pool - SQLite 连接池
+复用已打开的数据库连接,避免每次操作都重新建立连接并执行 PRAGMA
+"""
+
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from utils.exceptions import DatabaseConnectionError
+
+
+class ConnectionPool:
+    """
+    线程安全的 SQLite 连接池
+
+    - 连接以 check_same_thread=False 打开,可在线程间安全地借出/归还
+    - 空闲连接按后进先出复用,最近使用过的连接优先(页缓存更热)
+    - 借出前对空闲过久的连接做健康检查,失效连接自动丢弃并重建
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 5,
+                 connect_timeout: float = 5.0,
+                 acquire_timeout: float = 10.0,
+                 health_check_interval: float = 30.0,
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None):
+        """
+        初始化连接池
+
+        Args:
+            db_path: 数据库文件路径
+            pool_size: 最大连接数
+            connect_timeout: 连接等待数据库锁的秒数(sqlite3.connect 的 timeout)
+            acquire_timeout: 连接池耗尽时等待空闲连接的最长秒数
+            health_check_interval: 空闲超过该秒数的连接在借出前执行健康检查
+            on_connect: 新建连接后的初始化回调(设置 PRAGMA 等)
+        """
+        if pool_size < 1:
+            raise ValueError("pool_size 必须大于 0")
+
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._on_connect = on_connect
+
+        # 空闲连接: (connection, 归还时间)
+        self._idle = deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._total = 0
+        self._closed = False
+
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'discarded': 0,
+            'acquires': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+            'peak_in_use': 0,
+        }
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """新建一个连接并执行初始化回调"""
+        conn = sqlite3.connect(self.db_path, timeout=self.connect_timeout,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # 使用Row对象,支持按列名访问
+        conn.execute("PRAGMA foreign_keys = ON;")
+        if self._on_connect:
+            self._on_connect(conn)
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        """执行轻量查询确认连接可用"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        借出一个连接
+
+        Returns:
+            sqlite3.Connection: 数据库连接
+
+        Raises:
+            DatabaseConnectionError: 连接池已关闭或等待超时
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise DatabaseConnectionError("connection pool is closed")
+
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    needs_check = (time.monotonic() - released_at) >= self.health_check_interval
+                    break
+
+                if self._total < self.pool_size:
+                    # 先占位,连接在锁外创建
+                    self._total += 1
+                    conn = None
+                    needs_check = False
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise DatabaseConnectionError(
+                        f"connection pool exhausted (size={self.pool_size})"
+                    )
+                self._stats['waits'] += 1
+                self._cond.wait(remaining)
+
+        if conn is not None and needs_check:
+            healthy = self._is_healthy(conn)
+            with self._cond:
+                self._stats['health_checks'] += 1
+                if not healthy:
+                    self._stats['health_check_failures'] += 1
+                    self._stats['discarded'] += 1
+            if not healthy:
+                self._close_quietly(conn)
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self._create_connection()
+            except sqlite3.Error as e:
+                with self._cond:
+                    self._total -= 1
+                    self._cond.notify()
+                raise DatabaseConnectionError(str(e))
+            with self._cond:
+                self._stats['created'] += 1
+        else:
+            with self._cond:
+                self._stats['reused'] += 1
+
+        with self._cond:
+            self._stats['acquires'] += 1
+            in_use = self._total - len(self._idle)
+            if in_use > self._stats['peak_in_use']:
+                self._stats['peak_in_use'] = in_use
+        return conn
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False) -> None:
+        """
+        归还连接
+
+        Args:
+            conn: 借出的连接
+            discard: 为True时直接关闭该连接而不放回池中
+        """
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._total -= 1
+                self._stats['discarded'] += 1
+                close = True
+            else:
+                self._idle.append((conn, time.monotonic()))
+                close = False
+            self._cond.notify()
+
+        if close:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        借出连接的上下文管理器,退出时自动归还
+
+        Yields:
+            sqlite3.Connection: 数据库连接
+        """
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            # 连接级错误(如数据库文件被替换)时不再复用该连接
+            discard = not self._is_healthy(conn)
+            raise e
+        finally:
+            self.release(conn, discard=discard)
+
+    def close_all(self) -> None:
+        """关闭连接池及所有空闲连接,借出中的连接归还时关闭"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+            self._stats['discarded'] += len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def get_stats(self) -> Dict:
+        """
+        获取连接池统计信息
+
+        Returns:
+            Dict: 包含连接数、复用次数、等待次数、健康检查等统计
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pool_size'] = self.pool_size
+            stats['total'] = self._total
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._total - len(self._idle)
+            stats['closed'] = self._closed
+        return stats
@@ -5,9 +5,15 @@ Database Manager - 数据库管理器
 
 import sqlite3
 import os
-from typing import Optional, List, Dict, Any
+import threading
+from typing import Optional, List, Dict, Any, Callable
 from contextlib import contextmanager
 
+from config.settings import DATABASE_CONFIG
+from .connection_pool import ConnectionPool
+from .pragmas import resolve_profile, apply_pragmas, WalCheckpointer
+from .migrations import run_migrations, get_current_version, LATEST_VERSION
+
 
 class DatabaseManager:
     """
@@ -15,12 +21,15 @@ class DatabaseManager:
     使用SQLite作为数据库(可根据需要更换为MySQL/PostgreSQL等)
     """
     
-    def __init__(self, db_path: str = "anime_mall.db"):
+    def __init__(self, db_path: str = "anime_mall.db", pool_size: Optional[int] = None,
+                 profile: Optional[str] = None):
         """
         初始化数据库管理器
         
         Args:
             db_path: 数据库文件路径
+            pool_size: 连接池大小,默认读取 DATABASE_CONFIG['pool_size']
+            profile: 性能档位名称,默认读取 DATABASE_CONFIG['profile']
         """
         # 如果是相对路径，将其放在 exp3 目录下
         if not os.path.isabs(db_path):
@@ -29,32 +38,189 @@ class DatabaseManager:
             db_path = os.path.join(base_dir, db_path)
         
         self.db_path = db_path
+        self.profile = resolve_profile(profile)
+        self.pool = ConnectionPool(
+            db_path,
+            pool_size=pool_size or DATABASE_CONFIG.get('pool_size', 5),
+            connect_timeout=DATABASE_CONFIG.get('timeout', 30),
+            acquire_timeout=DATABASE_CONFIG.get('pool_acquire_timeout', 10),
+            health_check_interval=DATABASE_CONFIG.get('pool_health_check_interval', 30),
+            on_connect=self._on_connect
+        )
+        self.checkpointer = None
+        # 每个线程当前进行中的事务: conn / depth
+        self._tx = threading.local()
         self.init_database()
+        
+        # WAL 模式下准备后台检查点,线程由长期运行的进程调用 start_checkpointer() 启动
+        if self.profile['journal_mode'] == 'WAL' and self.profile['checkpoint_interval'] > 0:
+            self.checkpointer = WalCheckpointer(
+                self.pool,
+                interval=self.profile['checkpoint_interval'],
+                mode=self.profile['checkpoint_mode']
+            )
+    
+    def start_checkpointer(self) -> None:
+        """
+        启动 WAL 后台检查点线程(非 WAL 档位或间隔为 0 时无操作)
+        
+        短时运行的脚本和测试依靠 wal_autocheckpoint 与 close() 时的检查点即可,
+        只有长期运行的进程(如命令行主程序)需要启动该线程。
+        """
+        if self.checkpointer:
+            self.checkpointer.start()
+    
+    def _on_connect(self, conn: sqlite3.Connection) -> None:
+        """新建连接的初始化: PRAGMA 档位"""
+        apply_pragmas(conn, self.profile)
     
     @contextmanager
     def get_connection(self):
         """
         获取数据库连接(上下文管理器)
+        连接从连接池借出,退出时提交(异常时回滚)并归还连接池;
+        当前线程处于 transaction() 中时直接加入该事务,由事务统一提交
         
         Yields:
             sqlite3.Connection: 数据库连接对象
         """
-        conn = sqlite3.connect(self.db_path)
-        conn.execute("PRAGMA foreign_keys = ON;")
-        conn.row_factory = sqlite3.Row  # 使用Row对象,支持按列名访问
-        try:
-            yield conn
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+        tx_conn = getattr(self._tx, 'conn', None)
+        if tx_conn is not None:
+            yield tx_conn
+            return
+        
+        with self.pool.connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+    
+    @contextmanager
+    def transaction(self, immediate: bool = True):
+        """
+        工作单元事务(上下文管理器)
+        
+        事务内通过 execute_* / get_connection 执行的所有语句共用同一连接,
+        退出时一次提交(一次 fsync),异常时整体回滚。
+        在同一线程中嵌套调用时使用 SAVEPOINT,内层异常只回滚内层的修改。
+        提交后依次执行事务中通过 on_commit() 注册的回调;
+        回滚到保存点时一并丢弃该保存点内注册的回调。
+        
+        Args:
+            immediate: 为True时以 BEGIN IMMEDIATE 开始,立即获取写锁,
+                       避免读锁升级写锁时出现 SQLITE_BUSY
+        
+        Yields:
+            sqlite3.Connection: 事务使用的连接
+        """
+        conn = getattr(self._tx, 'conn', None)
+        
+        if conn is not None:
+            # 嵌套事务: 使用保存点
+            self._tx.depth += 1
+            savepoint = f"sp_{self._tx.depth}"
+            conn.execute(f"SAVEPOINT {savepoint}")
+            self._tx.callbacks.append([])
+            try:
+                yield conn
+                conn.execute(f"RELEASE SAVEPOINT {savepoint}")
+            except BaseException:
+                conn.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                conn.execute(f"RELEASE SAVEPOINT {savepoint}")
+                self._tx.callbacks.pop()
+                raise
+            else:
+                # 保存点释放后,其中注册的回调随外层一起提交或回滚
+                self._tx.callbacks[-2].extend(self._tx.callbacks.pop())
+            finally:
+                self._tx.depth -= 1
+            return
+        
+        # 每层(事务 + 各级保存点)一个回调列表
+        self._tx.callbacks = [[]]
+        callbacks = self._tx.callbacks[0]
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            self._tx.conn = conn
+            self._tx.depth = 0
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._tx.conn = None
+        # 连接已归还,回调可以开启自己的事务
+        for callback in callbacks:
+            callback()
+    
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        """
+        注册在当前事务提交后执行的回调
+        
+        不在事务中时立即执行;事务回滚(或注册时所在的保存点回滚)时丢弃;
+        同一事务中重复注册的回调只执行一次。
+        
+        Args:
+            callback: 无参数的回调函数
+        """
+        if getattr(self._tx, 'conn', None) is None:
+            callback()
+        elif not any(callback in level for level in self._tx.callbacks):
+            self._tx.callbacks[-1].append(callback)
+    
+    def in_transaction(self) -> bool:
+        """
+        当前线程是否处于 transaction() 中
+        
+        Returns:
+            bool: 是否处于事务中
+        """
+        return getattr(self._tx, 'conn', None) is not None
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        获取连接池统计信息
+        
+        Returns:
+            Dict[str, Any]: 连接池统计
+        """
+        return self.pool.get_stats()
+    
+    def close(self) -> None:
+        """
+        关闭数据库管理器,停止后台检查点并释放连接池中的所有连接
+        """
+        if self.checkpointer:
+            self.checkpointer.stop()
+            self.checkpointer.checkpoint()
+        self.pool.close_all()
+    
+    def is_schema_current(self) -> bool:
+        """
+        检查数据库结构是否为最新版本
+        PRAGMA user_version 在完整初始化后记录为最新迁移版本,读取它只需访问文件头
+        
+        Returns:
+            bool: 结构是否最新
+        """
+        with self.pool.connection() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0] == LATEST_VERSION
     
-    def init_database(self) -> None:
+    def init_database(self, force: bool = False) -> None:
         """
         初始化数据库表结构
+        结构已是最新版本时直接返回,仅在首次启动或升级后执行建表和迁移
+        
+        Args:
+            force: 为True时忽略版本标记,强制完整初始化
         """
+        if not force and self.is_schema_current():
+            return
+        
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
@@ -262,13 +428,37 @@ class DatabaseManager:
                     FOREIGN KEY (product_id) REFERENCES products(product_id)
                 )
             ''')
+        
+        # 执行未完成的版本迁移(索引、字段变更等)
+        self.migrate()
+        
+        # 记录结构版本,下次启动走快速路径
+        with self.get_connection() as conn:
+            conn.execute(f"PRAGMA user_version = {LATEST_VERSION}")
+    
+    def migrate(self, verbose: bool = True) -> List[int]:
+        """
+        执行未完成的数据库迁移
+        
+        Args:
+            verbose: 是否打印执行信息
             
-            # 数据库迁移：添加 cancel_reject_reason 字段（如果不存在）
-            cursor.execute("PRAGMA table_info(orders)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'cancel_reject_reason' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN cancel_reject_reason TEXT")
-                print("✓ 已添加 cancel_reject_reason 字段到 orders 表")
+        Returns:
+            List[int]: 本次执行的迁移版本号
+        """
+        with self.pool.connection() as conn:
+            applied = run_migrations(conn, verbose=verbose)
+        return [m.version for m in applied]
+    
+    def get_schema_version(self) -> int:
+        """
+        获取当前数据库的迁移版本
+        
+        Returns:
+            int: 已执行的最高迁移版本
+        """
+        with self.get_connection() as conn:
+            return get_current_version(conn)
     
     def execute_query(self, query: str, params: tuple = ()) -> List[Dict]:
         """
@@ -319,6 +509,23 @@ class DatabaseManager:
             cursor.execute(query, params)
             return cursor.rowcount
     
+    def execute_returning(self, query: str, params: tuple = ()) -> List[Dict]:
+        """
+        执行带 RETURNING 子句的写语句并返回结果行
+        
+        Args:
+            query: INSERT/UPDATE/DELETE ... RETURNING 语句
+            params: 语句参数
+            
+        Returns:
+            List[Dict]: RETURNING 返回的行,未命中任何行时为空列表
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            return [dict(row) for row in rows]
+    
     def execute_delete(self, query: str, params: tuple = ()) -> int:
         """
         执行删除并返回受影响的行数
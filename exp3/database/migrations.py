@@ -0,0 +1,902 @@
+"""
+Schema Migrations - 数据库版本迁移
+按版本号顺序执行迁移步骤,已执行的版本记录在 schema_migrations 表中
+"""
+
+import sqlite3
+from typing import Callable, List
+
+from .text_search import index_messages, index_products
+
+
+class Migration:
+    """
+    迁移步骤
+
+    Attributes:
+        version (int): 版本号(严格递增)
+        name (str): 迁移名称
+        apply (Callable): 执行迁移的函数,参数为 sqlite3.Cursor
+    """
+
+    def __init__(self, version: int, name: str, apply: Callable[[sqlite3.Cursor], None]):
+        self.version = version
+        self.name = name
+        self.apply = apply
+
+    def __repr__(self) -> str:
+        return f"<Migration(version={self.version}, name={self.name})>"
+
+
+def _table_exists(cursor: sqlite3.Cursor, table: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cursor.fetchone() is not None
+
+
+def _columns(cursor: sqlite3.Cursor, table: str) -> List[str]:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+# ============ 迁移步骤 ============
+
+def _merge_sellers_into_users(cursor: sqlite3.Cursor) -> None:
+    """移除 sellers 表,将 seller 信息合并到 users 表,并把 seller_id 改为 user_id"""
+    columns = _columns(cursor, 'users')
+    if 'shop_name' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN shop_name TEXT")
+    if 'rating' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN rating REAL DEFAULT 5.0")
+    if 'total_sales' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN total_sales INTEGER DEFAULT 0")
+
+    # 新建的数据库没有 sellers 表,无需迁移数据
+    if not _table_exists(cursor, 'sellers'):
+        return
+
+    cursor.execute("""
+        UPDATE users
+        SET shop_name = (SELECT s.shop_name FROM sellers s WHERE s.user_id = users.user_id),
+            rating = (SELECT s.rating FROM sellers s WHERE s.user_id = users.user_id),
+            total_sales = (SELECT s.total_sales FROM sellers s WHERE s.user_id = users.user_id),
+            role = 'seller'
+        WHERE user_id IN (SELECT user_id FROM sellers)
+    """)
+
+    # 重建 products 表(seller_id 改为 user_id)
+    cursor.execute("""
+        CREATE TABLE products_new (
+            product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seller_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            price REAL NOT NULL,
+            category TEXT NOT NULL,
+            images TEXT,
+            stock INTEGER DEFAULT 1,
+            status TEXT DEFAULT 'available',
+            auctionable BOOLEAN DEFAULT 0,
+            view_count INTEGER DEFAULT 0,
+            favorite_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (seller_id) REFERENCES users(user_id)
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO products_new
+        SELECT p.product_id, s.user_id, p.title, p.description, p.price, p.category,
+               p.images, p.stock, p.status, p.auctionable, p.view_count,
+               p.favorite_count, p.created_at, p.updated_at
+        FROM products p
+        LEFT JOIN sellers s ON p.seller_id = s.seller_id
+    """)
+    cursor.execute("DROP TABLE products")
+    cursor.execute("ALTER TABLE products_new RENAME TO products")
+
+    # 重建 orders 表
+    cursor.execute("""
+        CREATE TABLE orders_new (
+            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            buyer_id INTEGER NOT NULL,
+            seller_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER DEFAULT 1,
+            total_price REAL NOT NULL,
+            status TEXT DEFAULT 'pending',
+            shipping_address TEXT NOT NULL,
+            tracking_number TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            paid_at TIMESTAMP,
+            shipped_at TIMESTAMP,
+            completed_at TIMESTAMP,
+            FOREIGN KEY (buyer_id) REFERENCES users(user_id),
+            FOREIGN KEY (seller_id) REFERENCES users(user_id),
+            FOREIGN KEY (product_id) REFERENCES products(product_id)
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO orders_new
+        SELECT o.order_id, o.buyer_id, s.user_id, o.product_id, o.quantity,
+               o.total_price, o.status, o.shipping_address, o.tracking_number,
+               o.created_at, o.paid_at, o.shipped_at, o.completed_at
+        FROM orders o
+        LEFT JOIN sellers s ON o.seller_id = s.seller_id
+    """)
+    cursor.execute("DROP TABLE orders")
+    cursor.execute("ALTER TABLE orders_new RENAME TO orders")
+
+    # 重建 auctions 表
+    cursor.execute("""
+        CREATE TABLE auctions_new (
+            auction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER UNIQUE NOT NULL,
+            seller_id INTEGER NOT NULL,
+            start_price REAL NOT NULL,
+            current_bid REAL NOT NULL,
+            current_bidder_id INTEGER,
+            bid_increment REAL DEFAULT 1.0,
+            start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_time TIMESTAMP NOT NULL,
+            status TEXT DEFAULT 'active',
+            FOREIGN KEY (product_id) REFERENCES products(product_id),
+            FOREIGN KEY (seller_id) REFERENCES users(user_id),
+            FOREIGN KEY (current_bidder_id) REFERENCES users(user_id)
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO auctions_new
+        SELECT a.auction_id, a.product_id, s.user_id, a.start_price, a.current_bid,
+               a.current_bidder_id, a.bid_increment, a.start_time, a.end_time, a.status
+        FROM auctions a
+        LEFT JOIN sellers s ON a.seller_id = s.seller_id
+    """)
+    cursor.execute("DROP TABLE auctions")
+    cursor.execute("ALTER TABLE auctions_new RENAME TO auctions")
+
+    cursor.execute("DROP TABLE sellers")
+
+
+def _add_order_reject_reasons(cursor: sqlite3.Cursor) -> None:
+    """为 orders 表添加 refund_reject_reason / cancel_reject_reason 字段"""
+    columns = _columns(cursor, 'orders')
+    if 'refund_reject_reason' not in columns:
+        cursor.execute("ALTER TABLE orders ADD COLUMN refund_reject_reason TEXT")
+    if 'cancel_reject_reason' not in columns:
+        cursor.execute("ALTER TABLE orders ADD COLUMN cancel_reject_reason TEXT")
+
+
+# 服务层查询对应的索引,列顺序与 WHERE 等值条件 + ORDER BY 一致
+_HOT_PATH_INDEXES = [
+    # OrderService.get_orders_by_buyer / get_orders_by_seller / get_order_statistics
+    # (不按状态筛选时使用 (用户, status) 前缀,单个用户的订单不多,排序代价很小)
+    "CREATE INDEX IF NOT EXISTS idx_orders_buyer_status_created ON orders (buyer_id, status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_seller_status_created ON orders (seller_id, status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_product ON orders (product_id)",
+    # ProductService.search_products / get_all_categories
+    "CREATE INDEX IF NOT EXISTS idx_products_status_created ON products (status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_products_status_category ON products (status, category)",
+    # ProductService.get_products_by_category 的各排序方式
+    "CREATE INDEX IF NOT EXISTS idx_products_category_status_created ON products (category, status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_products_category_status_price ON products (category, status, price)",
+    "CREATE INDEX IF NOT EXISTS idx_products_category_status_popular "
+    "ON products (category, status, view_count, favorite_count)",
+    # ProductService.get_products_by_seller
+    "CREATE INDEX IF NOT EXISTS idx_products_seller_status_created ON products (seller_id, status, created_at)",
+    # MessageService.search_messages 的 LIKE 兜底(sender_id=? 分支;接收方向使用迁移 9 的索引)
+    "CREATE INDEX IF NOT EXISTS idx_messages_sender_created ON messages (sender_id, created_at)",
+    # ProductService.get_favorite_products
+    "CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_favorites_product ON favorites (product_id)",
+    # 关注 / 举报 / 拍卖
+    "CREATE INDEX IF NOT EXISTS idx_follows_following ON follows (following_id)",
+    "CREATE INDEX IF NOT EXISTS idx_reports_status_created ON reports (status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_auctions_status_end ON auctions (status, end_time)",
+    "CREATE INDEX IF NOT EXISTS idx_bid_history_auction_time ON bid_history (auction_id, bid_time)",
+]
+
+
+def _create_hot_path_indexes(cursor: sqlite3.Cursor) -> None:
+    """为服务层热点查询创建复合索引"""
+    for statement in _HOT_PATH_INDEXES:
+        cursor.execute(statement)
+    cursor.execute("ANALYZE")
+
+
+def rebuild_user_order_stats(cursor: sqlite3.Cursor) -> None:
+    """按 orders 表全量重建 user_order_stats 计数表"""
+    cursor.execute("DELETE FROM user_order_stats")
+    for role in ('buyer', 'seller'):
+        cursor.execute(f"""
+            INSERT INTO user_order_stats (user_id, role, status, order_count, total_amount)
+            SELECT {role}_id, '{role}', status, COUNT(*), COALESCE(SUM(total_price), 0)
+            FROM orders
+            GROUP BY {role}_id, status
+        """)
+
+
+def _create_user_order_stats(cursor: sqlite3.Cursor) -> None:
+    """创建按 用户/角色/状态 维护的订单计数表,由 orders 表上的触发器增量更新"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_order_stats (
+            user_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            status TEXT NOT NULL,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            total_amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, role, status)
+        ) WITHOUT ROWID
+    """)
+
+    def upsert(role: str, row: str, sign: str) -> str:
+        return f"""
+            INSERT INTO user_order_stats (user_id, role, status, order_count, total_amount)
+            VALUES ({row}.{role}_id, '{role}', {row}.status, {sign}1, {sign}{row}.total_price)
+            ON CONFLICT (user_id, role, status) DO UPDATE SET
+                order_count = order_count + excluded.order_count,
+                total_amount = total_amount + excluded.total_amount;
+        """
+
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_orders_stats_insert AFTER INSERT ON orders
+        BEGIN
+            {upsert('buyer', 'NEW', '')}
+            {upsert('seller', 'NEW', '')}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_orders_stats_update
+        AFTER UPDATE OF status, total_price, buyer_id, seller_id ON orders
+        BEGIN
+            {upsert('buyer', 'OLD', '-')}
+            {upsert('seller', 'OLD', '-')}
+            {upsert('buyer', 'NEW', '')}
+            {upsert('seller', 'NEW', '')}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_orders_stats_delete AFTER DELETE ON orders
+        BEGIN
+            {upsert('buyer', 'OLD', '-')}
+            {upsert('seller', 'OLD', '-')}
+        END
+    """)
+    rebuild_user_order_stats(cursor)
+
+
+def _create_products_fts(cursor: sqlite3.Cursor) -> None:
+    """
+    创建商品标题/描述的 FTS5 全文索引(外部内容表,由触发器与 products 同步)
+
+    SQLite 未编译 FTS5 时跳过,ProductService.search_products 会退回 LIKE 查询。
+    """
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                title, description,
+                content='products', content_rowid='product_id',
+                tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"⚠ 当前 SQLite 不支持 FTS5 trigram,商品搜索将使用 LIKE: {e}")
+        return
+    # 标题权重高于描述
+    cursor.execute("INSERT INTO products_fts (products_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO products_fts (rowid, title, description)
+            VALUES (NEW.product_id, NEW.title, NEW.description);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, title, description)
+            VALUES ('delete', OLD.product_id, OLD.title, OLD.description);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_update AFTER UPDATE OF title, description ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, title, description)
+            VALUES ('delete', OLD.product_id, OLD.title, OLD.description);
+            INSERT INTO products_fts (rowid, title, description)
+            VALUES (NEW.product_id, NEW.title, NEW.description);
+        END
+    """)
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+
+def _rebuild_products_fts_cjk(cursor: sqlite3.Cursor) -> None:
+    """
+    以 cjk_tokens() 分词重建商品全文索引(替换 trigram 索引,支持 1~2 字检索)
+
+    索引表保存分词后的文本,新增/修改商品时由 ProductService 分词后写入
+    (见 database/text_search.py)。这里不建调用 Python 函数的触发器,
+    否则未注册该函数的连接(sqlite3 命令行、外部脚本)写入商品会因 "no such function" 失败;
+    删除商品的触发器不分词,由数据库维护。
+    """
+    for trigger in ('trg_products_fts_insert', 'trg_products_fts_delete', 'trg_products_fts_update'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute("DROP TABLE IF EXISTS products_fts")
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE products_fts USING fts5(
+                title, description, tokenize='unicode61'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"⚠ 当前 SQLite 不支持 FTS5,商品搜索将使用 LIKE: {e}")
+        return
+    cursor.execute("INSERT INTO products_fts (products_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+    cursor.execute("""
+        CREATE TRIGGER trg_products_fts_delete AFTER DELETE ON products
+        BEGIN
+            DELETE FROM products_fts WHERE rowid = OLD.product_id;
+        END
+    """)
+    cursor.execute("SELECT product_id, title, description FROM products")
+    index_products(cursor.connection, cursor.fetchall())
+
+
+def _create_messages_fts(cursor: sqlite3.Cursor) -> None:
+    """
+    创建私信全文索引(服务消息为 JSON 模板,不建索引)
+
+    participants 列写入 "u<发送者> u<接收者>" 两个词,检索时与关键词做 AND,
+    FTS5 只需求该用户倒排列表与关键词倒排列表的交集,不会触及其他用户的消息。
+    索引行由 MessageService 与 NotificationDispatcher 写入消息时分词写入
+    (不建调用 Python 函数的触发器,原因同迁移 6)。
+    """
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content, participants, tokenize='unicode61'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"⚠ 当前 SQLite 不支持 FTS5,消息搜索将使用 LIKE: {e}")
+        return
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_messages_fts_delete AFTER DELETE ON messages
+        BEGIN
+            DELETE FROM messages_fts WHERE rowid = OLD.msg_id;
+        END
+    """)
+    cursor.execute("SELECT msg_id, content, sender_id, receiver_id FROM messages WHERE msg_type IS NOT 'service'")
+    index_messages(cursor.connection, cursor.fetchall())
+
+
+def _create_conversations(cursor: sqlite3.Cursor) -> None:
+    """
+    创建会话摘要表: 每对用户一行(user_lo < user_hi),记录最后一条消息、最后活跃时间
+    和双方各自的未读数,由 messages 表上的触发器维护,收件箱只需按用户做索引范围读取
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_lo INTEGER NOT NULL,
+            user_hi INTEGER NOT NULL,
+            last_message_id INTEGER,
+            last_activity TIMESTAMP,
+            unread_lo INTEGER NOT NULL DEFAULT 0,
+            unread_hi INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_lo, user_hi)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_lo_activity "
+                   "ON conversations (user_lo, last_activity)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_hi_activity "
+                   "ON conversations (user_hi, last_activity)")
+
+    # 会话键与"接收方是否为 user_lo"
+    pair = ("user_lo = MIN({m}.sender_id, {m}.receiver_id) "
+            "AND user_hi = MAX({m}.sender_id, {m}.receiver_id)")
+    to_lo = "{m}.receiver_id = MIN({m}.sender_id, {m}.receiver_id)"
+
+    new_pair, old_pair = pair.format(m='NEW'), pair.format(m='OLD')
+    new_to_lo, old_to_lo = to_lo.format(m='NEW'), to_lo.format(m='OLD')
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_conversations_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO conversations (user_lo, user_hi, last_message_id, last_activity, unread_lo, unread_hi)
+            VALUES (
+                MIN(NEW.sender_id, NEW.receiver_id), MAX(NEW.sender_id, NEW.receiver_id),
+                NEW.msg_id, NEW.created_at,
+                NEW.status IS NOT 'read' AND {new_to_lo},
+                NEW.status IS NOT 'read' AND NOT ({new_to_lo})
+            )
+            ON CONFLICT (user_lo, user_hi) DO UPDATE SET
+                last_activity = CASE WHEN excluded.last_message_id > last_message_id
+                                     THEN excluded.last_activity ELSE last_activity END,
+                last_message_id = MAX(last_message_id, excluded.last_message_id),
+                unread_lo = unread_lo + excluded.unread_lo,
+                unread_hi = unread_hi + excluded.unread_hi;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_conversations_status AFTER UPDATE OF status ON messages
+        WHEN (OLD.status IS 'read') <> (NEW.status IS 'read')
+        BEGIN
+            UPDATE conversations SET
+                unread_lo = unread_lo + CASE WHEN {new_to_lo}
+                    THEN CASE WHEN NEW.status IS 'read' THEN -1 ELSE 1 END ELSE 0 END,
+                unread_hi = unread_hi + CASE WHEN NOT ({new_to_lo})
+                    THEN CASE WHEN NEW.status IS 'read' THEN -1 ELSE 1 END ELSE 0 END
+            WHERE {new_pair};
+        END
+    """)
+    last_id = (
+        "NULLIF(MAX("
+        "COALESCE((SELECT MAX(msg_id) FROM messages WHERE sender_id = user_lo AND receiver_id = user_hi), 0), "
+        "COALESCE((SELECT MAX(msg_id) FROM messages WHERE sender_id = user_hi AND receiver_id = user_lo), 0)"
+        "), 0)"
+    )
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_conversations_delete AFTER DELETE ON messages
+        BEGIN
+            UPDATE conversations SET
+                unread_lo = unread_lo - (OLD.status IS NOT 'read' AND {old_to_lo}),
+                unread_hi = unread_hi - (OLD.status IS NOT 'read' AND NOT ({old_to_lo}))
+            WHERE {old_pair};
+            UPDATE conversations SET last_message_id = {last_id}
+            WHERE {old_pair} AND last_message_id = OLD.msg_id;
+            UPDATE conversations
+            SET last_activity = (SELECT created_at FROM messages WHERE msg_id = last_message_id)
+            WHERE {old_pair} AND last_message_id IS NOT NULL AND last_message_id < OLD.msg_id;
+            DELETE FROM conversations WHERE {old_pair} AND last_message_id IS NULL;
+        END
+    """)
+
+    # 回填已有消息
+    cursor.execute("DELETE FROM conversations")
+    cursor.execute("""
+        INSERT INTO conversations (user_lo, user_hi, last_message_id, unread_lo, unread_hi)
+        SELECT MIN(sender_id, receiver_id), MAX(sender_id, receiver_id), MAX(msg_id),
+               SUM(status IS NOT 'read' AND receiver_id = MIN(sender_id, receiver_id)),
+               SUM(status IS NOT 'read' AND receiver_id <> MIN(sender_id, receiver_id))
+        FROM messages
+        GROUP BY MIN(sender_id, receiver_id), MAX(sender_id, receiver_id)
+    """)
+    cursor.execute("""
+        UPDATE conversations
+        SET last_activity = (SELECT created_at FROM messages WHERE msg_id = last_message_id)
+    """)
+
+
+def _add_read_watermarks(cursor: sqlite3.Cursor) -> None:
+    """
+    为会话增加已读水位 last_read_lo / last_read_hi(该方已读到的最大消息ID)
+
+    已读状态不再逐条写入 messages.status: 标记已读只推进水位并重算该方未读数,
+    未读数 = 对方发来且 msg_id 大于水位的消息数,可在 (receiver_id, sender_id) 索引上按 rowid 范围计数。
+    回填时水位取该方第一条未读消息之前的位置。
+    """
+    columns = _columns(cursor, 'conversations')
+    for side in ('lo', 'hi'):
+        if f'last_read_{side}' not in columns:
+            cursor.execute(f"ALTER TABLE conversations ADD COLUMN last_read_{side} INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_receiver_sender ON messages (receiver_id, sender_id)")
+
+    for side, me, peer in (('lo', 'user_lo', 'user_hi'), ('hi', 'user_hi', 'user_lo')):
+        cursor.execute(f"""
+            UPDATE conversations SET last_read_{side} = COALESCE(
+                (SELECT MIN(msg_id) - 1 FROM messages
+                 WHERE receiver_id = {me} AND sender_id = {peer} AND status IS NOT 'read'),
+                last_message_id
+            )
+        """)
+        cursor.execute(f"""
+            UPDATE conversations SET unread_{side} = (
+                SELECT COUNT(*) FROM messages
+                WHERE receiver_id = {me} AND sender_id = {peer} AND msg_id > last_read_{side}
+            )
+        """)
+
+    # 未读数改由水位决定: 删除按 status 维护的触发器,删除消息时按水位判断是否扣减
+    cursor.execute("DROP TRIGGER IF EXISTS trg_conversations_status")
+    cursor.execute("DROP TRIGGER IF EXISTS trg_conversations_delete")
+    pair = ("user_lo = MIN(OLD.sender_id, OLD.receiver_id) "
+            "AND user_hi = MAX(OLD.sender_id, OLD.receiver_id)")
+    to_lo = "OLD.receiver_id = MIN(OLD.sender_id, OLD.receiver_id)"
+    last_id = (
+        "NULLIF(MAX("
+        "COALESCE((SELECT MAX(msg_id) FROM messages WHERE sender_id = user_lo AND receiver_id = user_hi), 0), "
+        "COALESCE((SELECT MAX(msg_id) FROM messages WHERE sender_id = user_hi AND receiver_id = user_lo), 0)"
+        "), 0)"
+    )
+    cursor.execute(f"""
+        CREATE TRIGGER trg_conversations_delete AFTER DELETE ON messages
+        BEGIN
+            UPDATE conversations SET
+                unread_lo = unread_lo - ({to_lo} AND OLD.msg_id > last_read_lo),
+                unread_hi = unread_hi - (NOT ({to_lo}) AND OLD.msg_id > last_read_hi)
+            WHERE {pair};
+            UPDATE conversations SET last_message_id = {last_id}
+            WHERE {pair} AND last_message_id = OLD.msg_id;
+            UPDATE conversations
+            SET last_activity = (SELECT created_at FROM messages WHERE msg_id = last_message_id)
+            WHERE {pair} AND last_message_id IS NOT NULL AND last_message_id < OLD.msg_id;
+            DELETE FROM conversations WHERE {pair} AND last_message_id IS NULL;
+        END
+    """)
+
+
+def _create_notification_outbox(cursor: sqlite3.Cursor) -> None:
+    """创建服务通知发件箱: 订单状态变更时在同一事务中写入,由后台投递到 messages"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER NOT NULL,
+            receiver_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            msg_type TEXT NOT NULL DEFAULT 'service',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+# 迁移 11 登记的服务消息模板(迁移时 zh_CN 中的 service_* 键及其占位符顺序),
+# 已写入的消息按这些ID编码,因此不随翻译文件变化
+_SERVICE_TEMPLATES_V11 = [
+    ('order.service_order_created', 'order_id'),
+    ('order.service_order_paid', 'order_id'),
+    ('order.service_order_shipped', 'order_id,tracking_number'),
+    ('order.service_order_completed', 'order_id'),
+    ('order.service_refund_requested', 'order_id,reason'),
+    ('order.service_refund_approved', 'order_id'),
+    ('order.service_refund_rejected', 'order_id,reason_text'),
+    ('order.service_cancel_requested', 'order_id,reason'),
+    ('order.service_cancel_approved', 'order_id'),
+    ('order.service_cancel_rejected', 'order_id,reason_text'),
+]
+
+
+def _create_message_templates(cursor: sqlite3.Cursor) -> None:
+    """
+    服务消息模板表: 以小整数ID引用 translations.json 中的服务消息键
+    
+    服务消息的 content 由 {"key": ..., "params": {...}} 形式的 JSON 改为
+    "<模板ID>\\x1f<参数1>\\x1f<参数2>..." 的紧凑格式(见 models/message.py),
+    参数顺序即 param_names 中记录的占位符顺序。已有的服务消息与待投递通知一并改写。
+    迁移只使用本文件中的常量,不依赖之后可能变化的翻译文件与模型代码。
+    """
+    import json
+
+    sep = '\x1f'
+
+    def pack(template_id: int, values: list) -> str:
+        fields = [str(template_id)]
+        fields.extend('' if v is None else str(v).replace(sep, ' ') for v in values)
+        return sep.join(fields)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS message_templates (
+            template_id INTEGER PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE,
+            param_names TEXT NOT NULL DEFAULT ''
+        )
+    """)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO message_templates (key, param_names) VALUES (?, ?)",
+        _SERVICE_TEMPLATES_V11
+    )
+
+    cursor.execute("SELECT key, template_id, param_names FROM message_templates")
+    templates = {key: (tid, names.split(',') if names else []) for key, tid, names in cursor.fetchall()}
+
+    for table, id_column in (('messages', 'msg_id'), ('notification_outbox', 'outbox_id')):
+        cursor.execute(f"SELECT {id_column}, content FROM {table} WHERE msg_type='service'")
+        updates = []
+        for row_id, content in cursor.fetchall():
+            try:
+                data = json.loads(content)
+                key, params = data['key'], data.get('params') or {}
+            except (ValueError, TypeError, KeyError):
+                continue
+            if key not in templates:
+                names = list(params)
+                cursor.execute(
+                    "INSERT INTO message_templates (key, param_names) VALUES (?, ?)",
+                    (key, ','.join(names))
+                )
+                templates[key] = (cursor.lastrowid, names)
+            tid, names = templates[key]
+            updates.append((pack(tid, [params.get(n) for n in names]), row_id))
+        cursor.executemany(f"UPDATE {table} SET content=? WHERE {id_column}=?", updates)
+
+
+def rebuild_popularity_scores(cursor: sqlite3.Cursor, weights: dict = None) -> None:
+    """
+    按当前计数与权重全量重算 products.popularity_score
+
+    Args:
+        cursor: 数据库游标
+        weights: 新的权重 {'views', 'favorites', 'sales'},为空时沿用 popularity_weights 表中的权重
+    """
+    if weights is not None:
+        cursor.execute(
+            "UPDATE popularity_weights SET views = ?, favorites = ?, sales = ? WHERE id = 1",
+            (weights['views'], weights['favorites'], weights['sales'])
+        )
+    cursor.execute(f"UPDATE products SET popularity_score = {_POPULARITY_EXPR.format(row='products')}")
+
+
+# 热度 = 浏览数 × views + 收藏数 × favorites + 成交件数 × sales
+_POPULARITY_EXPR = (
+    "{row}.view_count * (SELECT views FROM popularity_weights WHERE id = 1)"
+    " + {row}.favorite_count * (SELECT favorites FROM popularity_weights WHERE id = 1)"
+    " + {row}.sales_count * (SELECT sales FROM popularity_weights WHERE id = 1)"
+)
+
+
+def _create_popularity_score(cursor: sqlite3.Cursor) -> None:
+    """
+    为 "最受欢迎" 排序维护 products.popularity_score 列及 (category, status, popularity_score) 索引
+
+    成交件数 sales_count 由 orders 表上的触发器在订单进入/离开 completed 状态时增减;
+    浏览、收藏、成交计数变化时由 products 上的触发器只重算该商品的热度。
+    权重保存在单行表 popularity_weights 中,初始值为迁移时 PRODUCT_CONFIG['popularity_weights']
+    的取值;之后修改配置需运行 scripts/rebuild_popularity.py 写入新权重并重算。
+    """
+    columns = _columns(cursor, 'products')
+    if 'sales_count' not in columns:
+        cursor.execute("ALTER TABLE products ADD COLUMN sales_count INTEGER NOT NULL DEFAULT 0")
+    if 'popularity_score' not in columns:
+        cursor.execute("ALTER TABLE products ADD COLUMN popularity_score REAL NOT NULL DEFAULT 0")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS popularity_weights (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            views REAL NOT NULL,
+            favorites REAL NOT NULL,
+            sales REAL NOT NULL
+        )
+    """)
+    weights = {'views': 1.0, 'favorites': 5.0, 'sales': 20.0}
+    cursor.execute(
+        "INSERT OR IGNORE INTO popularity_weights (id, views, favorites, sales) VALUES (1, ?, ?, ?)",
+        (weights['views'], weights['favorites'], weights['sales'])
+    )
+
+    cursor.execute("""
+        UPDATE products SET sales_count = COALESCE((
+            SELECT SUM(quantity) FROM orders o
+            WHERE o.product_id = products.product_id AND o.status = 'completed'
+        ), 0)
+    """)
+
+    def adjust_sales(row: str, sign: str) -> str:
+        return (f"UPDATE products SET sales_count = sales_count {sign} {row}.quantity "
+                f"WHERE product_id = {row}.product_id AND {row}.status = 'completed';")
+
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_orders_sales_insert AFTER INSERT ON orders
+        WHEN NEW.status = 'completed'
+        BEGIN
+            {adjust_sales('NEW', '+')}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_orders_sales_update
+        AFTER UPDATE OF status, quantity, product_id ON orders
+        WHEN OLD.status = 'completed' OR NEW.status = 'completed'
+        BEGIN
+            {adjust_sales('OLD', '-')}
+            {adjust_sales('NEW', '+')}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_orders_sales_delete AFTER DELETE ON orders
+        WHEN OLD.status = 'completed'
+        BEGIN
+            {adjust_sales('OLD', '-')}
+        END
+    """)
+
+    update_score = (f"UPDATE products SET popularity_score = {_POPULARITY_EXPR.format(row='NEW')} "
+                    f"WHERE product_id = NEW.product_id;")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_popularity_insert AFTER INSERT ON products
+        WHEN NEW.view_count <> 0 OR NEW.favorite_count <> 0 OR NEW.sales_count <> 0
+        BEGIN
+            {update_score}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_popularity_update
+        AFTER UPDATE OF view_count, favorite_count, sales_count ON products
+        BEGIN
+            {update_score}
+        END
+    """)
+
+    # 取代按 (view_count, favorite_count) 排序的旧索引
+    cursor.execute("DROP INDEX IF EXISTS idx_products_category_status_popular")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_category_status_popularity "
+        "ON products (category, status, popularity_score)"
+    )
+    rebuild_popularity_scores(cursor)
+    cursor.execute("ANALYZE products")
+
+
+# categories 表中按状态维护的商品计数列
+_CATEGORY_STATUS_COLUMNS = {
+    'available': 'available_count',
+    'sold_out': 'sold_out_count',
+    'removed': 'removed_count',
+    'in_auction': 'in_auction_count',
+}
+
+
+def rebuild_category_counts(cursor: sqlite3.Cursor) -> None:
+    """按 products 表全量重建 categories 表中的各状态商品计数"""
+    cursor.execute(
+        "UPDATE categories SET " + ', '.join(f"{c} = 0" for c in _CATEGORY_STATUS_COLUMNS.values())
+    )
+    # 不在目录中的已有分类按名称追加到末尾
+    cursor.execute("""
+        INSERT INTO categories (name, position)
+        SELECT category, (SELECT COALESCE(MAX(position), -1) FROM categories)
+                         + ROW_NUMBER() OVER (ORDER BY category)
+        FROM (SELECT DISTINCT category FROM products)
+        WHERE category NOT IN (SELECT name FROM categories)
+    """)
+    for status, column in _CATEGORY_STATUS_COLUMNS.items():
+        cursor.execute(f"""
+            UPDATE categories SET {column} = (
+                SELECT COUNT(*) FROM products p WHERE p.category = categories.name AND p.status = ?
+            )
+        """, (status,))
+
+
+# 迁移 13 登记的分类及顺序(迁移时的 PRODUCT_CATEGORIES)
+_CATEGORIES_V13 = [
+    '原神', '明日方舟', '崩坏:星穹铁道', '蓝色档案', 'Vtuber', '东方Project',
+    '舰队Collection', 'LoveLive!', 'BanG Dream!', 'Fate', '其他',
+]
+
+
+def _create_categories(cursor: sqlite3.Cursor) -> None:
+    """
+    创建分类目录表: 按迁移时 PRODUCT_CATEGORIES 的顺序登记分类,并按商品状态维护商品数
+
+    商品的新增、删除以及分类/状态变更由 products 表上的触发器增量更新计数;
+    不在上述列表中的分类在首次出现时追加到末尾。
+    """
+    counts = ',\n'.join(f"            {c} INTEGER NOT NULL DEFAULT 0" for c in _CATEGORY_STATUS_COLUMNS.values())
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS categories (
+            name TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+{counts}
+        ) WITHOUT ROWID
+    """)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO categories (name, position) VALUES (?, ?)",
+        [(name, i) for i, name in enumerate(_CATEGORIES_V13)]
+    )
+
+    def upsert(row: str, sign: str) -> str:
+        columns = ', '.join(_CATEGORY_STATUS_COLUMNS.values())
+        values = ', '.join(f"{sign}({row}.status = '{s}')" for s in _CATEGORY_STATUS_COLUMNS)
+        updates = ', '.join(f"{c} = {c} + excluded.{c}" for c in _CATEGORY_STATUS_COLUMNS.values())
+        return f"""
+            INSERT INTO categories (name, position, {columns})
+            VALUES ({row}.category, (SELECT COALESCE(MAX(position), -1) + 1 FROM categories), {values})
+            ON CONFLICT (name) DO UPDATE SET {updates};
+        """
+
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_categories_insert AFTER INSERT ON products
+        BEGIN
+            {upsert('NEW', '')}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_categories_update
+        AFTER UPDATE OF category, status ON products
+        WHEN OLD.category IS NOT NEW.category OR OLD.status IS NOT NEW.status
+        BEGIN
+            {upsert('OLD', '-')}
+            {upsert('NEW', '')}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_categories_delete AFTER DELETE ON products
+        BEGIN
+            {upsert('OLD', '-')}
+        END
+    """)
+    rebuild_category_counts(cursor)
+
+
+# 迁移列表,只允许在末尾追加新版本
+MIGRATIONS = [
+    Migration(1, 'merge_sellers_into_users', _merge_sellers_into_users),
+    Migration(2, 'add_order_reject_reasons', _add_order_reject_reasons),
+    Migration(3, 'hot_path_indexes', _create_hot_path_indexes),
+    Migration(4, 'user_order_stats', _create_user_order_stats),
+    Migration(5, 'products_fts', _create_products_fts),
+    Migration(6, 'products_fts_cjk', _rebuild_products_fts_cjk),
+    Migration(7, 'messages_fts', _create_messages_fts),
+    Migration(8, 'conversations', _create_conversations),
+    Migration(9, 'read_watermarks', _add_read_watermarks),
+    Migration(10, 'notification_outbox', _create_notification_outbox),
+    Migration(11, 'message_templates', _create_message_templates),
+    Migration(12, 'popularity_score', _create_popularity_score),
+    Migration(13, 'categories', _create_categories),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def ensure_migrations_table(conn: sqlite3.Connection) -> None:
+    """创建 schema_migrations 版本表"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def get_current_version(conn: sqlite3.Connection) -> int:
+    """
+    获取已执行的最高迁移版本
+
+    Returns:
+        int: 版本号,未执行过任何迁移时为0
+    """
+    ensure_migrations_table(conn)
+    row = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()
+    return int(row[0])
+
+
+def run_migrations(conn: sqlite3.Connection, verbose: bool = True) -> List[Migration]:
+    """
+    按版本顺序执行所有未执行的迁移
+
+    每个迁移在独立事务中执行,失败时回滚该迁移并抛出异常。
+    迁移期间临时关闭外键检查(重建表时 DROP TABLE 需要)。
+
+    Args:
+        conn: 数据库连接(不能处于事务中)
+        verbose: 是否打印执行信息
+
+    Returns:
+        List[Migration]: 本次执行的迁移
+    """
+    if conn.in_transaction:
+        conn.commit()
+    ensure_migrations_table(conn)
+    done = {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+    pending = [m for m in MIGRATIONS if m.version not in done]
+    if not pending:
+        return []
+
+    applied = []
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for migration in pending:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                migration.apply(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (?, ?)",
+                    (migration.version, migration.name)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(migration)
+            if verbose:
+                print(f"✓ 已执行数据库迁移 {migration.version}: {migration.name}")
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    return applied
@@ -0,0 +1,134 @@
+"""
+SQLite PRAGMA Profiles - SQLite 性能配置
+根据 DATABASE_CONFIG 选择的性能档位设置连接级 PRAGMA,并负责 WAL 后台检查点
+"""
+
+import sqlite3
+import threading
+from typing import Dict, Any, Optional
+
+from config.settings import DATABASE_CONFIG, DATABASE_PROFILES
+
+
+# 允许的 PRAGMA 取值,防止把任意字符串拼进 PRAGMA 语句
+_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+_SYNCHRONOUS_LEVELS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+_TEMP_STORES = {'DEFAULT', 'FILE', 'MEMORY'}
+_CHECKPOINT_MODES = {'PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'}
+
+
+def resolve_profile(name: Optional[str] = None,
+                    overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    解析性能档位
+
+    Args:
+        name: 档位名称,默认读取 DATABASE_CONFIG['profile']
+        overrides: 覆盖档位中个别设置
+
+    Returns:
+        Dict[str, Any]: 完整的 PRAGMA 设置
+
+    Raises:
+        ValueError: 档位不存在或设置取值非法
+    """
+    name = name or DATABASE_CONFIG.get('profile', 'balanced')
+    if name not in DATABASE_PROFILES:
+        raise ValueError(f"未知的数据库性能档位: {name}")
+
+    profile = dict(DATABASE_PROFILES[name])
+    profile.update(DATABASE_CONFIG.get('pragma_overrides') or {})
+    profile.update(overrides or {})
+
+    # 未显式配置 busy_timeout 时使用 DATABASE_CONFIG['timeout'](秒)
+    if profile.get('busy_timeout') is None:
+        profile['busy_timeout'] = int(float(DATABASE_CONFIG.get('timeout', 30)) * 1000)
+
+    for key, allowed in (('journal_mode', _JOURNAL_MODES),
+                         ('synchronous', _SYNCHRONOUS_LEVELS),
+                         ('temp_store', _TEMP_STORES),
+                         ('checkpoint_mode', _CHECKPOINT_MODES)):
+        value = str(profile[key]).upper()
+        if value not in allowed:
+            raise ValueError(f"非法的 {key} 取值: {profile[key]}")
+        profile[key] = value
+
+    for key in ('busy_timeout', 'cache_size', 'mmap_size', 'wal_autocheckpoint'):
+        profile[key] = int(profile[key])
+
+    profile['name'] = name
+    return profile
+
+
+def apply_pragmas(conn: sqlite3.Connection, profile: Dict[str, Any]) -> None:
+    """
+    在新建连接上应用档位中的 PRAGMA
+
+    Args:
+        conn: 数据库连接
+        profile: resolve_profile 返回的设置
+    """
+    conn.execute(f"PRAGMA busy_timeout = {profile['busy_timeout']}")
+    # journal_mode 是数据库级持久设置,已是目标模式时为空操作
+    conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {profile['cache_size']}")
+    conn.execute(f"PRAGMA mmap_size = {profile['mmap_size']}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+    conn.execute(f"PRAGMA wal_autocheckpoint = {profile['wal_autocheckpoint']}")
+
+
+class WalCheckpointer:
+    """
+    WAL 后台检查点线程
+    按固定间隔执行 wal_checkpoint,把 WAL 中的页写回主库,防止 WAL 文件无限增长
+    """
+
+    def __init__(self, pool, interval: float, mode: str = 'PASSIVE'):
+        """
+        初始化检查点线程
+
+        Args:
+            pool: 连接池(ConnectionPool)
+            interval: 检查点间隔秒数
+            mode: 检查点模式(PASSIVE/FULL/RESTART/TRUNCATE)
+        """
+        self.pool = pool
+        self.interval = interval
+        self.mode = mode
+        self.runs = 0
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='wal-checkpointer', daemon=True)
+
+    def start(self) -> None:
+        """启动检查点线程(重复调用无操作)"""
+        if self._thread.ident is None:
+            self._thread.start()
+
+    def checkpoint(self) -> Optional[tuple]:
+        """
+        立即执行一次检查点
+
+        Returns:
+            Optional[tuple]: (busy, wal页数, 已写回页数),失败返回None
+        """
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute(f"PRAGMA wal_checkpoint({self.mode})").fetchone()
+        except Exception as e:
+            print(f"WAL检查点失败: {str(e)}")
+            return None
+        self.runs += 1
+        self.last_result = tuple(row) if row else None
+        return self.last_result
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.checkpoint()
+
+    def stop(self) -> None:
+        """停止检查点线程"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=self.interval + 1)
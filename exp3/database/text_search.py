@@ -0,0 +1,188 @@
+"""
+Text Search - 全文检索分词
+面向中日韩文本的 n-gram 分词,由服务层写入 FTS5 索引时调用,查询时共用同样的规则
+
+FTS5 内置的 unicode61 分词器把连续的汉字/假名视为一个词,无法检索标题中间的片段;
+Python 标准库的 sqlite3 又不能注册自定义 FTS5 分词器。因此写入索引前先用
+cjk_tokens() 把文本转换为空格分隔的词序列,再交给 unicode61 按空格切分:
+
+- 中日韩连续字符切为重叠的二元组,并在末尾补一个单字: "星穹铁道" -> "星穹 穹铁 铁道 道"
+- 拉丁字母/数字按词切分
+- 统一做 NFKC 归一化(全角转半角、半角片假名转全角)与大小写折叠
+
+查询时对关键词做同样的处理: 多字片段转为二元组短语(相邻即子串匹配),
+单字与拉丁词使用前缀匹配。
+"""
+
+import re
+import sqlite3
+import unicodedata
+from typing import Iterable, List, Optional, Tuple
+
+# 平假名/片假名、CJK 扩展 A、CJK 统一表意文字、兼容表意文字、谚文音节
+_CJK = '぀-ヿㇰ-ㇿ㐀-䶿一-鿿豈-﫿가-힯'
+_TOKEN_RE = re.compile(f"([{_CJK}]+)|([^\\W_{_CJK}]+)")
+
+
+def normalize(text: str) -> str:
+    """
+    检索文本归一化: NFKC(全角转半角) + 大小写折叠
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        str: 归一化后的文本
+    """
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+def _split(text: str):
+    """按 (是否中日韩, 片段) 依次返回文本中的连续片段"""
+    for match in _TOKEN_RE.finditer(normalize(text)):
+        if match.group(1):
+            yield True, match.group(1)
+        else:
+            yield False, match.group(2)
+
+
+def _bigrams(run: str) -> List[str]:
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def cjk_tokens(text: Optional[str]) -> str:
+    """
+    将文本转换为索引用的词序列
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        str: 空格分隔的词
+    """
+    if not text:
+        return ''
+    tokens = []
+    for is_cjk, run in _split(text):
+        if is_cjk:
+            tokens.extend(_bigrams(run))
+            # 末尾单字保证每个字都是某个词的开头,单字查询可用前缀匹配
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return ' '.join(tokens)
+
+
+def build_match_query(keyword: Optional[str]) -> Optional[str]:
+    """
+    将用户输入的关键词转换为 FTS5 MATCH 表达式
+
+    Args:
+        keyword: 用户输入的关键词,空白分隔的多个词之间为 AND
+
+    Returns:
+        Optional[str]: MATCH 表达式,关键词中没有可检索的字符时为 None
+    """
+    if not keyword:
+        return None
+    terms = []
+    for is_cjk, run in _split(keyword):
+        if is_cjk and len(run) > 1:
+            terms.append('"' + ' '.join(_bigrams(run)) + '"')
+        else:
+            terms.append(f'"{run}"*')
+    return ' '.join(terms) or None
+
+
+def _write_index(conn: sqlite3.Connection, query: str, rows: list) -> None:
+    """写入索引行;当前 SQLite 不支持 FTS5(迁移未建索引表)时无操作"""
+    if not rows:
+        return
+    try:
+        conn.executemany(query, rows)
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+
+
+def index_products(conn: sqlite3.Connection,
+                   rows: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> None:
+    """
+    写入(或替换)商品的全文索引行,应与商品的写入处于同一事务
+
+    Args:
+        conn: 数据库连接
+        rows: (商品ID, 标题, 描述)
+    """
+    _write_index(
+        conn,
+        "INSERT OR REPLACE INTO products_fts (rowid, title, description) VALUES (?, ?, ?)",
+        [(product_id, cjk_tokens(title), cjk_tokens(description)) for product_id, title, description in rows]
+    )
+
+
+def index_messages(conn: sqlite3.Connection,
+                   rows: Iterable[Tuple[int, Optional[str], int, int]]) -> None:
+    """
+    写入私信的全文索引行(服务消息不建索引,由调用方排除),应与消息的写入处于同一事务
+
+    Args:
+        conn: 数据库连接
+        rows: (消息ID, 内容, 发送者ID, 接收者ID)
+    """
+    _write_index(
+        conn,
+        "INSERT OR REPLACE INTO messages_fts (rowid, content, participants) VALUES (?, ?, ?)",
+        [(msg_id, cjk_tokens(content), f"u{sender_id} u{receiver_id}")
+         for msg_id, content, sender_id, receiver_id in rows]
+    )
+
+
+def highlight(text: Optional[str], keyword: Optional[str], start: str = '[', end: str = ']',
+              width: int = 60) -> str:
+    """
+    在原文中标记关键词并截取摘要(与检索相同的归一化规则,全角/大小写不同也能标记)
+
+    Args:
+        text: 原文
+        keyword: 用户输入的关键词
+        start: 命中片段前的标记
+        end: 命中片段后的标记
+        width: 摘要最大字符数(不含标记),原文较长时以第一个命中位置为中心截取
+
+    Returns:
+        str: 带标记的摘要
+    """
+    if not text:
+        return ''
+    # 逐字归一化并记录每个归一化字符对应的原文位置
+    folded, origin = [], []
+    for i, ch in enumerate(text):
+        for c in normalize(ch):
+            folded.append(c)
+            origin.append(i)
+    folded = ''.join(folded)
+
+    marked = [False] * len(text)
+    for _, run in _split(keyword or ''):
+        pos = folded.find(run)
+        while pos != -1:
+            for k in range(pos, pos + len(run)):
+                marked[origin[k]] = True
+            pos = folded.find(run, pos + len(run))
+
+    lo, hi = 0, len(text)
+    if len(text) > width:
+        first = marked.index(True) if True in marked else 0
+        lo = max(0, min(first - width // 3, len(text) - width))
+        hi = lo + width
+
+    parts = ['…' if lo > 0 else '']
+    for i in range(lo, hi):
+        if marked[i] and (i == lo or not marked[i - 1]):
+            parts.append(start)
+        parts.append(text[i])
+        if marked[i] and (i == hi - 1 or not marked[i + 1]):
+            parts.append(end)
+    parts.append('…' if hi < len(text) else '')
+    return ''.join(parts)
@@ -7,11 +7,11 @@ Anime Shopping Mall System - Main Entry Point
 """
 
 import sys
-import json
 from database import DatabaseManager
 from services import (
     UserService, ProductService, OrderService,
-    AuctionService, MessageService, ReportService
+    AuctionService, MessageService, ReportService,
+    NotificationDispatcher, ViewCountBuffer, TrendingTracker
 )
 from models import User, Product, Order, Auction, Message, Report, Admin
 from utils import Validator, Helper
@@ -26,8 +26,13 @@ class AnimeShoppingMall:
         """初始化系统"""
         self.db_manager = DatabaseManager()
         self.user_service = UserService(self.db_manager)
-        self.product_service = ProductService(self.db_manager)
-        self.order_service = OrderService(self.db_manager)
+        # 商品浏览次数在内存中累加,由后台线程批量写回
+        self.view_counter = ViewCountBuffer(self.db_manager)
+        self.trending = TrendingTracker()
+        self.product_service = ProductService(self.db_manager, self.view_counter, self.trending)
+        # 订单服务通知经发件箱由后台线程投递到消息表
+        self.notification_dispatcher = NotificationDispatcher(self.db_manager)
+        self.order_service = OrderService(self.db_manager, self.product_service, self.notification_dispatcher)
         self.auction_service = AuctionService(self.db_manager)
         self.message_service = MessageService(self.db_manager)
         self.report_service = ReportService(self.db_manager)
@@ -198,16 +203,17 @@ class AnimeShoppingMall:
     
     def show_all_products(self):
         """显示所有商品"""
-        page = 1
+        # 游标栈: cursors[i] 为第 i+1 页的起始游标,翻页代价与页码无关
+        cursors = [None]
         per_page = 10
         
         while True:
+            page = len(cursors)
             print(f"\n{'='*50}")
             print(f"{t('feature.all_products')} - {t('common.page')} {page}")
             print(f"{'='*50}")
             
-            offset = (page - 1) * per_page
-            products = self.product_service.search_products(limit=per_page, offset=offset)
+            products = self.product_service.search_products(limit=per_page, cursor=cursors[-1])
             
             if not products:
                 print(t('product.no_products'))
@@ -232,16 +238,17 @@ class AnimeShoppingMall:
             if action == '0':
                 break
             elif action == 'N':
-                page += 1
+                cursors.append(self.product_service.page_cursor(products[-1]))
             elif action == 'P' and page > 1:
-                page -= 1
+                cursors.pop()
             elif action.isdigit() and 1 <= int(action) <= len(products):
                 self.show_product_detail(products[int(action) - 1]['product_id'])
     
     def browse_by_category(self):
         """按分类浏览"""
-        # 获取所有分类
-        categories = self.product_service.get_all_categories()
+        # 获取所有分类及可售商品数
+        counts = self.product_service.get_category_counts()
+        categories = [row['name'] for row in counts]
         
         if not categories:
             print(t('product.no_categories'))
@@ -251,8 +258,8 @@ class AnimeShoppingMall:
         print(t('product.category_list'))
         print(f"{'='*50}")
         
-        for i, category in enumerate(categories, 1):
-            print(f"{i}. {category}")
+        for i, row in enumerate(counts, 1):
+            print(f"{i}. {row['name']} ({row['available_count']})")
         
         print(f"0. {t('common.back')}")
         
@@ -267,11 +274,12 @@ class AnimeShoppingMall:
     
     def show_category_products(self, category):
         """显示指定分类的商品"""
-        page = 1
+        cursors = [None]
         per_page = 10
         sort_by = 'newest'
         
         while True:
+            page = len(cursors)
             print(f"\n{'='*50}")
             print(f"{t('product.category')}: {category} - {t('common.page')} {page}")
             print(f"{'='*50}")
@@ -284,14 +292,15 @@ class AnimeShoppingMall:
                 print(t('product.price_high_to_low'))
             elif sort_by == 'popular':
                 print(t('product.most_popular'))
+            elif sort_by == 'trending':
+                print(t('product.trending'))
             print(f"{'='*50}")
             
-            offset = (page - 1) * per_page
             products = self.product_service.get_products_by_category(
                 category=category,
                 limit=per_page,
-                offset=offset,
-                sort_by=sort_by
+                sort_by=sort_by,
+                cursor=cursors[-1]
             )
             
             if not products:
@@ -316,12 +325,12 @@ class AnimeShoppingMall:
             if action == '0':
                 break
             elif action == 'N':
-                page += 1
+                cursors.append(self.product_service.page_cursor(products[-1], sort_by))
             elif action == 'P' and page > 1:
-                page -= 1
+                cursors.pop()
             elif action == 'S':
                 sort_by = self.select_sort_order()
-                page = 1  # 重置到第一页
+                cursors = [None]  # 重置到第一页
             elif action.isdigit() and 1 <= int(action) <= len(products):
                 self.show_product_detail(products[int(action) - 1]['product_id'])
     
@@ -332,6 +341,7 @@ class AnimeShoppingMall:
         print(f"2. {t('product.price_low_to_high')}")
         print(f"3. {t('product.price_high_to_low')}")
         print(f"4. {t('product.most_popular')}")
+        print(f"5. {t('product.trending')}")
         
         choice = input(f"\n{t('common.please_select')}: ").strip()
         
@@ -343,6 +353,8 @@ class AnimeShoppingMall:
             return 'price_desc'
         elif choice == '4':
             return 'popular'
+        elif choice == '5':
+            return 'trending'
         else:
             return 'newest'
     
@@ -440,8 +452,9 @@ class AnimeShoppingMall:
     
     def show_search_results(self, keyword=None, category=None, min_price=None, max_price=None):
         """显示搜索结果"""
-        page = 1
+        cursors = [None]
         per_page = 10
+        facets = None
         
         # 构建搜索条件描述
         conditions = []
@@ -455,28 +468,42 @@ class AnimeShoppingMall:
             conditions.append(f"{t('product.max_price')}: ¥{max_price}")
         
         while True:
+            page = len(cursors)
             print(f"\n{'='*50}")
             print(f"{t('product.search_results')} - {t('common.page')} {page}")
             if conditions:
                 print(f"{t('product.search_conditions')}: {', '.join(conditions)}")
             print(f"{'='*50}")
             
-            offset = (page - 1) * per_page
-            products = self.product_service.search_products(
-                keyword=keyword,
-                category=category,
-                min_price=min_price,
-                max_price=max_price,
-                limit=per_page,
-                offset=offset
-            )
+            # 首页同时取分面计数,翻页时沿用
+            if page == 1:
+                products, facets = self.product_service.search_products(
+                    keyword=keyword,
+                    category=category,
+                    min_price=min_price,
+                    max_price=max_price,
+                    limit=per_page,
+                    facets=True
+                )
+            else:
+                products = self.product_service.search_products(
+                    keyword=keyword,
+                    category=category,
+                    min_price=min_price,
+                    max_price=max_price,
+                    limit=per_page,
+                    cursor=cursors[-1]
+                )
             
             if not products:
                 print(t('product.no_results'))
                 input(f"\n{t('common.press_enter')}")
                 break
             
-            print(f"\n{t('common.found')} {len(products)} {t('product.products')}")
+            if facets:
+                self._print_search_facets(facets)
+            else:
+                print(f"\n{t('common.found')} {len(products)} {t('product.products')}")
             
             for i, product in enumerate(products, 1):
                 print(f"\n{i}. [{product['product_id']}] {product['title']}")
@@ -498,15 +525,38 @@ class AnimeShoppingMall:
             if action == '0':
                 break
             elif action == 'N':
-                page += 1
+                cursors.append(self.product_service.page_cursor(products[-1]))
             elif action == 'P' and page > 1:
-                page -= 1
+                cursors.pop()
             elif action == 'S':
                 self.search_products_menu()
                 break
             elif action.isdigit() and 1 <= int(action) <= len(products):
                 self.show_product_detail(products[int(action) - 1]['product_id'])
     
+    def _print_search_facets(self, facets):
+        """显示搜索结果的分面计数(分类 / 价格区间 / 是否可拍卖)"""
+        print(f"\n{t('product.total_products', count=facets['total'])}")
+        categories = [f"{f['value']}({f['count']})" for f in facets['category']]
+        if categories:
+            print(f"  {t('product.category')}: {'  '.join(categories)}")
+        prices = []
+        for bucket in facets['price']:
+            if not bucket['count']:
+                continue
+            if bucket['min'] is None:
+                label = f"<¥{bucket['max']}"
+            elif bucket['max'] is None:
+                label = f"≥¥{bucket['min']}"
+            else:
+                label = f"¥{bucket['min']}-{bucket['max']}"
+            prices.append(f"{label}({bucket['count']})")
+        if prices:
+            print(f"  {t('product.price_range')}: {'  '.join(prices)}")
+        auctionable = facets['auctionable']
+        print(f"  {t('product.auctionable')}: {t('common.yes')}({auctionable[True]})  "
+              f"{t('common.no')}({auctionable[False]})")
+    
     def favorites_menu(self):
         """收藏菜单"""
         if not self.current_user:
@@ -856,37 +906,8 @@ class AnimeShoppingMall:
 
     def _contacts_list_menu(self, user_id: int):
         """联系人列表 - Telegram风格"""
-    def _contacts_list_menu(self, user_id: int):
-        """联系人列表 - Telegram风格"""
-        rows = self.message_service.get_user_messages(user_id, limit=50)
-        
-        # 构建联系人列表（按最后消息时间排序）
-        contacts = []
-        for row in rows:
-            peer_id = row['receiver_id'] if row['sender_id'] == user_id else row['sender_id']
-            peer = self._get_user_by_id(peer_id)
-            if not peer:
-                continue
-            
-            peer_name = peer['username']
-            unread_from_peer = self._get_unread_from_peer(user_id, peer_id)
-            
-            # 检查是否是卖家
-            seller_info = self.db_manager.execute_query(
-                "SELECT shop_name FROM users WHERE user_id = ?",
-                (peer_id,)
-            )
-            is_seller = len(seller_info) > 0
-            shop_name = seller_info[0]['shop_name'] if is_seller else None
-            
-            contacts.append({
-                'peer_id': peer_id,
-                'peer_name': peer_name,
-                'shop_name': shop_name,
-                'is_seller': is_seller,
-                'last': row,
-                'unread': unread_from_peer,
-            })
+        # 联系人、卖家店铺名、最后一条消息与未读数由一次联表查询返回（按最后消息时间排序）
+        contacts = self.message_service.get_inbox(user_id, limit=50)
 
         while True:
             print(f"\n{'='*50}")
@@ -904,34 +925,13 @@ class AnimeShoppingMall:
                     # 跳转到搜索用户
                     self._search_users_and_chat(user_id)
                     # 刷新联系人列表
-                    rows = self.message_service.get_user_messages(user_id, limit=50)
-                    contacts = []
-                    for row in rows:
-                        peer_id = row['receiver_id'] if row['sender_id'] == user_id else row['sender_id']
-                        peer = self._get_user_by_id(peer_id)
-                        if not peer:
-                            continue
-                        peer_name = peer['username']
-                        unread_from_peer = self._get_unread_from_peer(user_id, peer_id)
-                        seller_info = self.db_manager.execute_query(
-                            "SELECT shop_name FROM users WHERE user_id = ?", (peer_id,)
-                        )
-                        is_seller = len(seller_info) > 0
-                        shop_name = seller_info[0]['shop_name'] if is_seller else None
-                        contacts.append({
-                            'peer_id': peer_id,
-                            'peer_name': peer_name,
-                            'shop_name': shop_name,
-                            'is_seller': is_seller,
-                            'last': row,
-                            'unread': unread_from_peer,
-                        })
+                    contacts = self.message_service.get_inbox(user_id, limit=50)
                 continue
             
             for i, c in enumerate(contacts, 1):
                 last = c['last']
                 prefix = t('message.me_label') if last['sender_id'] == user_id else c['peer_name']
-                content = (last['content'] or '')
+                content = self.message_service.render_content(last)
                 content = content if len(content) <= 25 else content[:22] + '...'
                 ts = last.get('created_at', '')
                 
@@ -960,28 +960,7 @@ class AnimeShoppingMall:
             if sel.isdigit() and 1 <= int(sel) <= len(contacts):
                 self._conversation_menu(user_id, contacts[int(sel)-1]['peer_id'])
                 # 刷新联系人列表
-                rows = self.message_service.get_user_messages(user_id, limit=50)
-                contacts = []
-                for row in rows:
-                    peer_id = row['receiver_id'] if row['sender_id'] == user_id else row['sender_id']
-                    peer = self._get_user_by_id(peer_id)
-                    if not peer:
-                        continue
-                    peer_name = peer['username']
-                    unread_from_peer = self._get_unread_from_peer(user_id, peer_id)
-                    seller_info = self.db_manager.execute_query(
-                        "SELECT shop_name FROM users WHERE user_id = ?", (peer_id,)
-                    )
-                    is_seller = len(seller_info) > 0
-                    shop_name = seller_info[0]['shop_name'] if is_seller else None
-                    contacts.append({
-                        'peer_id': peer_id,
-                        'peer_name': peer_name,
-                        'shop_name': shop_name,
-                        'is_seller': is_seller,
-                        'last': row,
-                        'unread': unread_from_peer,
-                    })
+                contacts = self.message_service.get_inbox(user_id, limit=50)
             else:
                 print(t('common.invalid_choice'))
 
@@ -998,7 +977,7 @@ class AnimeShoppingMall:
         
         # 搜索用户（模糊匹配）
         users = self.db_manager.execute_query(
-            "SELECT user_id, username, email FROM users WHERE username LIKE ? AND user_id != ? LIMIT 20",
+            "SELECT user_id, username, email, shop_name FROM users WHERE username LIKE ? AND user_id != ? LIMIT 20",
             (f"%{keyword}%", user_id)
         )
         
@@ -1008,12 +987,8 @@ class AnimeShoppingMall:
         
         print(f"\n{t('message.user_search_results')}:")
         for i, user in enumerate(users, 1):
-            # 检查是否是卖家
-            seller_info = self.db_manager.execute_query(
-                "SELECT shop_name FROM users WHERE user_id = ?",
-                (user['user_id'],)
-            )
-            seller_badge = f" [🏪{seller_info[0]['shop_name']}]" if seller_info else ""
+            # 卖家标识
+            seller_badge = f" [🏪{user['shop_name']}]" if user['shop_name'] else ""
             print(f"{i}. {user['username']}{seller_badge}")
         
         print(f"0. {t('common.back')}")
@@ -1031,15 +1006,14 @@ class AnimeShoppingMall:
 
     def _conversation_menu(self, user_id: int, other_user_id: int):
         """会话详情菜单"""
-        other = self._get_user_by_id(other_user_id)
+        rows = self.db_manager.execute_query(
+            "SELECT username, shop_name FROM users WHERE user_id = ?", (other_user_id,)
+        )
+        other = rows[0] if rows else None
         other_name = other['username'] if other else f"User#{other_user_id}"
         
-        # 检查是否是卖家
-        seller_info = self.db_manager.execute_query(
-            "SELECT shop_name FROM users WHERE user_id = ?",
-            (other_user_id,)
-        )
-        shop_display = f" [🏪{seller_info[0]['shop_name']}]" if seller_info else ""
+        # 卖家标识
+        shop_display = f" [🏪{other['shop_name']}]" if other and other['shop_name'] else ""
         
         # 自动标记该会话的所有消息为已读
         self.message_service.mark_conversation_as_read(user_id, other_user_id)
@@ -1059,21 +1033,8 @@ class AnimeShoppingMall:
                     read_tag = '' if mine or status == 'read' else f"({t('message.unread_tag')})"
                     ts = r.get('created_at', '')
                     
-                    # 处理服务消息的翻译
-                    msg_type = r.get('msg_type', 'text')
-                    if msg_type == 'service':
-                        try:
-                            # 解析 JSON 格式的服务消息
-                            msg_data = json.loads(r['content'])
-                            translation_key = msg_data.get('key', '')
-                            params = msg_data.get('params', {})
-                            # 使用翻译键和参数获取本地化消息
-                            content = t(translation_key, **params)
-                        except (json.JSONDecodeError, KeyError):
-                            # 如果解析失败,显示原始内容(兼容旧格式)
-                            content = r['content']
-                    else:
-                        content = r['content']
+                    # 服务消息按当前语言渲染
+                    content = self.message_service.render_content(r)
                     
                     print(f"{sender}: {content}  {read_tag}  [{ts}]  ({t('message.message_id_label')}: {r['msg_id']})")
 
@@ -1143,7 +1104,7 @@ class AnimeShoppingMall:
             rv = self._get_user_by_id(r['receiver_id'])
             rname = rv['username'] if rv else f"User#{r['receiver_id']}"
             ts = r.get('created_at','')
-            content = r['content']
+            content = r.get('snippet') or r['content']
             print(f"[{r['msg_id']}] {sname} -> {rname}: {content} [{ts}]")
 
     def _get_user_by_id(self, uid: int):
@@ -1154,13 +1115,6 @@ class AnimeShoppingMall:
         rows = self.db_manager.execute_query("SELECT user_id, username FROM users WHERE username=?", (username,))
         return rows[0] if rows else None
 
-    def _get_unread_from_peer(self, me: int, peer: int) -> int:
-        rows = self.db_manager.execute_query(
-            "SELECT COUNT(*) AS cnt FROM messages WHERE receiver_id=? AND sender_id=? AND status <> 'read'",
-            (me, peer)
-        )
-        return int(rows[0]['cnt']) if rows else 0
-    
     def profile_menu(self):
         """个人中心菜单"""
         print(f"\n--- {t('feature.personal_center')} ---")
@@ -1550,7 +1504,16 @@ class AnimeShoppingMall:
         print(f"\n{t('system.welcome_message')}")
         print(t('system.system_info'))
         print(t('system.framework_complete'))
-        self.main_menu()
+        self.db_manager.start_checkpointer()
+        self.notification_dispatcher.start()
+        self.view_counter.start()
+        try:
+            self.main_menu()
+        finally:
+            # 退出时投递剩余通知、写回浏览次数并释放连接池
+            self.notification_dispatcher.stop()
+            self.view_counter.stop()
+            self.db_manager.close()
 
 
 def main():
@@ -5,7 +5,7 @@ Models package for the Anime Shopping Mall System.
 
 from .user import User
 from .product import Product
-from .order import Order, OrderStatus
+from .order import Order, OrderStatus, OrderTransition, ORDER_TRANSITIONS
 from .auction import Auction
 from .message import Message
 from .report import Report
@@ -16,6 +16,8 @@ __all__ = [
     'Product',
     'Order',
     'OrderStatus',
+    'OrderTransition',
+    'ORDER_TRANSITIONS',
     'Auction',
     'Message',
     'Report',
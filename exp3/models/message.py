@@ -3,11 +3,66 @@ Message model - 消息模型
 管理用户间的通讯
 """
 
-from typing import Optional
+import string
+from typing import Optional, List, Tuple
 from datetime import datetime
 from enum import Enum
 
 
+# 服务消息的紧凑存储格式: "<模板ID>" 之后每个参数值前加一个单元分隔符
+# 例如 "3\x1f1024\x1fSF123" 表示模板3, 参数按模板中占位符的顺序依次为 1024、SF123
+SERVICE_FIELD_SEP = '\x1f'
+
+
+def pack_service_content(template_id: int, values: List) -> str:
+    """
+    将模板ID与参数值打包为服务消息内容
+    
+    Args:
+        template_id: message_templates 中的模板ID
+        values: 按模板占位符顺序排列的参数值
+        
+    Returns:
+        str: 紧凑格式的消息内容
+    """
+    fields = [str(template_id)]
+    fields.extend('' if v is None else str(v).replace(SERVICE_FIELD_SEP, ' ') for v in values)
+    return SERVICE_FIELD_SEP.join(fields)
+
+
+def unpack_service_content(content: str) -> Optional[Tuple[int, List[str]]]:
+    """
+    解析紧凑格式的服务消息内容
+    
+    Args:
+        content: 消息内容
+        
+    Returns:
+        Optional[Tuple[int, List[str]]]: (模板ID, 参数值列表),不是紧凑格式时返回None
+    """
+    head, _, rest = content.partition(SERVICE_FIELD_SEP)
+    if not head.isdigit():
+        return None
+    return int(head), rest.split(SERVICE_FIELD_SEP) if _ else []
+
+
+def template_param_names(text: str) -> List[str]:
+    """
+    按出现顺序返回翻译文本中的占位符名称(去重)
+    
+    Args:
+        text: 翻译文本,如 "订单 #{order_id} 已发货，物流单号: {tracking_number}。"
+        
+    Returns:
+        List[str]: 占位符名称列表
+    """
+    names = []
+    for _, field, _, _ in string.Formatter().parse(text):
+        if field and field not in names:
+            names.append(field)
+    return names
+
+
 class MessageType(Enum):
     """消息类型枚举"""
     TEXT = "text"        # 文字
@@ -22,6 +22,59 @@ class OrderStatus(Enum):
     REFUNDED = "refunded"        # 已退款
 
 
+class OrderTransition:
+    """
+    订单状态迁移定义
+
+    Attributes:
+        name (str): 迁移名称
+        from_statuses (tuple): 允许迁移的源状态
+        to_status (OrderStatus): 目标状态
+        actor (str): 需要校验身份的一方('buyer'/'seller'),None 表示不校验
+        timestamp_field (str): 迁移时写入当前时间的字段
+        fields (tuple): 迁移时一并写入的其他字段
+    """
+
+    def __init__(self, name: str, from_statuses: tuple, to_status: OrderStatus,
+                 actor: Optional[str] = None, timestamp_field: Optional[str] = None,
+                 fields: tuple = ()):
+        self.name = name
+        self.from_statuses = from_statuses
+        self.to_status = to_status
+        self.actor = actor
+        self.timestamp_field = timestamp_field
+        self.fields = fields
+
+    def __repr__(self) -> str:
+        sources = ','.join(s.value for s in self.from_statuses)
+        return f"<OrderTransition({self.name}: {sources} -> {self.to_status.value})>"
+
+
+# 订单状态机: 迁移名称 -> 迁移定义
+ORDER_TRANSITIONS = {t.name: t for t in [
+    OrderTransition('pay', (OrderStatus.PENDING,), OrderStatus.PAID,
+                    timestamp_field='paid_at'),
+    OrderTransition('ship', (OrderStatus.PAID,), OrderStatus.SHIPPED,
+                    actor='seller', timestamp_field='shipped_at', fields=('tracking_number',)),
+    OrderTransition('confirm_receipt', (OrderStatus.SHIPPED,), OrderStatus.COMPLETED,
+                    actor='buyer', timestamp_field='completed_at'),
+    OrderTransition('request_cancel',
+                    (OrderStatus.PENDING, OrderStatus.PAID, OrderStatus.SHIPPED),
+                    OrderStatus.CANCEL_REQUESTED, actor='buyer'),
+    OrderTransition('approve_cancel', (OrderStatus.CANCEL_REQUESTED,), OrderStatus.CANCELLED,
+                    actor='seller'),
+    OrderTransition('reject_cancel', (OrderStatus.CANCEL_REQUESTED,), OrderStatus.CANCEL_REJECTED,
+                    actor='seller', fields=('cancel_reject_reason',)),
+    OrderTransition('request_refund',
+                    (OrderStatus.PAID, OrderStatus.SHIPPED, OrderStatus.COMPLETED),
+                    OrderStatus.REFUND_REQUESTED, actor='buyer'),
+    OrderTransition('approve_refund', (OrderStatus.REFUND_REQUESTED,), OrderStatus.REFUNDED,
+                    actor='seller'),
+    OrderTransition('reject_refund', (OrderStatus.REFUND_REQUESTED,), OrderStatus.REFUND_REJECTED,
+                    actor='seller', fields=('refund_reject_reason',)),
+]}
+
+
 class Order:
     """
     订单类
@@ -0,0 +1,88 @@
+"""
+翻译函数基准测试：对比逐层查找嵌套字典与预编译的扁平翻译目录
+
+对当前 translations.json 中的全部键分别用旧的实现(按点分隔、逐层查找、每次 str.format)
+和 I18n.translate(扁平目录 + 预切分的模板片段)翻译,校验两者结果一致后统计平均耗时。
+
+用法:
+    python scripts/benchmark_i18n.py [--language zh_CN] [--repeat 200]
+"""
+
+import argparse
+import functools
+import os
+import sys
+import time
+
+# Ensure exp3 root is on sys.path
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXP3_ROOT = os.path.dirname(CURRENT_DIR)
+if EXP3_ROOT not in sys.path:
+    sys.path.insert(0, EXP3_ROOT)
+
+from config.i18n import I18n, _Template
+
+
+def legacy_translate(translations: dict, key: str, **kwargs):
+    """预编译之前的 I18n.translate 实现"""
+    value = translations
+    for k in key.split('.'):
+        if isinstance(value, dict):
+            value = value.get(k)
+        else:
+            value = None
+            break
+    if value is None:
+        return key
+    if kwargs and isinstance(value, str):
+        try:
+            return value.format(**kwargs)
+        except KeyError:
+            return value
+    return value
+
+
+def build_calls(i18n: I18n):
+    """为每个翻译文本生成一次调用: 有参数的文本传入全部参数,另加一个不存在的键"""
+    calls = []
+    for key, entry in i18n.catalog.items():
+        if entry.__class__ is not _Template:
+            continue
+        params = {name: 42 for name in (entry.fields or ())}
+        calls.append((key, params))
+    calls.append(('no.such.key', {}))
+    return calls
+
+
+def timed(fn, calls, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for key, params in calls:
+            fn(key, **params)
+    return (time.perf_counter() - started) / (repeat * len(calls)) * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='翻译函数基准测试')
+    parser.add_argument('--language', default=I18n.DEFAULT_LANGUAGE, choices=I18n.SUPPORTED_LANGUAGES)
+    parser.add_argument('--repeat', type=int, default=200, help='每个键的重复次数')
+    args = parser.parse_args()
+
+    i18n = I18n(args.language)
+    calls = build_calls(i18n)
+    for key, params in calls:
+        expected = legacy_translate(i18n.translations, key, **params)
+        assert i18n.translate(key, **params) == expected, key
+
+    with_params = [c for c in calls if c[1]]
+    without_params = [c for c in calls if not c[1]]
+    print(f"语言 {args.language}: {len(calls)} 个键({len(with_params)} 个带参数), 每个重复 {args.repeat} 次")
+    print(f"{'场景':<12}{'逐层查找(ns)':>16}{'扁平目录(ns)':>16}{'加速比':>10}")
+    for label, subset in (('全部', calls), ('无参数', without_params), ('带参数', with_params)):
+        legacy = timed(functools.partial(legacy_translate, i18n.translations), subset, args.repeat)
+        compiled = timed(i18n.translate, subset, args.repeat)
+        print(f"{label:<12}{legacy:>16.0f}{compiled:>16.0f}{legacy / compiled:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
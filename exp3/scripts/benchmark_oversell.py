@@ -0,0 +1,126 @@
+"""
+并发下单基准测试：验证原子库存扣减在高并发下不会超卖
+
+多个线程同时对同一商品调用 OrderService.create_order,统计成功订单数、
+最终库存和吞吐量。--naive 模式复现旧的"先查询库存再写回"流程作对比。
+
+用法:
+    python scripts/benchmark_oversell.py [--threads 32] [--stock 500] [--attempts 40] [--naive]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Ensure exp3 root is on sys.path
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXP3_ROOT = os.path.dirname(CURRENT_DIR)
+if EXP3_ROOT not in sys.path:
+    sys.path.insert(0, EXP3_ROOT)
+
+from database.db_manager import DatabaseManager
+from services.order_service import OrderService
+
+
+def naive_create_order(db, buyer_id, product_id, quantity):
+    """旧流程: 先 SELECT 库存,在 Python 中判断后再写回 stock=?(存在竞态)"""
+    products = db.execute_query(
+        "SELECT * FROM products WHERE product_id=? AND status='available'", (product_id,)
+    )
+    if not products or products[0]['stock'] < quantity:
+        return None
+    product = products[0]
+    order_id = db.execute_insert(
+        "INSERT INTO orders (buyer_id, seller_id, product_id, quantity, total_price, status, shipping_address) "
+        "VALUES (?, ?, ?, ?, ?, 'pending', 'bench')",
+        (buyer_id, product['seller_id'], product_id, quantity, product['price'] * quantity)
+    )
+    new_stock = product['stock'] - quantity
+    db.execute_update(
+        "UPDATE products SET stock=?, status=? WHERE product_id=?",
+        (new_stock, 'sold_out' if new_stock <= 0 else 'available', product_id)
+    )
+    return order_id
+
+
+def run(threads: int, stock: int, attempts: int, naive: bool) -> bool:
+    tmp_dir = tempfile.mkdtemp(prefix='oversell_')
+    db = DatabaseManager(os.path.join(tmp_dir, 'bench.db'), pool_size=threads)
+    try:
+        seller_id = db.execute_insert(
+            "INSERT INTO users (username, password, email) VALUES ('bench_seller', 'x', 'seller@bench')"
+        )
+        buyer_ids = [
+            db.execute_insert(
+                "INSERT INTO users (username, password, email) VALUES (?, 'x', ?)",
+                (f"bench_buyer_{i}", f"buyer{i}@bench")
+            )
+            for i in range(threads)
+        ]
+        product_id = db.execute_insert(
+            "INSERT INTO products (seller_id, title, price, category, stock) VALUES (?, 'bench', 9.9, '其他', ?)",
+            (seller_id, stock)
+        )
+
+        service = OrderService(db)
+        successes = [0] * threads
+        errors = []
+        start_barrier = threading.Barrier(threads)
+
+        def worker(idx):
+            start_barrier.wait()
+            for _ in range(attempts):
+                try:
+                    if naive:
+                        order_id = naive_create_order(db, buyer_ids[idx], product_id, 1)
+                    else:
+                        order_id = service.create_order(buyer_ids[idx], product_id, 1, 'bench')
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if order_id:
+                    successes[idx] += 1
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for th in workers:
+            th.start()
+        for th in workers:
+            th.join()
+        elapsed = time.perf_counter() - started
+
+        sold = sum(successes)
+        final = db.execute_query("SELECT stock, status FROM products WHERE product_id=?", (product_id,))[0]
+        orders = db.execute_query("SELECT COUNT(*) AS c FROM orders WHERE product_id=?", (product_id,))[0]['c']
+        oversold = orders - stock
+
+        print(f"模式: {'naive (先查后写)' if naive else 'atomic (stock >= ? 条件扣减)'}")
+        print(f"线程数: {threads}  初始库存: {stock}  每线程尝试: {attempts}")
+        print(f"成功订单: {sold}  订单表记录: {orders}  最终库存: {final['stock']} ({final['status']})")
+        print(f"超卖数量: {max(oversold, 0)}  错误数: {len(errors)}")
+        print(f"耗时: {elapsed:.3f}s  吞吐: {threads * attempts / elapsed:.0f} 次下单尝试/秒")
+        print(f"连接池: {db.get_pool_stats()}")
+
+        ok = oversold <= 0 and final['stock'] >= 0 and orders == min(stock, threads * attempts)
+        print("✅ 无超卖" if ok else "❌ 出现超卖或库存不一致")
+        return ok
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发下单超卖基准测试")
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=500)
+    parser.add_argument('--attempts', type=int, default=40)
+    parser.add_argument('--naive', action='store_true', help='使用旧的先查后写流程作对比')
+    args = parser.parse_args()
+    ok = run(args.threads, args.stock, args.attempts, args.naive)
+    sys.exit(0 if ok or args.naive else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+商品搜索基准测试：对比 LIKE '%kw%' 全表扫描与 FTS5 全文索引
+
+生成合成商品目录(默认 100 万件),分别用旧的 LIKE 查询和
+ProductService.search_products(FTS5 + BM25)执行同一组关键词,统计平均耗时。
+
+用法:
+    python scripts/benchmark_search.py [--products 1000000] [--repeat 5] [--db path]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Ensure exp3 root is on sys.path
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXP3_ROOT = os.path.dirname(CURRENT_DIR)
+if EXP3_ROOT not in sys.path:
+    sys.path.insert(0, EXP3_ROOT)
+
+from config.settings import PRODUCT_CATEGORIES
+from database.db_manager import DatabaseManager
+from database.text_search import index_products
+from services.product_service import ProductService
+
+CHARACTERS = ['胡桃', '雷电将军', '阿米娅', '能天使', '流萤', '黑天鹅', '星野', '白子',
+              '初音未来', '博丽灵梦', '雾雨魔理沙', '岛风', '南小鸟', '户山香澄', 'Saber', '凛']
+ITEMS = ['手办', '亚克力立牌', '徽章', '挂画', '抱枕', '钥匙扣', '色纸', '毛绒玩偶', '痛包', 'cos服']
+ADJECTIVES = ['限定', '官方正品', '二手', '全新未拆', '景品', '签名版', '复刻', '特典']
+
+# 前几个为高频词(命中约 1/10 的商品),LIKE 按时间索引找到 20 条即可停止;
+# 后几个为低频或不存在的词,LIKE 必须扫描全表,FTS5 只读取倒排列表
+KEYWORDS = ['雷电将军 手办', '亚克力立牌', '全新未拆 色纸',
+            '编号42424', '星野 编号99999', '不存在的商品名称']
+
+
+def generate_catalog(db: DatabaseManager, count: int, batch: int = 20000) -> None:
+    """批量写入合成商品,并在同一事务中写入 FTS 索引"""
+    rng = random.Random(42)
+    seller_id = db.execute_insert(
+        "INSERT INTO users (username, password, email) VALUES ('bench_seller', 'x', 'seller@bench')"
+    )
+    started = time.perf_counter()
+    for start in range(0, count, batch):
+        rows = []
+        for _ in range(min(batch, count - start)):
+            character = rng.choice(CHARACTERS)
+            item = rng.choice(ITEMS)
+            title = f"{rng.choice(ADJECTIVES)} {character} {item}"
+            description = f"{character}{item},{rng.choice(ADJECTIVES)},成色良好,包邮。编号{rng.randint(1, 10**6)}"
+            rows.append((seller_id, title, description, round(rng.uniform(5, 2000), 2),
+                         rng.choice(PRODUCT_CATEGORIES), rng.randint(1, 20)))
+        with db.transaction() as conn:
+            last_id = conn.execute("SELECT COALESCE(MAX(product_id), 0) FROM products").fetchone()[0]
+            conn.executemany(
+                "INSERT INTO products (seller_id, title, description, price, category, stock) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            index_products(conn, conn.execute(
+                "SELECT product_id, title, description FROM products WHERE product_id > ?", (last_id,)
+            ).fetchall())
+    print(f"已生成 {count} 件商品,耗时 {time.perf_counter() - started:.1f}s")
+
+
+def like_search(db: DatabaseManager, keyword: str, limit: int = 20):
+    """旧实现: 每个关键词 LIKE '%kw%',按创建时间排序"""
+    query = "SELECT * FROM products WHERE status = 'available'"
+    params = []
+    for word in keyword.split():
+        query += " AND (title LIKE ? OR description LIKE ?)"
+        params.extend([f"%{word}%", f"%{word}%"])
+    query += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+    return db.execute_query(query, tuple(params))
+
+
+def timed(fn, repeat: int):
+    """返回 (平均耗时毫秒, 最后一次结果)"""
+    result = None
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) * 1000 / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="商品搜索 LIKE vs FTS5 基准测试")
+    parser.add_argument('--products', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db', default=None, help='复用已有的基准数据库(不存在时生成)')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='search_bench_'), 'bench.db')
+    db = DatabaseManager(db_path)
+    try:
+        if not db.execute_query("SELECT COUNT(*) AS c FROM products")[0]['c']:
+            generate_catalog(db, args.products)
+        service = ProductService(db)
+
+        print(f"\n{'关键词':<16}{'LIKE(ms)':>12}{'FTS5(ms)':>12}{'加速比':>10}")
+        for keyword in KEYWORDS:
+            like_ms, _ = timed(lambda: like_search(db, keyword), args.repeat)
+            fts_ms, rows = timed(lambda: service.search_products(keyword=keyword), args.repeat)
+            print(f"{keyword:<16}{like_ms:>12.2f}{fts_ms:>12.2f}{like_ms / max(fts_ms, 1e-6):>9.1f}x"
+                  f"  ({len(rows)} 条)")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+数据库迁移脚本：执行 database/migrations.py 中尚未执行的版本迁移
+
+用法:
+    python scripts/migrate.py [db_path]
+"""
+
+import os
+import sys
+
+# Ensure exp3 root is on sys.path
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXP3_ROOT = os.path.dirname(CURRENT_DIR)
+if EXP3_ROOT not in sys.path:
+    sys.path.insert(0, EXP3_ROOT)
+
+from database.db_manager import DatabaseManager
+from database.migrations import MIGRATIONS
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "anime_mall.db"
+    # DatabaseManager 初始化时会自动执行未完成的迁移
+    db = DatabaseManager(db_path)
+    try:
+        print(f"数据库: {db.db_path}")
+        applied = {
+            row['version']: row['applied_at']
+            for row in db.execute_query("SELECT version, applied_at FROM schema_migrations")
+        }
+        for migration in MIGRATIONS:
+            mark = f"✓ {applied[migration.version]}" if migration.version in applied else "✗ 未执行"
+            print(f"  {migration.version:>3}  {migration.name:<32} {mark}")
+        print(f"\n当前版本: {db.get_schema_version()}")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""
+订单统计重建脚本：按 orders 表全量重建 user_order_stats 计数表
+
+计数表平时由 orders 表上的触发器增量维护,手工修改过订单数据后可用本脚本修复。
+
+用法:
+    python scripts/rebuild_order_stats.py [db_path]
+"""
+
+import os
+import sys
+
+# Ensure exp3 root is on sys.path
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXP3_ROOT = os.path.dirname(CURRENT_DIR)
+if EXP3_ROOT not in sys.path:
+    sys.path.insert(0, EXP3_ROOT)
+
+from database.db_manager import DatabaseManager
+from services.order_service import OrderService
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "anime_mall.db"
+    db = DatabaseManager(db_path)
+    try:
+        rows = OrderService(db).rebuild_order_statistics()
+        print(f"✓ 已重建订单统计表 ({rows} 行)")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
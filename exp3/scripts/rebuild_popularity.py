@@ -0,0 +1,36 @@
+"""
+商品热度重建脚本：按 PRODUCT_CONFIG['popularity_weights'] 全量重算 products.popularity_score
+
+热度平时由 products / orders 表上的触发器增量维护,修改热度权重后用本脚本使已有商品生效。
+
+用法:
+    python scripts/rebuild_popularity.py [db_path]
+"""
+
+import os
+import sys
+
+# Ensure exp3 root is on sys.path
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXP3_ROOT = os.path.dirname(CURRENT_DIR)
+if EXP3_ROOT not in sys.path:
+    sys.path.insert(0, EXP3_ROOT)
+
+from config.settings import PRODUCT_CONFIG
+from database.db_manager import DatabaseManager
+from services.product_service import ProductService
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "anime_mall.db"
+    db = DatabaseManager(db_path)
+    try:
+        weights = PRODUCT_CONFIG['popularity_weights']
+        rows = ProductService(db).rebuild_popularity_scores(weights)
+        print(f"✓ 已按权重 {weights} 重算商品热度 ({rows} 件商品)")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,9 @@ Test order cancellation approval workflow
 
 from database import DatabaseManager
 from services import OrderService
+from services.message_templates import MessageTemplateRegistry
 from models import OrderStatus
 from config.i18n import set_language, t
-import json
 
 def test_cancel_workflow():
     """测试取消订单审批流程"""
@@ -19,7 +19,7 @@ def test_cancel_workflow():
     
     # 初始化数据库和服务
     db = DatabaseManager()
-    order_service = OrderService(db)
+    order_service = OrderService(db, sync_dispatch=True)
     
     # 模拟场景：买家ID=1, 卖家ID=2
     buyer_id = 1
@@ -49,15 +49,15 @@ def test_cancel_workflow():
         )
         if messages:
             msg = messages[0]
-            msg_data = json.loads(msg['content'])
+            key, params = MessageTemplateRegistry(db).decode(msg['content'])
             print(f"\n   📨 服务消息已发送给卖家:")
-            print(f"      翻译键: {msg_data['key']}")
-            print(f"      参数: {msg_data['params']}")
+            print(f"      翻译键: {key}")
+            print(f"      参数: {params}")
             
             # 测试多语言显示
             for lang_code, lang_name in [('zh_CN', '中文'), ('en_US', 'English'), ('ja_JP', '日本語')]:
                 set_language(lang_code)
-                translated = t(msg_data['key'], **msg_data['params'])
+                translated = t(key, **params)
                 print(f"      {lang_name}: {translated}")
     
     print(f"\n3️⃣ 卖家(#{seller_id})处理取消申请...")
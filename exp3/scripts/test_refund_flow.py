@@ -52,7 +52,7 @@ def main():
             (seller_id,)
         )
 
-    svc = OrderService(db)
+    svc = OrderService(db, sync_dispatch=True)
 
     # Create order
     order_id = svc.create_order(buyer_id=buyer_id, product_id=product_id, quantity=1, shipping_address='Test Address')
@@ -12,7 +12,7 @@ from services.order_service import OrderService
 
 def main():
     db = DatabaseManager()
-    svc = OrderService(db)
+    svc = OrderService(db, sync_dispatch=True)
 
     buyer_username = 'buyer_reject_detail_test'
     seller_username = 'seller_reject_detail_test'
@@ -9,6 +9,9 @@ from .order_service import OrderService
 from .auction_service import AuctionService
 from .message_service import MessageService
 from .report_service import ReportService
+from .notification_dispatcher import NotificationDispatcher
+from .view_counter import ViewCountBuffer
+from .trending import TrendingTracker
 
 __all__ = [
     'UserService',
@@ -16,5 +19,8 @@ __all__ = [
     'OrderService',
     'AuctionService',
     'MessageService',
-    'ReportService'
+    'ReportService',
+    'NotificationDispatcher',
+    'ViewCountBuffer',
+    'TrendingTracker'
 ]
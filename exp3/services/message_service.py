@@ -3,15 +3,45 @@ Message Service - 消息服务层
 处理消息相关的业务逻辑
 """
 
+import sqlite3
 from typing import Optional, List, Dict
-from models.message import Message, MessageType
+from models.message import Message, MessageType, MessageStatus
 from utils.exceptions import UserNotFoundError, PermissionDeniedError
 from config.settings import MESSAGE_CONFIG
 from config.i18n import t
 from utils.helpers import Helper
+from utils.pagination import keyset_condition, cursor_for
+from database.text_search import build_match_query, highlight, index_messages
+from services.message_templates import MessageTemplateRegistry
 from datetime import datetime
 
 
+# 会话消息按 (created_at, msg_id) 升序排列,用于游标分页
+CONVERSATION_SORT_KEY = ('created_at', 'msg_id')
+
+
+def _apply_read_state(row: Dict, watermark: int) -> Dict:
+    """
+    按接收方的已读水位设置消息行的已读状态
+
+    messages.status / read_at 在改用已读水位后不再更新,
+    水位之后的消息即使旧数据标记为 read 也视为未读,read_at 不再返回。
+
+    Args:
+        row: 消息行
+        watermark: 接收方在该会话中的已读水位
+
+    Returns:
+        Dict: 修改后的消息行
+    """
+    row.pop('read_at', None)
+    if row['msg_id'] <= watermark:
+        row['status'] = MessageStatus.READ.value
+    elif row.get('status') == MessageStatus.READ.value:
+        row['status'] = MessageStatus.DELIVERED.value
+    return row
+
+
 class MessageService:
     """
     消息服务类
@@ -26,6 +56,7 @@ class MessageService:
             db_manager: 数据库管理器实例
         """
         self.db = db_manager
+        self.templates = MessageTemplateRegistry(db_manager)
     
     def send_message(self, sender_id: int, receiver_id: int, 
                     content: str, msg_type: str = "text") -> Optional[int]:
@@ -69,14 +100,32 @@ class MessageService:
         if len(content) > max_len:
             raise ValueError(t('message.too_long', max=max_len))
 
-        # 3. 保存到数据库
+        # 3. 保存到数据库,并在同一事务中写入全文索引(服务消息不建索引)
         query = (
             "INSERT INTO messages (sender_id, receiver_id, content, msg_type, status) "
             "VALUES (?, ?, ?, ?, 'sent')"
         )
-        msg_id = self.db.execute_insert(query, (sender_id, receiver_id, content, msg_type))
+        with self.db.transaction() as conn:
+            msg_id = self.db.execute_insert(query, (sender_id, receiver_id, content, msg_type))
+            if msg_type != 'service':
+                index_messages(conn, [(msg_id, content, sender_id, receiver_id)])
         return msg_id
     
+    def render_content(self, message: Dict) -> str:
+        """
+        获取消息的显示文本,服务消息按当前语言由模板渲染
+        
+        Args:
+            message: 消息记录(包含 content 和 msg_type)
+            
+        Returns:
+            str: 显示文本
+        """
+        content = message.get('content') or ''
+        if message.get('msg_type') == 'service':
+            return self.templates.render(content)
+        return content
+    
     def get_message_by_id(self, msg_id: int) -> Optional[Message]:
         """
         根据ID获取消息
@@ -94,6 +143,9 @@ class MessageService:
         if not rows:
             return None
         row = rows[0]
+        # 已读状态由接收方的已读水位决定
+        watermark = self.get_read_watermarks(row['sender_id'], row['receiver_id']).get(row['receiver_id'], 0)
+        _apply_read_state(row, watermark)
         msg = Message(row['sender_id'], row['receiver_id'], row['content'], row['msg_type'])
         msg.msg_id = row['msg_id']
         # created_at 格式化
@@ -103,23 +155,15 @@ class MessageService:
                 msg.created_at = Helper.parse_datetime(created)
             except Exception:
                 pass
-        # 状态
         try:
-            from models.message import MessageStatus
             msg.status = MessageStatus(row['status'])
-        except Exception:
+        except ValueError:
             pass
-        # read_at
-        read_at = row.get('read_at')
-        if read_at:
-            try:
-                msg.read_at = Helper.parse_datetime(read_at) if isinstance(read_at, str) else read_at
-            except Exception:
-                pass
         return msg
     
     def get_conversation(self, user_id1: int, user_id2: int,
-                        limit: int = 50, offset: int = 0) -> List[Dict]:
+                        limit: int = 50, offset: int = 0,
+                        cursor: str = None) -> List[Dict]:
         """
         获取两个用户之间的对话记录
         
@@ -127,19 +171,43 @@ class MessageService:
             user_id1: 用户1的ID
             user_id2: 用户2的ID
             limit: 返回数量限制
-            offset: 偏移量
+            offset: 偏移量(传入 cursor 时忽略)
+            cursor: 上一页返回的游标,见 conversation_cursor()
             
         Returns:
             List[Dict]: 消息列表
         """
         query = (
             "SELECT * FROM messages "
-            "WHERE (sender_id=? AND receiver_id=?) OR (sender_id=? AND receiver_id=?) "
-            "ORDER BY created_at ASC LIMIT ? OFFSET ?"
+            "WHERE ((sender_id=? AND receiver_id=?) OR (sender_id=? AND receiver_id=?))"
         )
-        rows = self.db.execute_query(query, (user_id1, user_id2, user_id2, user_id1, limit, offset))
+        params = [user_id1, user_id2, user_id2, user_id1]
+        if cursor:
+            condition, values = keyset_condition(CONVERSATION_SORT_KEY, False, cursor, 'conversation')
+            query += f" AND {condition}"
+            params.extend(values)
+            offset = 0
+        query += " ORDER BY created_at ASC, msg_id ASC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        rows = self.db.execute_query(query, tuple(params))
+        # 已读状态由接收方的已读水位决定
+        watermarks = self.get_read_watermarks(user_id1, user_id2)
+        for row in rows:
+            _apply_read_state(row, watermarks.get(row['receiver_id'], 0))
         return rows
     
+    def conversation_cursor(self, message: Dict) -> str:
+        """
+        生成会话下一页游标
+        
+        Args:
+            message: 当前页最后一条消息
+            
+        Returns:
+            str: 游标字符串
+        """
+        return cursor_for(message, CONVERSATION_SORT_KEY, 'conversation')
+    
     def get_user_messages(self, user_id: int, limit: int = 20) -> List[Dict]:
         """
         获取用户的所有消息(最近联系人)
@@ -149,46 +217,79 @@ class MessageService:
             limit: 返回数量限制
             
         Returns:
-            List[Dict]: 消息列表
+            List[Dict]: 每个联系人的最后一条消息,按时间降序
+        """
+        # 会话摘要表按 (用户, 最后活跃时间) 建有索引,每个联系人一行
+        return self.db.execute_query(
+            "SELECT m.* FROM ("
+            "  SELECT last_message_id, last_activity FROM conversations WHERE user_lo = ? "
+            "  UNION ALL "
+            "  SELECT last_message_id, last_activity FROM conversations WHERE user_hi = ? AND user_lo <> ?"
+            ") c JOIN messages m ON m.msg_id = c.last_message_id "
+            "ORDER BY c.last_activity DESC, c.last_message_id DESC LIMIT ?",
+            (user_id, user_id, user_id, limit)
+        )
+    
+    def get_inbox(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """
+        获取收件箱(联系人列表),一次联表查询返回联系人信息、最后一条消息和未读数
+        
+        Args:
+            user_id: 用户ID
+            limit: 返回数量限制
+            
+        Returns:
+            List[Dict]: 联系人列表(按最后活跃时间降序),每项包含
+                peer_id, peer_name, shop_name, is_seller, unread, last(最后一条消息,已读状态由已读水位决定)
         """
-        # 拉取用户相关的较多消息后在内存中按对方用户聚合，取每个会话的最新一条
         rows = self.db.execute_query(
-            "SELECT * FROM messages WHERE sender_id=? OR receiver_id=? ORDER BY created_at DESC LIMIT 1000",
-            (user_id, user_id)
+            "SELECT c.peer_id, u.username AS peer_name, u.shop_name, c.unread, "
+            "c.my_read, c.peer_read, m.* FROM ("
+            "  SELECT user_hi AS peer_id, last_message_id, last_activity, unread_lo AS unread, "
+            "  last_read_lo AS my_read, last_read_hi AS peer_read "
+            "  FROM conversations WHERE user_lo = ? "
+            "  UNION ALL "
+            "  SELECT user_lo, last_message_id, last_activity, unread_hi, last_read_hi, last_read_lo "
+            "  FROM conversations WHERE user_hi = ? AND user_lo <> ?"
+            ") c "
+            "JOIN messages m ON m.msg_id = c.last_message_id "
+            "JOIN users u ON u.user_id = c.peer_id "
+            "ORDER BY c.last_activity DESC, c.last_message_id DESC LIMIT ?",
+            (user_id, user_id, user_id, limit)
         )
-        latest_by_peer: Dict[int, Dict] = {}
+        inbox = []
         for row in rows:
-            peer = row['receiver_id'] if row['sender_id'] == user_id else row['sender_id']
-            if peer not in latest_by_peer:
-                latest_by_peer[peer] = row
-            if len(latest_by_peer) >= limit:
-                break
-        # 返回按时间降序
-        result = sorted(latest_by_peer.values(), key=lambda r: r['created_at'], reverse=True)
-        return result[:limit]
+            peer = {key: row.pop(key) for key in ('peer_id', 'peer_name', 'shop_name', 'unread')}
+            peer['is_seller'] = bool(peer['shop_name'])
+            my_read, peer_read = row.pop('my_read'), row.pop('peer_read')
+            peer['last'] = _apply_read_state(row, my_read if row['receiver_id'] == user_id else peer_read)
+            inbox.append(peer)
+        return inbox
     
     def mark_as_read(self, msg_id: int, user_id: int) -> bool:
         """
-        标记消息为已读
+        标记消息为已读(推进已读水位,该消息及之前对方发来的消息均视为已读)
         
         Args:
             msg_id: 消息ID
             user_id: 用户ID(验证权限)
             
         Returns:
-            bool: 标记是否成功
+            bool: 是否有消息被标记(不是接收者或消息已读时为False)
         """
         # 只允许接收者标记为已读
-        affected = self.db.execute_update(
-            "UPDATE messages SET status='read', read_at=CURRENT_TIMESTAMP WHERE msg_id=? AND receiver_id=?",
+        rows = self.db.execute_query(
+            "SELECT sender_id FROM messages WHERE msg_id=? AND receiver_id=?",
             (msg_id, user_id)
         )
-        return affected > 0
+        if not rows:
+            return False
+        return self._advance_read_watermark(user_id, rows[0]['sender_id'], msg_id)
     
     def mark_conversation_as_read(self, user_id: int, 
                                   other_user_id: int) -> bool:
         """
-        标记与某用户的所有对话为已读
+        标记与某用户的所有对话为已读(只写会话摘要中的一行)
         
         Args:
             user_id: 当前用户ID
@@ -197,13 +298,56 @@ class MessageService:
         Returns:
             bool: 标记是否成功
         """
+        return self._advance_read_watermark(user_id, other_user_id)
+    
+    def _advance_read_watermark(self, user_id: int, other_user_id: int,
+                                upto: Optional[int] = None) -> bool:
+        """
+        推进 user_id 在与 other_user_id 会话中的已读水位,并重算其未读数
+        
+        Args:
+            user_id: 当前用户ID
+            other_user_id: 对方用户ID
+            upto: 已读到的消息ID,为空时读到会话最后一条
+            
+        Returns:
+            bool: 水位是否前移
+        """
+        side = 'lo' if user_id <= other_user_id else 'hi'
+        target = f"MAX(last_read_{side}, COALESCE(?, last_message_id))"
+        # 剩余未读只需在 (receiver_id, sender_id) 索引上按 msg_id 做范围计数
         affected = self.db.execute_update(
-            "UPDATE messages SET status='read', read_at=CURRENT_TIMESTAMP "
-            "WHERE receiver_id=? AND sender_id=? AND status <> 'read'",
-            (user_id, other_user_id)
+            f"UPDATE conversations SET "
+            f"last_read_{side} = {target}, "
+            f"unread_{side} = (SELECT COUNT(*) FROM messages "
+            f"  WHERE receiver_id = ? AND sender_id = ? AND msg_id > {target}) "
+            f"WHERE user_lo = ? AND user_hi = ? AND last_read_{side} < COALESCE(?, last_message_id)",
+            (upto, user_id, other_user_id, upto,
+             min(user_id, other_user_id), max(user_id, other_user_id), upto)
         )
         return affected > 0
     
+    def get_read_watermarks(self, user_id1: int, user_id2: int) -> Dict[int, int]:
+        """
+        获取会话双方的已读水位
+        
+        Args:
+            user_id1: 用户1的ID
+            user_id2: 用户2的ID
+            
+        Returns:
+            Dict[int, int]: 用户ID -> 已读到的最大消息ID(无会话时为0)
+        """
+        lo, hi = min(user_id1, user_id2), max(user_id1, user_id2)
+        rows = self.db.execute_query(
+            "SELECT last_read_lo, last_read_hi FROM conversations WHERE user_lo=? AND user_hi=?",
+            (lo, hi)
+        )
+        if not rows:
+            return {lo: 0, hi: 0}
+        # 自己与自己的会话只使用 lo 一侧
+        return {hi: rows[0]['last_read_hi'], lo: rows[0]['last_read_lo']}
+    
     def delete_message(self, msg_id: int, user_id: int) -> bool:
         """
         删除消息
@@ -232,9 +376,12 @@ class MessageService:
         Returns:
             int: 未读消息数量
         """
+        # 各会话的未读数随已读水位维护,按用户在会话摘要索引上求和
         rows = self.db.execute_query(
-            "SELECT COUNT(*) AS cnt FROM messages WHERE receiver_id=? AND status <> 'read'",
-            (user_id,)
+            "SELECT "
+            "(SELECT COALESCE(SUM(unread_lo), 0) FROM conversations WHERE user_lo=?) + "
+            "(SELECT COALESCE(SUM(unread_hi), 0) FROM conversations WHERE user_hi=? AND user_lo<>?) AS cnt",
+            (user_id, user_id, user_id)
         )
         return int(rows[0]['cnt']) if rows else 0
     
@@ -243,20 +390,40 @@ class MessageService:
         """
         搜索消息
         
+        通过 messages_fts 全文索引检索(只与该用户作为参与者的倒排列表求交),
+        每条结果附带 snippet 字段: 以 [] 标记命中关键词的摘要。
+        
         Args:
             user_id: 用户ID
             keyword: 搜索关键词
             limit: 返回数量限制
             
         Returns:
-            List[Dict]: 消息列表
+            List[Dict]: 消息列表(按时间倒序)
         """
         keyword = (keyword or '').strip()
         if not keyword:
             return []
-        rows = self.db.execute_query(
-            "SELECT * FROM messages WHERE (sender_id=? OR receiver_id=?) AND content LIKE ? "
-            "ORDER BY created_at DESC LIMIT ?",
-            (user_id, user_id, f"%{keyword}%", limit)
-        )
+        match = build_match_query(keyword)
+        rows = None
+        if match:
+            try:
+                rows = self.db.execute_query(
+                    "SELECT m.* FROM messages_fts "
+                    "JOIN messages m ON m.msg_id = messages_fts.rowid "
+                    "WHERE messages_fts MATCH ? "
+                    "ORDER BY m.created_at DESC, m.msg_id DESC LIMIT ?",
+                    (f'participants:"u{int(user_id)}" AND content:({match})', limit)
+                )
+            except sqlite3.OperationalError:
+                # 未建立全文索引(SQLite 不支持 FTS5)时退回 LIKE
+                rows = None
+        if rows is None:
+            rows = self.db.execute_query(
+                "SELECT * FROM messages WHERE (sender_id=? OR receiver_id=?) AND content LIKE ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (user_id, user_id, f"%{keyword}%", limit)
+            )
+        for row in rows:
+            row['snippet'] = highlight(row['content'], keyword)
         return rows
@@ -0,0 +1,186 @@
+"""
+Message Templates - 服务消息模板
+服务消息以 "模板ID + 参数值" 的紧凑格式存储(见 models/message.py),
+模板ID与 translations.json 中翻译键的对应关系保存在 message_templates 表
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple
+
+from config.i18n import I18n, get_i18n
+from config.settings import MESSAGE_CONFIG
+from models.message import (
+    pack_service_content, unpack_service_content, template_param_names
+)
+
+
+class MessageTemplateRegistry:
+    """
+    服务消息模板注册表
+
+    首次使用时一次性读取 message_templates 并缓存在内存中;
+    编码时遇到表中没有的翻译键会自动登记新模板(在调用方的事务中写入,提交后才加入缓存),
+    解码时遇到缓存中没有的模板ID(如其他服务实例登记的模板)重新查询模板表。
+    表不存在(未迁移的数据库)时退回旧的 JSON 格式,解码同时兼容两种格式。
+    渲染结果按 (翻译键, 参数, 语言) 做 LRU 缓存,切换语言或重新加载翻译后整体失效。
+    """
+
+    def __init__(self, db_manager, cache_size: Optional[int] = None):
+        """
+        初始化模板注册表
+
+        Args:
+            db_manager: 数据库管理器实例
+            cache_size: 渲染缓存条数,默认读取 MESSAGE_CONFIG['render_cache_size']
+        """
+        self.db = db_manager
+        self.cache_size = cache_size or MESSAGE_CONFIG.get('render_cache_size', 1024)
+        self._rendered: OrderedDict = OrderedDict()
+        self._rendered_revision = I18n.revision
+        self._by_key: Optional[Dict[str, Tuple[int, List[str]]]] = None
+        self._by_id: Dict[int, Tuple[str, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Tuple[int, List[str]]]:
+        """读取全部模板(只在首次调用时访问数据库)"""
+        if self._by_key is None:
+            with self._lock:
+                if self._by_key is None:
+                    try:
+                        rows = self.db.execute_query(
+                            "SELECT template_id, key, param_names FROM message_templates", ()
+                        )
+                    except sqlite3.OperationalError:
+                        rows = []
+                    for row in rows:
+                        self._remember(row['template_id'], row['key'], row['param_names'])
+                    self._by_key = {key: (tid, names) for tid, (key, names) in self._by_id.items()}
+        return self._by_key
+
+    def _remember(self, template_id: int, key: str, param_names: str) -> None:
+        names = param_names.split(',') if param_names else []
+        self._by_id[template_id] = (key, names)
+        if self._by_key is not None:
+            self._by_key[key] = (template_id, names)
+
+    def _remember_on_commit(self, template_id: int, key: str, param_names: str) -> None:
+        """模板行所在的事务提交后再加入缓存,事务回滚时缓存不会指向不存在的模板"""
+        self.db.on_commit(lambda: self._remember(template_id, key, param_names))
+
+    def _register(self, key: str, param_names: List[str]) -> Optional[Tuple[int, List[str]]]:
+        """登记新模板,返回 (模板ID, 表中登记的参数名);模板表不可用时返回None"""
+        joined = ','.join(param_names)
+        try:
+            self.db.execute_update(
+                "INSERT OR IGNORE INTO message_templates (key, param_names) VALUES (?, ?)",
+                (key, joined)
+            )
+            rows = self.db.execute_query(
+                "SELECT template_id, param_names FROM message_templates WHERE key=?", (key,)
+            )
+        except sqlite3.OperationalError:
+            return None
+        if not rows:
+            return None
+        template_id, stored = rows[0]['template_id'], rows[0]['param_names']
+        self._remember_on_commit(template_id, key, stored)
+        return template_id, stored.split(',') if stored else []
+
+    def _lookup_id(self, template_id: int) -> Optional[Tuple[str, List[str]]]:
+        """按模板ID查询缓存,未命中时重新查询模板表"""
+        entry = self._by_id.get(template_id)
+        if entry is not None:
+            return entry
+        try:
+            rows = self.db.execute_query(
+                "SELECT key, param_names FROM message_templates WHERE template_id=?", (template_id,)
+            )
+        except sqlite3.OperationalError:
+            return None
+        if not rows:
+            return None
+        key, param_names = rows[0]['key'], rows[0]['param_names']
+        self._remember_on_commit(template_id, key, param_names)
+        return key, param_names.split(',') if param_names else []
+
+    def encode(self, key: str, params: Dict) -> str:
+        """
+        将翻译键和参数编码为服务消息内容
+
+        Args:
+            key: 翻译键（如 'order.service_order_created'）
+            params: 翻译参数（如 {'order_id': 123}）
+
+        Returns:
+            str: 紧凑格式的消息内容,模板表不可用时为 JSON
+        """
+        entry = self._load().get(key)
+        if entry is None:
+            text = I18n(I18n.DEFAULT_LANGUAGE).translate(key)
+            names = template_param_names(text) if text != key else list(params)
+            entry = self._register(key, names)
+            if entry is None:
+                return json.dumps({'key': key, 'params': params}, ensure_ascii=False)
+        template_id, names = entry
+        return pack_service_content(template_id, [params.get(name) for name in names])
+
+    def decode(self, content: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        解码服务消息内容
+
+        Args:
+            content: 消息内容(紧凑格式或旧的 JSON 格式)
+
+        Returns:
+            Optional[Tuple[str, Dict[str, str]]]: (翻译键, 参数字典),无法识别时返回None
+        """
+        if not content:
+            return None
+        packed = unpack_service_content(content)
+        if packed is not None:
+            template_id, values = packed
+            self._load()
+            entry = self._lookup_id(template_id)
+            if entry is None:
+                return None
+            key, names = entry
+            return key, dict(zip(names, values))
+        try:
+            data = json.loads(content)
+            return data['key'], data.get('params') or {}
+        except (ValueError, TypeError, KeyError):
+            return None
+
+    def render(self, content: str) -> str:
+        """
+        按当前语言渲染服务消息
+
+        Args:
+            content: 消息内容
+
+        Returns:
+            str: 翻译后的文本,无法识别时原样返回
+        """
+        decoded = self.decode(content)
+        if decoded is None:
+            return content
+        key, params = decoded
+        i18n = get_i18n()
+        cache_key = (key, tuple(params.items()), i18n.current_language)
+        with self._lock:
+            if self._rendered_revision != I18n.revision:
+                self._rendered.clear()
+                self._rendered_revision = I18n.revision
+            text = self._rendered.get(cache_key)
+            if text is not None:
+                self._rendered.move_to_end(cache_key)
+                return text
+        text = i18n.translate(key, **params)
+        with self._lock:
+            self._rendered[cache_key] = text
+            if len(self._rendered) > self.cache_size:
+                self._rendered.popitem(last=False)
+        return text
@@ -0,0 +1,111 @@
+"""
+Notification Dispatcher - 服务通知投递
+将 notification_outbox 中的通知批量写入 messages 表
+"""
+
+import threading
+from typing import Optional
+
+from config.settings import MESSAGE_CONFIG
+from database.text_search import index_messages
+
+
+class NotificationDispatcher:
+    """
+    发件箱投递器
+    
+    每批在一个写事务中读取、executemany 写入 messages 并删除已投递的发件箱记录,
+    因此通知不会丢失也不会重复投递;可在后台线程中按固定间隔运行,
+    未运行后台线程时由 OrderService 在事务提交后同步投递。
+    """
+    
+    def __init__(self, db_manager, interval: Optional[float] = None,
+                 batch_size: Optional[int] = None):
+        """
+        初始化投递器
+        
+        Args:
+            db_manager: 数据库管理器实例
+            interval: 后台投递间隔秒数,默认读取 MESSAGE_CONFIG['outbox_dispatch_interval']
+            batch_size: 每批投递数量,默认读取 MESSAGE_CONFIG['outbox_batch_size']
+        """
+        self.db = db_manager
+        self.interval = interval or MESSAGE_CONFIG.get('outbox_dispatch_interval', 1.0)
+        self.batch_size = batch_size or MESSAGE_CONFIG.get('outbox_batch_size', 200)
+        self.delivered = 0
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def dispatch(self) -> int:
+        """
+        立即投递所有待发送的通知
+        
+        Returns:
+            int: 本次投递的通知数
+        """
+        total = 0
+        while True:
+            count = self._deliver_batch()
+            total += count
+            if count < self.batch_size:
+                return total
+    
+    def _deliver_batch(self) -> int:
+        """投递一批通知,返回投递数量"""
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT outbox_id, sender_id, receiver_id, content, msg_type, created_at "
+                "FROM notification_outbox ORDER BY outbox_id LIMIT ?",
+                (self.batch_size,)
+            ).fetchall()
+            if not rows:
+                return 0
+            # 服务消息不建全文索引,其他类型的通知在同一事务中写入索引
+            needs_index = any(r['msg_type'] != 'service' for r in rows)
+            if needs_index:
+                last_id = conn.execute("SELECT COALESCE(MAX(msg_id), 0) FROM messages").fetchone()[0]
+            conn.executemany(
+                "INSERT INTO messages (sender_id, receiver_id, content, msg_type, status, created_at) "
+                "VALUES (?, ?, ?, ?, 'sent', ?)",
+                [(r['sender_id'], r['receiver_id'], r['content'], r['msg_type'], r['created_at']) for r in rows]
+            )
+            if needs_index:
+                index_messages(conn, conn.execute(
+                    "SELECT msg_id, content, sender_id, receiver_id FROM messages "
+                    "WHERE msg_id > ? AND msg_type IS NOT 'service'",
+                    (last_id,)
+                ).fetchall())
+            conn.execute("DELETE FROM notification_outbox WHERE outbox_id <= ?", (rows[-1]['outbox_id'],))
+        self.delivered += len(rows)
+        return len(rows)
+    
+    @property
+    def running(self) -> bool:
+        """后台投递线程是否在运行"""
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self) -> None:
+        """启动后台投递线程"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+        self._thread.start()
+    
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.dispatch()
+            except Exception as e:
+                # 投递失败的通知保留在发件箱中,下一轮重试
+                print(f"投递服务通知失败: {str(e)}")
+    
+    def stop(self) -> None:
+        """停止后台线程并投递剩余通知"""
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.interval + 1)
+        try:
+            self.dispatch()
+        except Exception as e:
+            print(f"投递服务通知失败: {str(e)}")
@@ -3,8 +3,12 @@ Order Service - 订单服务层
 处理订单相关的业务逻辑
 """
 
+import sqlite3
 from typing import Optional, List, Dict
-from models.order import Order, OrderStatus
+from models.order import Order, OrderStatus, ORDER_TRANSITIONS
+from services.product_service import ProductService
+from services.message_templates import MessageTemplateRegistry
+from services.notification_dispatcher import NotificationDispatcher
 from datetime import datetime
 
 
@@ -14,14 +18,23 @@ class OrderService:
     提供订单创建、支付、发货、完成等功能
     """
     
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, product_service: Optional[ProductService] = None,
+                 dispatcher: Optional[NotificationDispatcher] = None, sync_dispatch: bool = False):
         """
         初始化订单服务
         
         Args:
             db_manager: 数据库管理器实例
+            product_service: 用于预占/归还库存的商品服务,应传入应用共用的实例
+            dispatcher: 服务通知投递器,应传入应用共用并已启动后台线程的实例
+            sync_dispatch: 为True时,若投递器的后台线程未运行,通知在事务提交后
+                           于当前线程同步投递。仅供脚本和测试使用,生产环境应运行投递线程
         """
         self.db = db_manager
+        self.product_service = product_service or ProductService(db_manager)
+        self.templates = MessageTemplateRegistry(db_manager)
+        self.dispatcher = dispatcher or NotificationDispatcher(db_manager)
+        self.sync_dispatch = sync_dispatch
     
     def create_order(self, buyer_id: int, product_id: int, quantity: int,
                     shipping_address: str) -> Optional[int]:
@@ -37,35 +50,69 @@ class OrderService:
         Returns:
             Optional[int]: 成功返回订单ID,失败返回None
         """
-        # 1. 查询商品信息
-        product_query = "SELECT * FROM products WHERE product_id=? AND status='available'"
-        products = self.db.execute_query(product_query, (product_id,))
-        if not products:
-            return None  # 商品不存在或不可售
-        product = products[0]
-        if product['stock'] < quantity:
-            return None  # 库存不足
-        # 2. 计算总价
-        total_price = product['price'] * quantity
-        seller_id = product['seller_id']
-        # 3. 创建订单
-        order_insert = """
-            INSERT INTO orders (buyer_id, seller_id, product_id, quantity, total_price, status, shipping_address)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
-        order_id = self.db.execute_insert(order_insert, (
-            buyer_id, seller_id, product_id, quantity, total_price, OrderStatus.PENDING.value, shipping_address
-        ))
-        if not order_id:
-            return None
-        # 4. 减少商品库存
-        new_stock = product['stock'] - quantity
-        product_update = "UPDATE products SET stock=?, status=? WHERE product_id=?"
-        new_status = 'sold_out' if new_stock == 0 else 'available'
-        self.db.execute_update(product_update, (new_stock, new_status, product_id))
-        # 5. 发送服务消息给卖家
-        self._send_service_message(buyer_id, seller_id, 'order.service_order_created', order_id=order_id)
-        return order_id
+        with self.db.transaction():
+            # 1. 原子扣减库存(库存不足或不可售时不修改任何数据),同时取得价格和卖家
+            product = self.product_service.reserve_stock(product_id, quantity)
+            if not product:
+                return None  # 商品不存在、不可售或库存不足
+            # 2. 计算总价
+            total_price = product['price'] * quantity
+            seller_id = product['seller_id']
+            # 3. 创建订单(写入失败时抛出异常,事务回滚预占的库存)
+            order_insert = """
+                INSERT INTO orders (buyer_id, seller_id, product_id, quantity, total_price, status, shipping_address)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """
+            order_id = self.db.execute_insert(order_insert, (
+                buyer_id, seller_id, product_id, quantity, total_price, OrderStatus.PENDING.value, shipping_address
+            ))
+            # 4. 发送服务消息给卖家
+            self._send_service_message(buyer_id, seller_id, 'order.service_order_created', order_id=order_id)
+            return order_id
+    
+    def _transition(self, name: str, order_id: int, actor_id: Optional[int] = None,
+                    **fields) -> Optional[Dict]:
+        """
+        执行订单状态迁移(比较并设置)
+        
+        用一条 UPDATE ... WHERE order_id=? AND status IN (...) AND buyer_id/seller_id=? RETURNING
+        同时完成存在性、权限和状态校验,买卖双方并发操作时只有一方能成功
+        
+        Args:
+            name: ORDER_TRANSITIONS 中的迁移名称
+            order_id: 订单ID
+            actor_id: 操作者ID(迁移定义要求校验买家/卖家时必填)
+            **fields: 迁移定义中 fields 列出的字段值
+            
+        Returns:
+            Optional[Dict]: 成功返回订单的 order_id/buyer_id/seller_id/product_id/quantity,
+                            订单不存在、无权限或状态不允许时返回None
+        """
+        transition = ORDER_TRANSITIONS[name]
+        
+        set_clauses = ["status=?"]
+        params = [transition.to_status.value]
+        if transition.timestamp_field:
+            set_clauses.append(f"{transition.timestamp_field}=?")
+            params.append(datetime.now().isoformat())
+        for field in transition.fields:
+            set_clauses.append(f"{field}=?")
+            params.append(fields.get(field))
+        
+        placeholders = ', '.join('?' for _ in transition.from_statuses)
+        where = f"order_id=? AND status IN ({placeholders})"
+        params.append(order_id)
+        params.extend(s.value for s in transition.from_statuses)
+        if transition.actor:
+            where += f" AND {transition.actor}_id=?"
+            params.append(actor_id)
+        
+        query = (
+            f"UPDATE orders SET {', '.join(set_clauses)} WHERE {where} "
+            "RETURNING order_id, buyer_id, seller_id, product_id, quantity"
+        )
+        rows = self.db.execute_returning(query, tuple(params))
+        return rows[0] if rows else None
     
     def pay_order(self, order_id: int, payment_method: str) -> bool:
         """
@@ -78,22 +125,14 @@ class OrderService:
         Returns:
             bool: 支付是否成功
         """
-        # 1. 查询订单
-        order_query = "SELECT * FROM orders WHERE order_id=?"
-        orders = self.db.execute_query(order_query, (order_id,))
-        if not orders:
-            return False  # 订单不存在
-        order = orders[0]
-        if order['status'] != OrderStatus.PENDING.value:
-            return False  # 订单状态异常
-        # 2. 支付逻辑（买家确认即支付成功）
-        paid_at = datetime.now().isoformat()
-        update_query = "UPDATE orders SET status=?, paid_at=? WHERE order_id=?"
-        updated = self.db.execute_update(update_query, (OrderStatus.PAID.value, paid_at, order_id))
-        if updated > 0:
-            # 3. 发送服务消息给卖家
+        with self.db.transaction():
+            # 支付逻辑（买家确认即支付成功）,仅待支付订单可支付
+            order = self._transition('pay', order_id)
+            if not order:
+                return False
+            # 发送服务消息给卖家
             self._send_service_message(order['buyer_id'], order['seller_id'], 'order.service_order_paid', order_id=order_id)
-        return updated > 0
+            return True
     
     def ship_order(self, order_id: int, seller_id: int,
                   tracking_number: str) -> bool:
@@ -108,24 +147,15 @@ class OrderService:
         Returns:
             bool: 发货是否成功
         """
-        # 查询订单
-        order_query = "SELECT * FROM orders WHERE order_id=?"
-        orders = self.db.execute_query(order_query, (order_id,))
-        if not orders:
-            return False
-        order = orders[0]
-        if order['seller_id'] != seller_id:
-            return False  # 权限校验
-        if order['status'] != OrderStatus.PAID.value:
-            return False  # 仅已支付订单可发货
-        shipped_at = datetime.now().isoformat()
-        update_query = "UPDATE orders SET status=?, tracking_number=?, shipped_at=? WHERE order_id=?"
-        updated = self.db.execute_update(update_query, (OrderStatus.SHIPPED.value, tracking_number, shipped_at, order_id))
-        if updated > 0:
+        with self.db.transaction():
+            # 仅卖家本人可对已支付订单发货
+            order = self._transition('ship', order_id, seller_id, tracking_number=tracking_number)
+            if not order:
+                return False
             # 发送服务消息给买家
             self._send_service_message(seller_id, order['buyer_id'], 'order.service_order_shipped', 
                                       order_id=order_id, tracking_number=tracking_number)
-        return updated > 0
+            return True
     
     def confirm_receipt(self, order_id: int, buyer_id: int) -> bool:
         """
@@ -138,23 +168,14 @@ class OrderService:
         Returns:
             bool: 确认收货是否成功
         """
-        # 查询订单
-        order_query = "SELECT * FROM orders WHERE order_id=?"
-        orders = self.db.execute_query(order_query, (order_id,))
-        if not orders:
-            return False
-        order = orders[0]
-        if order['buyer_id'] != buyer_id:
-            return False  # 权限校验
-        if order['status'] != OrderStatus.SHIPPED.value:
-            return False  # 仅已发货订单可确认收货
-        completed_at = datetime.now().isoformat()
-        update_query = "UPDATE orders SET status=?, completed_at=? WHERE order_id=?"
-        updated = self.db.execute_update(update_query, (OrderStatus.COMPLETED.value, completed_at, order_id))
-        if updated > 0:
+        with self.db.transaction():
+            # 仅买家本人可对已发货订单确认收货
+            order = self._transition('confirm_receipt', order_id, buyer_id)
+            if not order:
+                return False
             # 发送服务消息给卖家
             self._send_service_message(buyer_id, order['seller_id'], 'order.service_order_completed', order_id=order_id)
-        return updated > 0
+            return True
     
     def request_cancel_order(self, order_id: int, buyer_id: int, reason: str) -> bool:
         """
@@ -168,30 +189,15 @@ class OrderService:
         Returns:
             bool: 申请是否成功
         """
-        # 查询订单
-        order_query = "SELECT * FROM orders WHERE order_id=?"
-        orders = self.db.execute_query(order_query, (order_id,))
-        if not orders:
-            return False
-        order = orders[0]
-        
-        # 权限校验：必须是买家
-        if order['buyer_id'] != buyer_id:
-            return False
-            
-        # 仅待支付/已支付/已发货状态可申请取消
-        if order['status'] not in [OrderStatus.PENDING.value, OrderStatus.PAID.value, OrderStatus.SHIPPED.value]:
-            return False
-        
-        # 状态改为 cancel_requested（待卖家审批）
-        update_query = "UPDATE orders SET status=? WHERE order_id=?"
-        updated = self.db.execute_update(update_query, (OrderStatus.CANCEL_REQUESTED.value, order_id))
-        
-        if updated > 0:
+        with self.db.transaction():
+            # 仅买家本人可对待支付/已支付/已发货订单申请取消
+            order = self._transition('request_cancel', order_id, buyer_id)
+            if not order:
+                return False
             # 发送服务消息给卖家
             self._send_service_message(buyer_id, order['seller_id'], 'order.service_cancel_requested', 
                                      order_id=order_id, reason=reason)
-        return updated > 0
+            return True
     
     def approve_cancel(self, order_id: int, seller_id: int) -> bool:
         """
@@ -204,37 +210,20 @@ class OrderService:
         Returns:
             bool: 审批是否成功
         """
-        order_query = "SELECT * FROM orders WHERE order_id=?"
-        orders = self.db.execute_query(order_query, (order_id,))
-        if not orders:
-            return False
-        order = orders[0]
-        if order['seller_id'] != seller_id:
-            return False  # 权限校验
-        if order['status'] != OrderStatus.CANCEL_REQUESTED.value:
-            return False  # 仅待审批状态可审批
-        
-        # 更新订单状态为已取消
-        update_query = "UPDATE orders SET status=? WHERE order_id=?"
-        updated = self.db.execute_update(update_query, (OrderStatus.CANCELLED.value, order_id))
-        
-        if updated > 0:
+        with self.db.transaction():
+            order = self._transition('approve_cancel', order_id, seller_id)
+            if not order:
+                return False
             # 恢复商品库存
-            product_query = "SELECT stock FROM products WHERE product_id=?"
-            products = self.db.execute_query(product_query, (order['product_id'],))
-            if products:
-                new_stock = products[0]['stock'] + order['quantity']
-                product_update = "UPDATE products SET stock=?, status=? WHERE product_id=?"
-                self.db.execute_update(product_update, (new_stock, 'available', order['product_id']))
-            
+            self.product_service.release_stock(order['product_id'], order['quantity'])
             # 发送服务消息给买家
             self._send_service_message(seller_id, order['buyer_id'], 'order.service_cancel_approved', 
                                      order_id=order_id)
-        return updated > 0
+            return True
     
     def reject_cancel(self, order_id: int, seller_id: int, reason: str = "") -> bool:
         """
-        卖家拒绝取消订单（状态从 cancel_requested 改为原状态或 cancel_rejected）
+        卖家拒绝取消订单（状态从 cancel_requested 改为 cancel_rejected）
         
         Args:
             order_id: 订单ID
@@ -244,26 +233,16 @@ class OrderService:
         Returns:
             bool: 是否拒绝成功
         """
-        order_query = "SELECT * FROM orders WHERE order_id=?"
-        orders = self.db.execute_query(order_query, (order_id,))
-        if not orders:
-            return False
-        order = orders[0]
-        if order['seller_id'] != seller_id:
-            return False  # 权限校验
-        if order['status'] != OrderStatus.CANCEL_REQUESTED.value:
-            return False  # 仅待审批状态可审批
-        
-        # 更新状态和拒绝原因
-        update_query = "UPDATE orders SET status=?, cancel_reject_reason=? WHERE order_id=?"
-        updated = self.db.execute_update(update_query, (OrderStatus.CANCEL_REJECTED.value, reason, order_id))
-        
-        if updated > 0:
+        with self.db.transaction():
+            # 更新状态和拒绝原因
+            order = self._transition('reject_cancel', order_id, seller_id, cancel_reject_reason=reason)
+            if not order:
+                return False
             # 发送服务消息给买家
             reason_text = f" 原因: {reason}" if reason else ""
             self._send_service_message(seller_id, order['buyer_id'], 'order.service_cancel_rejected', 
                                      order_id=order_id, reason_text=reason_text)
-        return updated > 0
+            return True
     
     def request_refund(self, order_id: int, buyer_id: int, 
                       reason: str) -> bool:
@@ -278,24 +257,14 @@ class OrderService:
         Returns:
             bool: 申请是否成功
         """
-        # 查询订单
-        order_query = "SELECT * FROM orders WHERE order_id=?"
-        orders = self.db.execute_query(order_query, (order_id,))
-        if not orders:
-            return False
-        order = orders[0]
-        if order['buyer_id'] != buyer_id:
-            return False  # 权限校验
-        # 仅已支付/已发货/已完成状态可申请退款
-        if order['status'] not in [OrderStatus.PAID.value, OrderStatus.SHIPPED.value, OrderStatus.COMPLETED.value]:
-            return False
-        # 状态改为 refund_requested（待卖家审批）
-        update_query = "UPDATE orders SET status=? WHERE order_id=?"
-        updated = self.db.execute_update(update_query, (OrderStatus.REFUND_REQUESTED.value, order_id))
-        if updated > 0:
+        with self.db.transaction():
+            # 仅买家本人可对已支付/已发货/已完成订单申请退款
+            order = self._transition('request_refund', order_id, buyer_id)
+            if not order:
+                return False
             # 发送服务消息给卖家
             self._send_service_message(buyer_id, order['seller_id'], 'order.service_refund_requested', order_id=order_id, reason=reason)
-        return updated > 0
+            return True
     
     def approve_refund(self, order_id: int, seller_id: int) -> bool:
         """
@@ -308,21 +277,13 @@ class OrderService:
         Returns:
             bool: 审批是否成功
         """
-        order_query = "SELECT * FROM orders WHERE order_id=?"
-        orders = self.db.execute_query(order_query, (order_id,))
-        if not orders:
-            return False
-        order = orders[0]
-        if order['seller_id'] != seller_id:
-            return False  # 权限校验
-        if order['status'] != OrderStatus.REFUND_REQUESTED.value:
-            return False  # 仅待审批状态可审批
-        update_query = "UPDATE orders SET status=? WHERE order_id=?"
-        updated = self.db.execute_update(update_query, (OrderStatus.REFUNDED.value, order_id))
-        if updated > 0:
+        with self.db.transaction():
+            order = self._transition('approve_refund', order_id, seller_id)
+            if not order:
+                return False
             # 发送服务消息给买家
             self._send_service_message(seller_id, order['buyer_id'], 'order.service_refund_approved', order_id=order_id)
-        return updated > 0
+            return True
     
     def reject_refund(self, order_id: int, seller_id: int, reason: str = "") -> bool:
         """
@@ -336,53 +297,46 @@ class OrderService:
         Returns:
             bool: 是否拒绝成功
         """
-        order_query = "SELECT * FROM orders WHERE order_id=?"
-        orders = self.db.execute_query(order_query, (order_id,))
-        if not orders:
-            return False
-        order = orders[0]
-        if order['seller_id'] != seller_id:
-            return False  # 权限校验
-        if order['status'] != OrderStatus.REFUND_REQUESTED.value:
-            return False  # 仅待审批状态可审批
-        # 更新状态和拒绝原因
-        update_query = "UPDATE orders SET status=?, refund_reject_reason=? WHERE order_id=?"
-        updated = self.db.execute_update(update_query, (OrderStatus.REFUND_REJECTED.value, reason, order_id))
-        if updated > 0:
+        with self.db.transaction():
+            # 更新状态和拒绝原因
+            order = self._transition('reject_refund', order_id, seller_id, refund_reject_reason=reason)
+            if not order:
+                return False
             # 发送服务消息给买家
             reason_text = f" 原因: {reason}" if reason else ""
             self._send_service_message(seller_id, order['buyer_id'], 'order.service_refund_rejected', 
                                      order_id=order_id, reason_text=reason_text)
-        return updated > 0
+            return True
     
     def _send_service_message(self, sender_id: int, receiver_id: int, translation_key: str, **params):
         """
         发送服务消息（内部辅助方法）
         
+        消息写入 notification_outbox,与订单状态变更处于同一事务:
+        事务回滚时通知一并撤销,提交后由 NotificationDispatcher 的后台线程批量投递到 messages
+        (开启 sync_dispatch 且后台线程未运行时,在提交后同步投递)。
+        
         Args:
             sender_id: 发送者user_id
             receiver_id: 接收者user_id
             translation_key: 翻译键（如 'order.service_order_created'）
             **params: 翻译参数（如 order_id=123）
         """
+        # 以模板ID和参数值的紧凑格式存储,显示时按查看者的语言翻译
+        content = self.templates.encode(translation_key, params)
+        self.db.execute_insert(
+            "INSERT INTO notification_outbox (sender_id, receiver_id, content) VALUES (?, ?, ?)",
+            (sender_id, receiver_id, content)
+        )
+        if self.sync_dispatch and not self.dispatcher.running:
+            self.db.on_commit(self._dispatch_notifications)
+    
+    def _dispatch_notifications(self) -> None:
+        """同步投递发件箱(订单操作已提交,投递失败的通知留在发件箱中等待下次投递)"""
         try:
-            import json
-            # 将翻译键和参数存储为 JSON
-            content_data = {
-                'key': translation_key,
-                'params': params
-            }
-            content = json.dumps(content_data, ensure_ascii=False)
-            
-            # 插入消息表，msg_type 为 'service'
-            insert_query = """
-                INSERT INTO messages (sender_id, receiver_id, content, msg_type, status)
-                VALUES (?, ?, ?, 'service', 'sent')
-            """
-            self.db.execute_insert(insert_query, (sender_id, receiver_id, content))
+            self.dispatcher.dispatch()
         except Exception as e:
-            # 记录错误但不中断流程
-            print(f"发送服务消息失败: {str(e)}")
+            print(f"投递服务通知失败: {str(e)}")
     
     def get_order_by_id(self, order_id: int) -> Optional[Order]:
         """
@@ -492,30 +446,43 @@ class OrderService:
         Returns:
             Dict: 统计信息
         """
-        role_field = 'seller_id' if is_seller else 'buyer_id'
-        base_params = (user_id,)
-        # 总数
-        total = self.db.execute_query(
-            f"SELECT COUNT(*) AS c FROM orders WHERE {role_field}=?",
-            base_params
-        )[0]['c']
-        # 各状态计数
-        stats = {}
-        for st in [s.value for s in OrderStatus]:
+        role = 'seller' if is_seller else 'buyer'
+        try:
+            # 读取触发器维护的计数表,每个状态一行
             rows = self.db.execute_query(
-                f"SELECT COUNT(*) AS c FROM orders WHERE {role_field}=? AND status=?",
-                (user_id, st)
+                "SELECT status, order_count AS c, total_amount AS s "
+                "FROM user_order_stats WHERE user_id=? AND role=?",
+                (user_id, role)
             )
-            stats[st] = rows[0]['c']
-        # 金额统计
-        sum_field = 'total_price'
-        amount_row = self.db.execute_query(
-            f"SELECT COALESCE(SUM({sum_field}), 0) AS s FROM orders WHERE {role_field}=?",
-            base_params
-        )[0]
-        total_amount = amount_row['s']
+        except sqlite3.OperationalError:
+            # 计数表不可用时退回到单次 GROUP BY 扫描
+            rows = self.db.execute_query(
+                f"SELECT status, COUNT(*) AS c, COALESCE(SUM(total_price), 0) AS s "
+                f"FROM orders WHERE {role}_id=? GROUP BY status",
+                (user_id,)
+            )
+        # 各状态计数
+        stats = {s.value: 0 for s in OrderStatus}
+        total = 0
+        total_amount = 0
+        for row in rows:
+            stats[row['status']] = row['c']
+            total += row['c']
+            total_amount += row['s']
         return {
             'total_orders': total,
             'by_status': stats,
             ('total_revenue' if is_seller else 'total_spent'): total_amount
         }
+    
+    def rebuild_order_statistics(self) -> int:
+        """
+        按订单表全量重建订单统计计数表(数据修复用)
+        
+        Returns:
+            int: 重建后的统计行数
+        """
+        from database.migrations import rebuild_user_order_stats
+        with self.db.transaction() as conn:
+            rebuild_user_order_stats(conn.cursor())
+        return self.db.execute_query("SELECT COUNT(*) AS c FROM user_order_stats")[0]['c']
@@ -3,14 +3,31 @@ Product Service - 商品服务层
 处理商品相关的业务逻辑
 """
 
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Union
 import json
+import sqlite3
 from models.product import Product, ProductStatus
 
 from utils.exceptions import (
     ProductNotFoundError,
     InsufficientStockError
 )
+from utils.pagination import keyset_condition, cursor_for, decode_cursor
+from database.text_search import build_match_query, index_products
+from services.view_counter import ViewCountBuffer
+from services.trending import TrendingTracker
+from config.settings import PRODUCT_CONFIG
+
+
+# 排序方式 -> (排序列, 是否降序);末尾的 product_id 保证顺序唯一,供游标分页使用
+PRODUCT_SORT_KEYS = {
+    'newest': (('created_at', 'product_id'), True),
+    'price_asc': (('price', 'product_id'), False),
+    'price_desc': (('price', 'product_id'), True),
+    'popular': (('popularity_score', 'product_id'), True),
+    # 全文搜索结果:BM25 分数越小越相关
+    'relevance': (('score', 'product_id'), False),
+}
 
 
 class ProductService:
@@ -19,14 +36,20 @@ class ProductService:
     提供商品发布、编辑、搜索、浏览等功能
     """
     
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, view_counter: Optional[ViewCountBuffer] = None,
+                 trending: Optional[TrendingTracker] = None):
         """
         初始化商品服务
         
         Args:
             db_manager: 数据库管理器实例
+            view_counter: 已启动的浏览计数缓冲,多个服务实例应共用同一个,
+                          由创建者负责 stop();未提供时每次浏览直接写入数据库
+            trending: 近期热门统计,多个服务实例应共用同一个
         """
         self.db = db_manager
+        self.view_counter = view_counter
+        self.trending = trending or TrendingTracker()
     
     def create_product(self, seller_id: int, product_data: dict) -> Optional[int]:
         """
@@ -67,8 +90,10 @@ class ProductService:
                 product_data.get('auctionable', 0)  # 默认不支持拍卖
             )
             
-            # 执行插入
-            product_id = self.db.execute_insert(query, params)
+            # 执行插入,并在同一事务中写入全文索引
+            with self.db.transaction() as conn:
+                product_id = self.db.execute_insert(query, params)
+                index_products(conn, [(product_id, product_data['title'], product_data['description'])])
             
             return product_id
             
@@ -122,8 +147,14 @@ class ProductService:
             # 构建完整的更新语句
             query = f"UPDATE products SET {', '.join(update_fields)} WHERE product_id = ?"
             
-            # 执行更新
-            affected_rows = self.db.execute_update(query, tuple(params))
+            # 执行更新,标题或描述变化时在同一事务中更新全文索引
+            with self.db.transaction() as conn:
+                affected_rows = self.db.execute_update(query, tuple(params))
+                if affected_rows and ('title' in product_data or 'description' in product_data):
+                    row = conn.execute(
+                        "SELECT title, description FROM products WHERE product_id = ?", (product_id,)
+                    ).fetchone()
+                    index_products(conn, [(product_id, row['title'], row['description'])])
             
             return affected_rows > 0
             
@@ -206,12 +237,20 @@ class ProductService:
             
             product_data = products[0]
             
-            # 增加浏览次数
+            # 增加浏览次数(有缓冲时先累加在内存中,由 ViewCountBuffer 批量写回)
+            pending = 0
             if increment_view:
-                self.db.execute_update(
-                    "UPDATE products SET view_count = view_count + 1 WHERE product_id = ?",
-                    (product_id,)
-                )
+                if self.view_counter is not None:
+                    self.view_counter.record(product_id)
+                else:
+                    self.db.execute_update(
+                        "UPDATE products SET view_count = view_count + 1 WHERE product_id = ?",
+                        (product_id,)
+                    )
+                    pending = 1
+                self.trending.record_view(product_id, product_data['category'])
+            if self.view_counter is not None:
+                pending = self.view_counter.pending(product_id)
             
             # 创建 Product 对象
             product = Product(
@@ -231,7 +270,7 @@ class ProductService:
                 product.images = []
             product.status = ProductStatus(product_data['status'])
             product.auctionable = bool(product_data['auctionable'])
-            product.view_count = product_data['view_count'] + (1 if increment_view else 0)
+            product.view_count = product_data['view_count'] + pending
             product.favorite_count = product_data['favorite_count']
             
             return product
@@ -242,9 +281,64 @@ class ProductService:
             print(f"获取商品失败: {str(e)}")
             return None
 
+    def reserve_stock(self, product_id: int, quantity: int) -> Optional[Dict]:
+        """
+        原子扣减库存(下单预占)
+        
+        单条 UPDATE 同时完成库存校验(stock >= ?)、扣减和售罄状态切换,
+        并发下单时不会超卖,也不需要先 SELECT 再写回
+        
+        Args:
+            product_id: 商品ID
+            quantity: 扣减数量
+            
+        Returns:
+            Optional[Dict]: 成功返回扣减后的商品信息(product_id, seller_id, price, stock, status),
+                            商品不存在、不可售或库存不足返回None
+        """
+        if quantity <= 0:
+            return None
+        rows = self.db.execute_returning(
+            """
+            UPDATE products
+            SET stock = stock - ?,
+                status = CASE WHEN stock - ? <= 0 THEN 'sold_out' ELSE status END
+            WHERE product_id = ? AND status = 'available' AND stock >= ?
+            RETURNING product_id, seller_id, price, stock, status
+            """,
+            (quantity, quantity, product_id, quantity)
+        )
+        return rows[0] if rows else None
+    
+    def release_stock(self, product_id: int, quantity: int) -> bool:
+        """
+        归还库存(取消订单时),售罄商品恢复为可售
+        
+        Args:
+            product_id: 商品ID
+            quantity: 归还数量
+            
+        Returns:
+            bool: 是否归还成功
+        """
+        if quantity <= 0:
+            return False
+        affected = self.db.execute_update(
+            """
+            UPDATE products
+            SET stock = stock + ?,
+                status = CASE WHEN status = 'sold_out' THEN 'available' ELSE status END
+            WHERE product_id = ?
+            """,
+            (quantity, product_id)
+        )
+        return affected > 0
+    
     def search_products(self, keyword: str = None, category: str = None,
                        min_price: float = None, max_price: float = None,
-                       limit: int = 20, offset: int = 0) -> List[Dict]:
+                       limit: int = 20, offset: int = 0,
+                       cursor: str = None,
+                       facets: bool = False) -> Union[List[Dict], Tuple[List[Dict], Dict]]:
         """
         搜索商品
         
@@ -254,52 +348,207 @@ class ProductService:
             min_price: 最低价格
             max_price: 最高价格
             limit: 返回数量限制
-            offset: 偏移量
+            offset: 偏移量(传入 cursor 时忽略)
+            cursor: 上一页返回的游标,见 page_cursor()
+            facets: 是否同时返回分面计数,见 _facet_counts()
             
         Returns:
-            List[Dict]: 商品列表
+            List[Dict]: 商品列表;facets 为 True 时返回 (商品列表, 分面计数)
         """
         try:
-            # 构建基础查询（只搜索可售商品）
-            query = "SELECT * FROM products WHERE status = 'available'"
-            params = []
-            
-            # 添加关键词搜索（标题或描述中包含）
-            if keyword:
-                query += " AND (title LIKE ? OR description LIKE ?)"
-                keyword_pattern = f"%{keyword}%"
-                params.extend([keyword_pattern, keyword_pattern])
-            
-            # 添加分类筛选
-            if category:
-                query += " AND category = ?"
-                params.append(category)
-            
-            # 添加价格范围筛选
-            if min_price is not None:
-                query += " AND price >= ?"
-                params.append(min_price)
-            
-            if max_price is not None:
-                query += " AND price <= ?"
-                params.append(max_price)
+            # 关键词按中日韩二元组分词后交给全文索引,无可检索字符时退回 LIKE
+            match = build_match_query(keyword)
+            like_terms = keyword.split() if keyword else []
+            if match:
+                try:
+                    return self._search(match, [], category, min_price, max_price,
+                                        limit, offset, cursor, facets)
+                except sqlite3.OperationalError:
+                    # 未建立全文索引(SQLite 不支持 FTS5)时退回 LIKE
+                    pass
+            return self._search(None, like_terms, category, min_price, max_price,
+                                limit, offset, cursor, facets)
             
-            # 按创建时间降序排序
-            query += " ORDER BY created_at DESC"
+        except Exception as e:
+            print(f"搜索商品失败: {str(e)}")
+            return ([], {}) if facets else []
+    
+    def _search(self, match: Optional[str], like_terms: List[str], category: str,
+                min_price: float, max_price: float, limit: int, offset: int,
+                cursor: str, facets: bool):
+        products = self._query_products(match, like_terms, category, min_price,
+                                        max_price, limit, offset, cursor)
+        if not facets:
+            return products
+        return products, self._facet_counts(match, like_terms, category, min_price, max_price)
+    
+    def _search_source(self, match: Optional[str], like_terms: List[str]) -> Tuple[str, list]:
+        """
+        搜索的 FROM/WHERE 子句(关键词与可售状态条件),结果页与分面计数共用
+        
+        有 MATCH 表达式时通过 products_fts 匹配,否则直接查询 products。
+        """
+        if match:
+            clause = (
+                "FROM products_fts JOIN products p ON p.product_id = products_fts.rowid "
+                "WHERE products_fts MATCH ? AND p.status = 'available'"
+            )
+            params = [match]
+        else:
+            # 只搜索可售商品
+            clause = "FROM products p WHERE p.status = 'available'"
+            params = []
+        
+        # 添加关键词搜索（标题或描述中包含）
+        for word in like_terms:
+            clause += " AND (p.title LIKE ? OR p.description LIKE ?)"
+            keyword_pattern = f"%{word}%"
+            params.extend([keyword_pattern, keyword_pattern])
+        return clause, params
+    
+    def _query_products(self, match: Optional[str], like_terms: List[str],
+                        category: str, min_price: float, max_price: float,
+                        limit: int, offset: int, cursor: str) -> List[Dict]:
+        """
+        执行商品搜索查询
+        
+        有 MATCH 表达式时按 BM25 相关度排序,否则按创建时间降序排序。
+        """
+        clause, params = self._search_source(match, like_terms)
+        if match:
+            # 先只取 (product_id, score) 完成过滤排序,再回表取整行,避免对全部命中行排序宽行
+            query = "SELECT p.product_id, products_fts.rank AS score " + clause
+            sort_by = 'relevance'
+        else:
+            query = "SELECT p.* " + clause
+            sort_by = 'newest'
+        
+        # 添加分类筛选
+        if category:
+            query += " AND p.category = ?"
+            params.append(category)
+        
+        # 添加价格范围筛选
+        if min_price is not None:
+            query += " AND p.price >= ?"
+            params.append(min_price)
+        
+        if max_price is not None:
+            query += " AND p.price <= ?"
+            params.append(max_price)
+        
+        # 排序与游标分页
+        query, params = self._paginate(query, params, sort_by, limit, offset, cursor)
+        if match:
+            query = (
+                f"SELECT p.*, k.score FROM ({query}) k "
+                "JOIN products p ON p.product_id = k.product_id "
+                "ORDER BY k.score, k.product_id"
+            )
+        
+        products = self.db.execute_query(query, tuple(params))
+        return [dict(product) for product in products]
+    
+    def _facet_counts(self, match: Optional[str], like_terms: List[str], category: str,
+                      min_price: float, max_price: float) -> Dict:
+        """
+        对关键词命中的可售商品做一次 GROUP BY category 聚合,得到全部分面计数
+        
+        每个分面忽略自身的筛选条件、保留其他条件,便于切换筛选值:
+        分类计数受价格范围限制,价格区间计数受分类限制,是否可拍卖同时受两者限制。
+        价格区间边界取自 PRODUCT_CONFIG['search_price_buckets']。
+        
+        Returns:
+            Dict: {'total': 符合全部条件的商品数,
+                   'category': [{'value', 'count'}] (按数量降序),
+                   'price': [{'min', 'max', 'count'}] (min/max 为 None 表示不限),
+                   'auctionable': {True: 数量, False: 数量}}
+        """
+        in_range, range_params = [], []
+        if min_price is not None:
+            in_range.append("p.price >= ?")
+            range_params.append(min_price)
+        if max_price is not None:
+            in_range.append("p.price <= ?")
+            range_params.append(max_price)
+        in_range = ' AND '.join(in_range) or '1'
+        
+        bounds = [None] + list(PRODUCT_CONFIG.get('search_price_buckets', [50, 100, 200, 500])) + [None]
+        buckets = list(zip(bounds, bounds[1:]))
+        columns = [f"SUM({in_range}) AS matched", f"SUM(p.auctionable AND {in_range}) AS auctionable"]
+        params = range_params * 2
+        for i, (low, high) in enumerate(buckets):
+            conditions = []
+            if low is not None:
+                conditions.append("p.price >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append("p.price < ?")
+                params.append(high)
+            columns.append(f"SUM({' AND '.join(conditions) or '1'}) AS bucket_{i}")
+        
+        clause, source_params = self._search_source(match, like_terms)
+        rows = self.db.execute_query(
+            f"SELECT p.category, {', '.join(columns)} {clause} GROUP BY p.category",
+            tuple(params + source_params)
+        )
+        
+        selected = [r for r in rows if not category or r['category'] == category]
+        total = sum(r['matched'] for r in selected)
+        auctionable = sum(r['auctionable'] for r in selected)
+        return {
+            'total': total,
+            'category': sorted(
+                ({'value': r['category'], 'count': r['matched']} for r in rows if r['matched']),
+                key=lambda f: (-f['count'], f['value'])
+            ),
+            'price': [
+                {'min': low, 'max': high, 'count': sum(r[f'bucket_{i}'] for r in selected)}
+                for i, (low, high) in enumerate(buckets)
+            ],
+            'auctionable': {True: auctionable, False: total - auctionable},
+        }
+    
+    def page_cursor(self, product: Dict, sort_by: str = None) -> str:
+        """
+        生成下一页游标
+        
+        Args:
+            product: 当前页最后一个商品
+            sort_by: 排序方式,须与查询时一致;为空时根据结果自动判断
+                    (全文搜索结果带有 score 字段)
             
-            # 添加分页
+        Returns:
+            str: 游标字符串
+        """
+        if sort_by is None:
+            sort_by = 'relevance' if 'score' in product else 'newest'
+        if sort_by == 'trending':
+            return cursor_for(product, ('trending_rank',), 'trending')
+        if sort_by not in PRODUCT_SORT_KEYS:
+            sort_by = 'newest'
+        return cursor_for(product, PRODUCT_SORT_KEYS[sort_by][0], sort_by)
+    
+    def _paginate(self, query: str, params: list, sort_by: str,
+                  limit: int, offset: int, cursor: str = None):
+        """为查询追加游标条件、ORDER BY 与 LIMIT"""
+        if sort_by not in PRODUCT_SORT_KEYS:
+            sort_by = 'newest'
+        columns, descending = PRODUCT_SORT_KEYS[sort_by]
+        params = list(params)
+        if cursor:
+            condition, values = keyset_condition(columns, descending, cursor, sort_by)
+            query += f" AND {condition}"
+            params.extend(values)
+        direction = 'DESC' if descending else 'ASC'
+        query += " ORDER BY " + ', '.join(f"{c} {direction}" for c in columns)
+        if cursor:
+            query += " LIMIT ?"
+            params.append(limit)
+        else:
             query += " LIMIT ? OFFSET ?"
             params.extend([limit, offset])
-            
-            # 执行查询
-            products = self.db.execute_query(query, tuple(params))
-            
-            # 转换为字典列表
-            return [dict(product) for product in products]
-            
-        except Exception as e:
-            print(f"搜索商品失败: {str(e)}")
-            return []
+        return query, params
     
     def get_products_by_seller(self, seller_id: int, include_removed: bool = False) -> List[Dict]:
         """
@@ -339,44 +588,34 @@ class ProductService:
     
     def get_products_by_category(self, category: str, 
                                 limit: int = 20, offset: int = 0,
-                                sort_by: str = 'newest') -> List[Dict]:
+                                sort_by: str = 'newest',
+                                cursor: str = None) -> List[Dict]:
         """
         根据分类获取商品
         
         Args:
             category: 商品分类(IP)
             limit: 返回数量限制
-            offset: 偏移量，用于分页
+            offset: 偏移量，用于分页(传入 cursor 时忽略)
             sort_by: 排序方式 ('newest'=最新, 'price_asc'=价格升序, 
-                    'price_desc'=价格降序, 'popular'=最受欢迎)
+                    'price_desc'=价格降序, 'popular'=最受欢迎, 'trending'=近期热门)
+            cursor: 上一页返回的游标,见 page_cursor()
             
         Returns:
             List[Dict]: 商品列表
         """
         try:
+            if sort_by == 'trending':
+                start = decode_cursor(cursor, 'trending', 1)[0] if cursor else offset
+                return self.get_trending_products(category, limit, start)
+
             # 基础查询（只返回可售商品）
-            query = """
-                SELECT * FROM products 
-                WHERE category = ? AND status = 'available'
-            """
-            
-            # 根据排序方式添加 ORDER BY 子句
-            if sort_by == 'newest':
-                query += " ORDER BY created_at DESC"
-            elif sort_by == 'price_asc':
-                query += " ORDER BY price ASC"
-            elif sort_by == 'price_desc':
-                query += " ORDER BY price DESC"
-            elif sort_by == 'popular':
-                query += " ORDER BY view_count DESC, favorite_count DESC"
-            else:
-                # 默认按最新排序
-                query += " ORDER BY created_at DESC"
+            query = "SELECT * FROM products WHERE category = ? AND status = 'available'"
             
-            # 添加分页
-            query += " LIMIT ? OFFSET ?"
+            # 根据排序方式添加 ORDER BY 子句与游标条件(未知排序方式按最新排序)
+            query, params = self._paginate(query, [category], sort_by, limit, offset, cursor)
             
-            products = self.db.execute_query(query, (category, limit, offset))
+            products = self.db.execute_query(query, tuple(params))
             
             return [dict(product) for product in products]
             
@@ -384,6 +623,39 @@ class ProductService:
             print(f"获取分类商品失败: {str(e)}")
             return []
     
+    def get_trending_products(self, category: str = None, limit: int = 20,
+                              offset: int = 0) -> List[Dict]:
+        """
+        获取近期热门商品(热门榜由 TrendingTracker 在内存中维护,只按ID读取上榜商品)
+        
+        Args:
+            category: 商品分类,为空时返回全站热门
+            limit: 返回数量限制
+            offset: 在热门榜中的起始位置
+            
+        Returns:
+            List[Dict]: 商品列表,附带 trending_score(热度)与 trending_rank(榜单位置,从1开始)
+        """
+        ranked = self.trending.top(category)
+        if not ranked:
+            return []
+        try:
+            placeholders = ', '.join('?' for _ in ranked)
+            rows = self.db.execute_query(
+                f"SELECT * FROM products WHERE product_id IN ({placeholders}) AND status = 'available'",
+                tuple(product_id for product_id, _ in ranked)
+            )
+        except Exception as e:
+            print(f"获取热门商品失败: {str(e)}")
+            return []
+        by_id = {row['product_id']: row for row in rows}
+        products = []
+        for rank, (product_id, score) in enumerate(ranked, 1):
+            product = by_id.get(product_id)
+            if product is not None:
+                products.append(dict(product, trending_score=score, trending_rank=rank))
+        return [p for p in products if p['trending_rank'] > offset][:limit]
+    
     def favorite_product(self, user_id: int, product_id: int) -> bool:
         """
         收藏商品
@@ -398,7 +670,7 @@ class ProductService:
         try:
             # 检查商品是否存在
             product = self.db.execute_query(
-                "SELECT product_id FROM products WHERE product_id = ?",
+                "SELECT product_id, category FROM products WHERE product_id = ?",
                 (product_id,)
             )
             if not product:
@@ -414,18 +686,20 @@ class ProductService:
                 print(f"商品ID {product_id} 已经在收藏列表中")
                 return False
             
-            # 添加收藏记录
-            favorite_id = self.db.execute_insert(
-                "INSERT INTO favorites (user_id, product_id) VALUES (?, ?)",
-                (user_id, product_id)
-            )
+            # 添加收藏记录并更新商品的收藏计数(同一事务提交)
+            with self.db.transaction():
+                favorite_id = self.db.execute_insert(
+                    "INSERT INTO favorites (user_id, product_id) VALUES (?, ?)",
+                    (user_id, product_id)
+                )
+                if favorite_id:
+                    self.db.execute_update(
+                        "UPDATE products SET favorite_count = favorite_count + 1 WHERE product_id = ?",
+                        (product_id,)
+                    )
             
             if favorite_id:
-                # 更新商品的收藏计数
-                self.db.execute_update(
-                    "UPDATE products SET favorite_count = favorite_count + 1 WHERE product_id = ?",
-                    (product_id,)
-                )
+                self.trending.record_favorite(product_id, product[0]['category'])
                 print(f"✓ 收藏商品ID {product_id} 成功")
                 return True
             
@@ -459,18 +733,19 @@ class ProductService:
                 print(f"商品ID {product_id} 不在收藏列表中")
                 return False
             
-            # 删除收藏记录
-            affected = self.db.execute_delete(
-                "DELETE FROM favorites WHERE user_id = ? AND product_id = ?",
-                (user_id, product_id)
-            )
+            # 删除收藏记录并更新商品的收藏计数(同一事务提交)
+            with self.db.transaction():
+                affected = self.db.execute_delete(
+                    "DELETE FROM favorites WHERE user_id = ? AND product_id = ?",
+                    (user_id, product_id)
+                )
+                if affected > 0:
+                    self.db.execute_update(
+                        "UPDATE products SET favorite_count = favorite_count - 1 WHERE product_id = ?",
+                        (product_id,)
+                    )
             
             if affected > 0:
-                # 更新商品的收藏计数
-                self.db.execute_update(
-                    "UPDATE products SET favorite_count = favorite_count - 1 WHERE product_id = ?",
-                    (product_id,)
-                )
                 print(f"✓ 取消收藏商品ID {product_id} 成功")
                 return True
             
@@ -510,27 +785,50 @@ class ProductService:
     
     def get_all_categories(self) -> List[str]:
         """
-        获取所有商品分类
+        获取所有商品分类(只返回有可售商品的分类,按分类目录顺序)
         
         Returns:
             List[str]: 分类列表
         """
+        return [row['name'] for row in self.get_category_counts()]
+    
+    def get_category_counts(self, include_empty: bool = False) -> List[Dict]:
+        """
+        获取分类目录及各状态的商品数(读取由触发器维护的 categories 表)
+        
+        Args:
+            include_empty: 是否包含没有可售商品的分类
+            
+        Returns:
+            List[Dict]: 分类列表,每项包含 name, available_count, sold_out_count,
+                        removed_count, in_auction_count
+        """
         try:
-            # 查询所有不重复的分类
             query = """
-                SELECT DISTINCT category 
-                FROM products 
-                WHERE status = 'available'
-                ORDER BY category
+                SELECT name, available_count, sold_out_count, removed_count, in_auction_count
+                FROM categories
             """
-            
-            results = self.db.execute_query(query)
-            
-            # 提取分类名称
-            categories = [row['category'] for row in results]
-            
-            return categories
+            if not include_empty:
+                query += " WHERE available_count > 0"
+            query += " ORDER BY position"
+            return self.db.execute_query(query)
             
         except Exception as e:
             print(f"获取分类列表失败: {str(e)}")
             return []
+    
+    def rebuild_popularity_scores(self, weights: Dict[str, float] = None) -> int:
+        """
+        全量重算商品热度(修改热度权重后调用)
+        
+        Args:
+            weights: 新的权重 {'views', 'favorites', 'sales'},为空时沿用数据库中的权重
+            
+        Returns:
+            int: 重算的商品数
+        """
+        from database.migrations import rebuild_popularity_scores
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            rebuild_popularity_scores(cursor, weights)
+            return cursor.rowcount
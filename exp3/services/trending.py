@@ -0,0 +1,165 @@
+"""
+Trending - 近期热门商品
+按分钟/小时分桶的环形缓冲区统计商品近期的浏览与收藏事件,在内存中维护各分类的热门榜
+"""
+
+import heapq
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from config.settings import PRODUCT_CONFIG
+
+
+class _RingCounter:
+    """
+    固定槽位数的时间分桶计数器
+
+    第 n 个时间桶写入 n % size 号槽位,槽位记录所属桶号,
+    被新的时间桶复用时先清零,因此过期的计数自然滑出窗口。
+    """
+
+    __slots__ = ('buckets', 'counts')
+
+    def __init__(self, size: int):
+        self.buckets = [-1] * size
+        self.counts = [0.0] * size
+
+    def add(self, bucket: int, amount: float) -> None:
+        i = bucket % len(self.buckets)
+        if self.buckets[i] != bucket:
+            self.buckets[i] = bucket
+            self.counts[i] = 0.0
+        self.counts[i] += amount
+
+    def total(self, bucket: int) -> float:
+        """窗口 (bucket - size, bucket] 内的计数之和"""
+        oldest = bucket - len(self.buckets)
+        return sum(c for b, c in zip(self.buckets, self.counts) if oldest < b <= bucket)
+
+
+class _Activity:
+    """单个商品的近期事件: 最近一小时按分钟分桶,最近一天按小时分桶"""
+
+    __slots__ = ('category', 'minutes', 'hours')
+
+    def __init__(self, category: str, minute_slots: int, hour_slots: int):
+        self.category = category
+        self.minutes = _RingCounter(minute_slots)
+        self.hours = _RingCounter(hour_slots)
+
+
+class TrendingTracker:
+    """
+    热门商品统计
+
+    热度 = 分钟窗口内的事件权重之和 + day_weight × 小时窗口内的事件权重之和;
+    浏览计 1,收藏计 favorite_weight。只有窗口内有事件的商品保存在内存中,
+    热门榜按分类缓存,仅在该分类有新事件或进入新的分钟桶后重新计算,不扫描 products 表。
+    """
+
+    def __init__(self, top_k: Optional[int] = None, favorite_weight: Optional[float] = None,
+                 day_weight: Optional[float] = None):
+        """
+        初始化热门统计
+
+        Args:
+            top_k: 每个分类保留的热门商品数,默认读取 PRODUCT_CONFIG['trending_top_k']
+            favorite_weight: 一次收藏相当于多少次浏览,默认读取 PRODUCT_CONFIG['trending_favorite_weight']
+            day_weight: 小时窗口计数的权重,默认读取 PRODUCT_CONFIG['trending_day_weight']
+        """
+        self.top_k = top_k or PRODUCT_CONFIG.get('trending_top_k', 50)
+        self.favorite_weight = favorite_weight or PRODUCT_CONFIG.get('trending_favorite_weight', 5.0)
+        self.day_weight = day_weight if day_weight is not None else PRODUCT_CONFIG.get('trending_day_weight', 0.1)
+        self.minute_slots = PRODUCT_CONFIG.get('trending_window_minutes', 60)
+        self.hour_slots = PRODUCT_CONFIG.get('trending_window_hours', 24)
+        self._products: Dict[int, _Activity] = {}
+        self._by_category: Dict[str, Set[int]] = {}
+        self._top: Dict[str, List[Tuple[int, float]]] = {}
+        self._dirty: Set[str] = set()
+        self._refreshed_minute = None
+        self._lock = threading.Lock()
+
+    def record_view(self, product_id: int, category: str, now: Optional[float] = None) -> None:
+        """记录一次商品浏览"""
+        self._record(product_id, category, 1.0, now)
+
+    def record_favorite(self, product_id: int, category: str, now: Optional[float] = None) -> None:
+        """记录一次商品收藏"""
+        self._record(product_id, category, self.favorite_weight, now)
+
+    def _record(self, product_id: int, category: str, amount: float, now: Optional[float]) -> None:
+        now = time.time() if now is None else now
+        with self._lock:
+            activity = self._products.get(product_id)
+            if activity is None or activity.category != category:
+                if activity is not None:
+                    self._by_category[activity.category].discard(product_id)
+                    self._dirty.add(activity.category)
+                activity = _Activity(category, self.minute_slots, self.hour_slots)
+                self._products[product_id] = activity
+                self._by_category.setdefault(category, set()).add(product_id)
+            activity.minutes.add(int(now // 60), amount)
+            activity.hours.add(int(now // 3600), amount)
+            self._dirty.add(category)
+
+    def _score(self, activity: _Activity, now: float) -> float:
+        return activity.minutes.total(int(now // 60)) + self.day_weight * activity.hours.total(int(now // 3600))
+
+    def score(self, product_id: int, now: Optional[float] = None) -> float:
+        """
+        获取商品当前的热度
+
+        Args:
+            product_id: 商品ID
+            now: 当前时间戳,默认为系统时间
+
+        Returns:
+            float: 热度,窗口内没有事件时为 0
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            activity = self._products.get(product_id)
+            return self._score(activity, now) if activity else 0.0
+
+    def top(self, category: Optional[str] = None, now: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        获取热门榜
+
+        Args:
+            category: 分类,为空时返回全站热门榜
+            now: 当前时间戳,默认为系统时间
+
+        Returns:
+            List[Tuple[int, float]]: 按热度降序的 (商品ID, 热度),最多 top_k 项
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._refresh(now)
+            if category is not None:
+                return list(self._top.get(category, []))
+            # 全站前 K 名一定在各分类的前 K 名之中
+            merged = [entry for entries in self._top.values() for entry in entries]
+            return heapq.nlargest(self.top_k, merged, key=lambda e: (e[1], e[0]))
+
+    def _refresh(self, now: float) -> None:
+        """重新计算有新事件的分类;进入新的分钟桶后窗口滑动,所有分类都需要重新计算"""
+        minute = int(now // 60)
+        if minute != self._refreshed_minute:
+            self._refreshed_minute = minute
+            self._dirty.update(self._by_category)
+        for category in self._dirty:
+            scored = []
+            for product_id in list(self._by_category.get(category, ())):
+                score = self._score(self._products[product_id], now)
+                if score > 0:
+                    scored.append((product_id, score))
+                else:
+                    # 窗口内已没有事件,不再保留
+                    del self._products[product_id]
+                    self._by_category[category].discard(product_id)
+            self._top[category] = heapq.nlargest(self.top_k, scored, key=lambda e: (e[1], e[0]))
+            if not self._by_category.get(category):
+                self._by_category.pop(category, None)
+                self._top.pop(category, None)
+        self._dirty.clear()
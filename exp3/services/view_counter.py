@@ -0,0 +1,124 @@
+"""
+View Counter - 商品浏览计数缓冲
+在进程内累加商品浏览次数,按时间间隔或数量阈值批量写回 products.view_count
+"""
+
+import threading
+from typing import Dict, Optional
+
+from config.settings import PRODUCT_CONFIG
+
+
+class ViewCountBuffer:
+    """
+    浏览计数写缓冲(write-behind)
+
+    浏览商品详情只在内存中累加计数,不再逐次 UPDATE 占用写锁;
+    累计的增量由后台线程按间隔、或在待写入次数达到阈值时,用一个事务内的
+    executemany 写回。写回事务提交前,正在写回的增量仍计入 pending()。
+    停止时写回剩余计数。进程异常退出时未写回的计数会丢失。
+    """
+
+    def __init__(self, db_manager, interval: Optional[float] = None,
+                 threshold: Optional[int] = None):
+        """
+        初始化浏览计数缓冲
+
+        Args:
+            db_manager: 数据库管理器实例
+            interval: 后台写回间隔秒数,默认读取 PRODUCT_CONFIG['view_flush_interval']
+            threshold: 待写入浏览次数达到该值时立即写回,默认读取 PRODUCT_CONFIG['view_flush_threshold']
+        """
+        self.db = db_manager
+        self.interval = interval or PRODUCT_CONFIG.get('view_flush_interval', 5.0)
+        self.threshold = threshold or PRODUCT_CONFIG.get('view_flush_threshold', 500)
+        self._counts: Dict[int, int] = {}
+        self._inflight: Dict[int, int] = {}  # 正在写回、尚未提交的增量
+        self._total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, product_id: int) -> None:
+        """
+        记录一次商品浏览
+
+        Args:
+            product_id: 商品ID
+        """
+        with self._lock:
+            self._counts[product_id] = self._counts.get(product_id, 0) + 1
+            self._total += 1
+            full = self._total >= self.threshold
+        if full:
+            self.flush()
+
+    def pending(self, product_id: int) -> int:
+        """
+        获取商品尚未写回数据库的浏览次数
+
+        Args:
+            product_id: 商品ID
+
+        Returns:
+            int: 待写入的浏览次数(含正在写回、尚未提交的次数)
+        """
+        with self._lock:
+            return self._counts.get(product_id, 0) + self._inflight.get(product_id, 0)
+
+    def flush(self) -> int:
+        """
+        立即写回所有累计的浏览次数
+
+        Returns:
+            int: 本次写回的商品数
+        """
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts, self._total = self._counts, {}, 0
+                self._inflight = counts
+            if not counts:
+                return 0
+            try:
+                with self.db.transaction() as conn:
+                    conn.executemany(
+                        "UPDATE products SET view_count = view_count + ? WHERE product_id = ?",
+                        [(count, product_id) for product_id, count in counts.items()]
+                    )
+            except Exception:
+                # 写回失败时把增量放回缓冲,下一轮重试
+                with self._lock:
+                    for product_id, count in counts.items():
+                        self._counts[product_id] = self._counts.get(product_id, 0) + count
+                        self._total += count
+                    self._inflight = {}
+                raise
+            with self._lock:
+                self._inflight = {}
+            return len(counts)
+
+    def start(self) -> None:
+        """启动后台写回线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='view-count-flusher', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"写回浏览次数失败: {str(e)}")
+
+    def stop(self) -> None:
+        """停止后台线程并写回剩余计数"""
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.interval + 1)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"写回浏览次数失败: {str(e)}")
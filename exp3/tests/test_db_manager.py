@@ -0,0 +1,363 @@
+import pytest
+import sys
+import os
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db_manager import DatabaseManager
+from database.connection_pool import ConnectionPool
+from utils.exceptions import DatabaseConnectionError
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "test.db"), pool_size=3)
+    yield manager
+    manager.close()
+
+
+class TestConnectionPool:
+    """测试连接池"""
+
+    def test_connections_are_reused(self, db):
+        """连续操作复用同一连接而不是每次新建"""
+        before = db.get_pool_stats()['created']
+        for _ in range(20):
+            db.execute_query("SELECT COUNT(*) AS c FROM users")
+        stats = db.get_pool_stats()
+        assert stats['created'] == before
+        assert stats['reused'] >= 20
+        assert stats['in_use'] == 0
+
+    def test_foreign_keys_enabled_on_pooled_connection(self, db):
+        """复用的连接保留 PRAGMA foreign_keys 设置"""
+        db.execute_query("SELECT 1")
+        rows = db.execute_query("PRAGMA foreign_keys")
+        assert rows[0]['foreign_keys'] == 1
+
+    def test_rollback_on_error_keeps_connection_usable(self, db):
+        """异常回滚后连接仍可正常归还复用"""
+        with pytest.raises(Exception):
+            with db.get_connection() as conn:
+                conn.execute("INSERT INTO admins (username, password, email) VALUES ('a', 'p', 'a@x.com')")
+                raise RuntimeError("boom")
+        assert db.execute_query("SELECT COUNT(*) AS c FROM admins")[0]['c'] == 0
+        assert db.get_pool_stats()['in_use'] == 0
+
+    def test_pool_size_is_respected(self, tmp_path):
+        """连接数不超过连接池大小,耗尽时等待超时报错"""
+        pool = ConnectionPool(str(tmp_path / "p.db"), pool_size=2, acquire_timeout=0.05)
+        c1 = pool.acquire()
+        c2 = pool.acquire()
+        with pytest.raises(DatabaseConnectionError):
+            pool.acquire()
+        pool.release(c1)
+        c3 = pool.acquire()
+        assert c3 is c1
+        pool.release(c2)
+        pool.release(c3)
+        stats = pool.get_stats()
+        assert stats['created'] == 2
+        assert stats['timeouts'] == 1
+        assert stats['peak_in_use'] == 2
+        pool.close_all()
+
+    def test_unhealthy_connection_is_replaced(self, tmp_path):
+        """健康检查失败的连接被丢弃并重建"""
+        pool = ConnectionPool(str(tmp_path / "p.db"), pool_size=1, health_check_interval=0)
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.close()  # 模拟连接失效
+        fresh = pool.acquire()
+        assert fresh is not conn
+        assert fresh.execute("SELECT 1").fetchone()[0] == 1
+        pool.release(fresh)
+        stats = pool.get_stats()
+        assert stats['health_check_failures'] == 1
+        assert stats['total'] == 1
+        pool.close_all()
+
+    def test_concurrent_access(self, db):
+        """多线程并发读写共享连接池"""
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(10):
+                    db.execute_insert(
+                        "INSERT INTO admins (username, password, email) VALUES (?, 'p', ?)",
+                        (f"u{n}_{i}", f"u{n}_{i}@x.com")
+                    )
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert not errors
+        assert db.execute_query("SELECT COUNT(*) AS c FROM admins")[0]['c'] == 60
+        assert db.get_pool_stats()['total'] <= 3
+
+
+class TestPragmaProfile:
+    """测试 PRAGMA 性能档位"""
+
+    def test_default_profile_uses_wal(self, db):
+        """默认档位启用 WAL 并使用配置的 busy_timeout"""
+        assert db.execute_query("PRAGMA journal_mode")[0]['journal_mode'] == 'wal'
+        assert db.execute_query("PRAGMA synchronous")[0]['synchronous'] == 1  # NORMAL
+        assert db.execute_query("PRAGMA busy_timeout")[0]['timeout'] == db.profile['busy_timeout']
+
+    def test_unknown_profile_rejected(self, tmp_path):
+        """未知档位直接报错"""
+        with pytest.raises(ValueError):
+            DatabaseManager(str(tmp_path / "x.db"), profile='no_such_profile')
+
+    def test_legacy_profile(self, tmp_path):
+        """legacy 档位保持回滚日志模式且不启动检查点线程"""
+        manager = DatabaseManager(str(tmp_path / "legacy.db"), profile='legacy')
+        try:
+            assert manager.execute_query("PRAGMA journal_mode")[0]['journal_mode'] == 'delete'
+            assert manager.checkpointer is None
+        finally:
+            manager.close()
+
+    def test_readers_not_blocked_by_writer(self, db):
+        """WAL 模式下未提交的写事务不阻塞读操作"""
+        writer = db.pool.acquire()
+        try:
+            writer.execute("BEGIN IMMEDIATE")
+            writer.execute(
+                "INSERT INTO products (seller_id, title, price, category) VALUES (1, 'w', 1.0, '其他')"
+            )
+            rows = db.execute_query("SELECT COUNT(*) AS c FROM products")
+            assert rows[0]['c'] == 0
+        finally:
+            writer.rollback()
+            db.pool.release(writer)
+
+    def test_manual_checkpoint(self, db):
+        """检查点可手动触发"""
+        db.execute_insert("INSERT INTO admins (username, password, email) VALUES ('c', 'p', 'c@x.com')")
+        result = db.checkpointer.checkpoint()
+        assert result is not None and result[0] == 0
+
+    def test_checkpointer_thread_started_on_demand(self, db):
+        """创建管理器不启动检查点线程,start_checkpointer() 只启动一次"""
+        def names():
+            return [th.name for th in threading.enumerate()].count('wal-checkpointer')
+
+        before = names()
+        other = DatabaseManager(db.db_path)
+        try:
+            assert names() == before
+            other.start_checkpointer()
+            other.start_checkpointer()
+            assert names() == before + 1
+        finally:
+            other.close()
+        assert names() == before
+
+
+class TestMigrations:
+    """测试版本迁移"""
+
+    def test_fresh_database_is_at_latest_version(self, db):
+        """新数据库执行全部迁移,重复执行无操作"""
+        from database.migrations import LATEST_VERSION
+        assert db.get_schema_version() == LATEST_VERSION
+        assert db.migrate(verbose=False) == []
+
+    def test_hot_path_queries_use_indexes(self, db):
+        """服务层热点查询走索引而不是全表扫描"""
+        queries = [
+            ("SELECT * FROM orders WHERE seller_id=? AND status=? ORDER BY created_at DESC", (1, 'paid')),
+            ("SELECT * FROM orders WHERE buyer_id=? AND status=? ORDER BY created_at DESC", (1, 'paid')),
+            ("SELECT * FROM products WHERE category = ? AND status = 'available' ORDER BY price ASC", ('原神',)),
+            ("SELECT * FROM products WHERE category = ? AND status = 'available' "
+             "ORDER BY popularity_score DESC, product_id DESC LIMIT 20", ('原神',)),
+            ("SELECT * FROM messages WHERE receiver_id=? AND sender_id=? AND status <> 'read'", (1, 2)),
+            ("SELECT COUNT(*) FROM messages WHERE receiver_id=? AND sender_id=? AND msg_id > ?", (1, 2, 10)),
+        ]
+        for query, params in queries:
+            plan = " ".join(row['detail'] for row in db.execute_query("EXPLAIN QUERY PLAN " + query, params))
+            assert "USING INDEX" in plan or "USING COVERING INDEX" in plan, plan
+            assert "USE TEMP B-TREE" not in plan, plan
+
+    def test_no_overlapping_indexes(self, db):
+        """不创建重叠的索引,只按用户筛选的列表使用带状态列的索引前缀"""
+        names = {r['name'] for r in db.execute_query("SELECT name FROM sqlite_master WHERE type='index'")}
+        assert names.isdisjoint({
+            'idx_orders_buyer_created', 'idx_orders_seller_created', 'idx_products_seller_created',
+            'idx_messages_sender_receiver_created', 'idx_messages_receiver_sender_created',
+            'idx_messages_receiver_created', 'idx_messages_receiver_status',
+        })
+        plan = " ".join(row['detail'] for row in db.execute_query(
+            "EXPLAIN QUERY PLAN SELECT * FROM orders WHERE buyer_id=? ORDER BY created_at DESC", (1,)
+        ))
+        assert "idx_orders_buyer_status_created" in plan, plan
+
+    def test_triggers_do_not_call_python_functions(self, db):
+        """触发器不调用连接上注册的 Python 函数,未注册的连接也能写入"""
+        triggers = db.execute_query(
+            "SELECT name, sql FROM sqlite_master WHERE type='trigger' AND tbl_name IN ('products', 'messages')"
+        )
+        assert triggers
+        for row in triggers:
+            assert 'cjk_tokens' not in row['sql'], row['name']
+
+    def test_legacy_sellers_table_is_merged(self, tmp_path):
+        """旧版 sellers 表数据合并到 users 表"""
+        import sqlite3
+        path = str(tmp_path / "legacy.db")
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE users (user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL, email TEXT UNIQUE NOT NULL, role TEXT DEFAULT 'user',
+                is_verified BOOLEAN DEFAULT 0, profile TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE sellers (seller_id INTEGER PRIMARY KEY, user_id INTEGER, shop_name TEXT,
+                rating REAL, total_sales INTEGER);
+            CREATE TABLE products (product_id INTEGER PRIMARY KEY AUTOINCREMENT, seller_id INTEGER NOT NULL,
+                title TEXT NOT NULL, description TEXT, price REAL NOT NULL, category TEXT NOT NULL, images TEXT,
+                stock INTEGER DEFAULT 1, status TEXT DEFAULT 'available', auctionable BOOLEAN DEFAULT 0,
+                view_count INTEGER DEFAULT 0, favorite_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE orders (order_id INTEGER PRIMARY KEY AUTOINCREMENT, buyer_id INTEGER NOT NULL,
+                seller_id INTEGER NOT NULL, product_id INTEGER NOT NULL, quantity INTEGER DEFAULT 1,
+                total_price REAL NOT NULL, status TEXT DEFAULT 'pending', shipping_address TEXT NOT NULL,
+                tracking_number TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, paid_at TIMESTAMP,
+                shipped_at TIMESTAMP, completed_at TIMESTAMP);
+            CREATE TABLE auctions (auction_id INTEGER PRIMARY KEY AUTOINCREMENT, product_id INTEGER UNIQUE NOT NULL,
+                seller_id INTEGER NOT NULL, start_price REAL NOT NULL, current_bid REAL NOT NULL,
+                current_bidder_id INTEGER, bid_increment REAL DEFAULT 1.0,
+                start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, end_time TIMESTAMP NOT NULL,
+                status TEXT DEFAULT 'active');
+            INSERT INTO users (username, password, email) VALUES ('alice', 'x', 'a@x.com');
+            INSERT INTO sellers VALUES (7, 1, 'Alice Shop', 4.5, 3);
+            INSERT INTO products (seller_id, title, price, category) VALUES (7, 'p', 1.0, '其他');
+            INSERT INTO orders (buyer_id, seller_id, product_id, total_price, shipping_address)
+                VALUES (1, 7, 1, 1.0, 'addr');
+        """)
+        conn.commit()
+        conn.close()
+
+        manager = DatabaseManager(path)
+        try:
+            user = manager.execute_query("SELECT * FROM users WHERE username='alice'")[0]
+            assert user['shop_name'] == 'Alice Shop' and user['role'] == 'seller'
+            assert manager.execute_query("SELECT seller_id FROM products")[0]['seller_id'] == 1
+            order = manager.execute_query("SELECT * FROM orders")[0]
+            assert order['seller_id'] == 1 and 'cancel_reject_reason' in order
+            tables = {r['name'] for r in manager.execute_query("SELECT name FROM sqlite_master WHERE type='table'")}
+            assert 'sellers' not in tables
+        finally:
+            manager.close()
+
+
+class TestWarmStartup:
+    """测试启动快速路径"""
+
+    def test_warm_start_skips_schema_ddl(self, tmp_path, monkeypatch):
+        """结构已是最新时不再执行建表和迁移"""
+        path = str(tmp_path / "warm.db")
+        DatabaseManager(path).close()
+
+        calls = []
+        monkeypatch.setattr(DatabaseManager, 'migrate', lambda self, verbose=True: calls.append(1) or [])
+        manager = DatabaseManager(path)
+        try:
+            assert manager.is_schema_current()
+            assert calls == []
+        finally:
+            manager.close()
+
+    def test_outdated_version_runs_full_init(self, tmp_path):
+        """版本标记落后时执行完整初始化并补齐迁移"""
+        path = str(tmp_path / "upgrade.db")
+        manager = DatabaseManager(path)
+        with manager.get_connection() as conn:
+            conn.execute("PRAGMA user_version = 0")
+            conn.execute("DROP INDEX idx_orders_buyer_status_created")
+            conn.execute("DELETE FROM schema_migrations WHERE version = 3")
+        manager.close()
+
+        manager = DatabaseManager(path)
+        try:
+            assert manager.is_schema_current()
+            names = {r['name'] for r in manager.execute_query("SELECT name FROM sqlite_master WHERE type='index'")}
+            assert 'idx_orders_buyer_status_created' in names
+        finally:
+            manager.close()
+
+
+class TestTransaction:
+    """测试工作单元事务"""
+
+    def _count_admins(self, db):
+        return db.execute_query("SELECT COUNT(*) AS c FROM admins")[0]['c']
+
+    def _add_admin(self, db, name):
+        return db.execute_insert(
+            "INSERT INTO admins (username, password, email) VALUES (?, 'p', ?)", (name, f"{name}@x.com")
+        )
+
+    def test_statements_join_transaction_and_commit_once(self, db):
+        """事务内的 execute_* 共用一个连接,退出时一次提交"""
+        with db.transaction() as conn:
+            self._add_admin(db, 'a')
+            self._add_admin(db, 'b')
+            assert db.in_transaction()
+            assert conn.in_transaction
+            assert db.get_pool_stats()['in_use'] == 1
+        assert not db.in_transaction()
+        assert self._count_admins(db) == 2
+
+    def test_exception_rolls_back_everything(self, db):
+        """异常时事务内的所有修改一起回滚"""
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                self._add_admin(db, 'a')
+                self._add_admin(db, 'b')
+                raise RuntimeError("boom")
+        assert self._count_admins(db) == 0
+
+    def test_nested_savepoint_rolls_back_inner_only(self, db):
+        """嵌套事务使用保存点,内层失败只回滚内层"""
+        with db.transaction():
+            self._add_admin(db, 'outer')
+            with pytest.raises(RuntimeError):
+                with db.transaction():
+                    self._add_admin(db, 'inner')
+                    raise RuntimeError("inner failed")
+            with db.transaction():
+                self._add_admin(db, 'inner2')
+        names = {r['username'] for r in db.execute_query("SELECT username FROM admins")}
+        assert names == {'outer', 'inner2'}
+
+    def test_on_commit_discards_callbacks_of_rolled_back_savepoint(self, db):
+        """回滚到保存点时丢弃其中注册的回调,释放的保存点中的回调在外层提交后执行"""
+        called = []
+        with db.transaction():
+            with pytest.raises(RuntimeError):
+                with db.transaction():
+                    db.on_commit(lambda: called.append('rolled back'))
+                    raise RuntimeError("inner failed")
+            with db.transaction():
+                with db.transaction():
+                    db.on_commit(lambda: called.append('released'))
+            assert called == []
+        assert called == ['released']
+
+    def test_transaction_is_per_thread(self, db):
+        """其他线程的操作不加入当前线程的事务"""
+        seen = []
+        with db.transaction():
+            self._add_admin(db, 'a')
+            th = threading.Thread(target=lambda: seen.append(db.in_transaction()))
+            th.start()
+            th.join()
+        assert seen == [False]
@@ -0,0 +1,112 @@
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.i18n import I18n, compile_catalog
+
+
+class TestCompiledCatalog:
+    """测试预编译的扁平翻译目录"""
+
+    @pytest.mark.parametrize('language', I18n.SUPPORTED_LANGUAGES)
+    def test_every_key_matches_nested_lookup(self, language):
+        """扁平目录中的每个键与逐层查找得到的翻译一致"""
+        i18n = I18n(language)
+
+        def nested(key):
+            value = i18n.translations
+            for k in key.split('.'):
+                value = value.get(k)
+            return value
+
+        for key, entry in i18n.catalog.items():
+            expected = nested(key)
+            assert i18n.translate(key) == expected
+            if isinstance(expected, str):
+                params = {name: 7 for name in (i18n.catalog[key].fields or ())}
+                if params:
+                    assert i18n.translate(key, **params) == expected.format(**params)
+
+    def test_format_edge_cases(self):
+        """缺少参数返回原文,转义花括号与位置参数保持 str.format 的行为"""
+        i18n = I18n('zh_CN')
+        i18n.catalog = compile_catalog({'a': {
+            'greet': '你好 {name}',
+            'braces': '{{字面}}',
+            'attr': '{user.name}',
+            'spec': '{price:.2f} 元,{name!r}',
+            'mixed': '{user.name} 的订单 #{order_id}',
+            'positional': '{0}',
+            'section': {'x': '1'},
+        }})
+        assert i18n.translate('a.greet', name='x') == '你好 x'
+        assert i18n.translate('a.greet', other='x') == '你好 {name}'
+        assert i18n.translate('a.greet') == '你好 {name}'
+        assert i18n.translate('a.braces') == '{{字面}}'
+        assert i18n.translate('a.braces', name='x') == '{字面}'
+        assert i18n.translate('a.attr', user=type('U', (), {'name': 'bob'})) == 'bob'
+        assert i18n.translate('a.spec', price=3, name='x') == "3.00 元,'x'"
+        assert i18n.translate('a.mixed', user=type('U', (), {'name': 'bob'}), order_id=7) == 'bob 的订单 #7'
+        assert i18n.catalog['a.greet'].segments == ['你好 ', 'name', '']
+        assert i18n.catalog['a.mixed'].segments is None
+        with pytest.raises(IndexError):
+            i18n.translate('a.positional', name='x')
+        assert i18n.translate('a.section') == {'x': '1'}
+        assert i18n.translate('a.section.x.y') == 'a.section.x.y'
+        assert i18n.translate('missing') == 'missing'
+
+
+class TestLazyLoading:
+    """测试按语言加载与编译缓存"""
+
+    @pytest.fixture
+    def source(self, tmp_path, monkeypatch):
+        import json
+        path = tmp_path / "translations.json"
+        path.write_text(json.dumps({
+            'zh_CN': {'hello': '你好'},
+            'en_US': {'hello': 'Hello'},
+            'ja_JP': {'hello': 'こんにちは'},
+        }, ensure_ascii=False), encoding='utf-8')
+        monkeypatch.setattr(I18n, 'SOURCE_PATH', str(path))
+        monkeypatch.setattr(I18n, 'CACHE_DIR', str(tmp_path / "cache"))
+        monkeypatch.setattr(I18n, '_translations_cache', {})
+        monkeypatch.setattr(I18n, '_catalog_cache', {})
+        return path
+
+    def _count_json_loads(self, monkeypatch):
+        import json
+        calls = []
+        original = json.load
+        monkeypatch.setattr(json, 'load', lambda f: calls.append(1) or original(f))
+        return calls
+
+    def test_only_requested_language_is_loaded(self, source, monkeypatch):
+        """只加载当前语言,切换语言时从缓存读取新语言而不解析 JSON"""
+        calls = self._count_json_loads(monkeypatch)
+        i18n = I18n('zh_CN')
+        assert i18n.t('hello') == '你好'
+        assert list(I18n._translations_cache) == ['zh_CN'] and len(calls) == 1
+
+        i18n.set_language('en_US')
+        assert i18n.t('hello') == 'Hello'
+        assert list(I18n._translations_cache) == ['zh_CN', 'en_US'] and len(calls) == 1
+
+        # 新进程(清空内存缓存)直接读取编译缓存
+        monkeypatch.setattr(I18n, '_translations_cache', {})
+        assert I18n('ja_JP').t('hello') == 'こんにちは'
+        assert len(calls) == 1
+
+    def test_stale_cache_is_rebuilt(self, source, monkeypatch):
+        """源文件修改后缓存失效,重新解析 JSON"""
+        import json
+        calls = self._count_json_loads(monkeypatch)
+        i18n = I18n('zh_CN')
+        source.write_text(json.dumps({'zh_CN': {'hello': '您好'}}, ensure_ascii=False), encoding='utf-8')
+        i18n.reload_translations()
+        assert i18n.t('hello') == '您好' and len(calls) == 2
+        # 文件中没有的语言使用默认语言
+        assert i18n.set_language('en_US') and i18n.t('hello') == '您好'
+        assert len(calls) == 2
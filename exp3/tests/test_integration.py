@@ -1,7 +1,9 @@
 import pytest
 import sys
 import os
+import re
 from datetime import datetime
+from contextlib import contextmanager
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -17,6 +19,14 @@ class MockDB:
         self.messages = []
         self.oid_counter = 1
     
+    @contextmanager
+    def transaction(self):
+        yield self
+    
+    def on_commit(self, callback):
+        # 发件箱记录已视为已发送的消息,无需投递
+        pass
+    
     def execute_query(self, query, params):
         if "SELECT * FROM orders WHERE order_id=?" in query:
             return [self.orders[params[0]]] if params[0] in self.orders else []
@@ -51,7 +61,8 @@ class MockDB:
                 'completed_at': None, 'cancel_reject_reason': None, 'refund_reject_reason': None
             }
             return oid
-        if "INSERT INTO messages" in query:
+        if "INSERT INTO notification_outbox" in query:
+            # 服务通知写入发件箱,此处直接视为已发送的消息
             self.messages.append({
                 'sender_id': params[0],
                 'receiver_id': params[1],
@@ -62,36 +73,44 @@ class MockDB:
             return len(self.messages)
         return None
     
+    def execute_returning(self, query, params):
+        if "UPDATE orders SET" in query and "RETURNING" in query:
+            # 模拟比较并设置的订单状态迁移
+            m = re.search(r"SET (.*) WHERE order_id=\? AND status IN \(([?, ]*)\)( AND (\w+)=\?)?", query)
+            set_fields = [f.split('=')[0].strip() for f in m.group(1).split(',')]
+            n_status = m.group(2).count('?')
+            values = params[:len(set_fields)]
+            oid = params[len(set_fields)]
+            statuses = params[len(set_fields) + 1:len(set_fields) + 1 + n_status]
+            order = self.orders.get(oid)
+            if not order or order['status'] not in statuses:
+                return []
+            if m.group(4) and order[m.group(4)] != params[-1]:
+                return []
+            for field, value in zip(set_fields, values):
+                order[field] = value
+            return [dict(order)]
+        if "UPDATE products" in query and "SET stock = stock - ?" in query:
+            # 模拟带 stock >= ? 条件的原子扣减
+            qty, pid = params[0], params[2]
+            product = self.products.get(pid)
+            if not product or product.get('status') != 'available' or product['stock'] < qty:
+                return []
+            product['stock'] -= qty
+            if product['stock'] <= 0:
+                product['status'] = 'sold_out'
+            return [dict(product)]
+        return []
+    
     def execute_update(self, query, params):
-        if "UPDATE orders" in query and "WHERE order_id=?" in query:
-            oid = params[-1]
-            if "SET status=?, paid_at=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['paid_at'] = params[1]
-            elif "SET status=?, tracking_number=?, shipped_at=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['tracking_number'] = params[1]
-                self.orders[oid]['shipped_at'] = params[2]
-            elif "SET status=?, completed_at=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['completed_at'] = params[1]
-            elif "SET status=?" in query:
-                self.orders[oid]['status'] = params[0]
-            elif "SET status=?, cancel_reject_reason=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['cancel_reject_reason'] = params[1]
-            elif "SET status=?, refund_reject_reason=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['refund_reject_reason'] = params[1]
-            return 1
-        if "UPDATE products SET stock=?" in query:
-            if "WHERE product_id=?" in query:
-                pid = params[-1]
-                if pid in self.products:
-                    self.products[pid]['stock'] = params[0]
-                    if "status=?" in query:
-                        self.products[pid]['status'] = params[1]
-            return 1
+        if "UPDATE products" in query and "SET stock = stock + ?" in query:
+            qty, pid = params
+            if pid in self.products:
+                self.products[pid]['stock'] += qty
+                if self.products[pid].get('status') == 'sold_out':
+                    self.products[pid]['status'] = 'available'
+                return 1
+            return 0
         return 0
 
 
@@ -0,0 +1,371 @@
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db_manager import DatabaseManager
+from services.message_service import MessageService
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "messages.db"), pool_size=3)
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def service(db):
+    return MessageService(db)
+
+
+@pytest.fixture
+def users(db):
+    return [
+        db.execute_insert("INSERT INTO users (username, password, email) VALUES (?, 'p', ?)",
+                          (name, f"{name}@x.com"))
+        for name in ('alice', 'bob', 'carol')
+    ]
+
+
+class TestMessageSearch:
+    """测试消息全文检索"""
+
+    def test_search_only_own_messages(self, service, users):
+        """只返回当前用户参与的消息"""
+        alice, bob, carol = users
+        mine = service.send_message(alice, bob, '请问星穹铁道流萤手办还有吗')
+        other = service.send_message(bob, carol, '星穹铁道流萤手办已售出')
+        reply = service.send_message(bob, alice, '流萤手办还有两个')
+        assert [r['msg_id'] for r in service.search_messages(alice, '流萤 手办')] == [reply, mine]
+        assert [r['msg_id'] for r in service.search_messages(carol, '星穹铁道')] == [other]
+
+    def test_snippet_highlights_matches(self, service, users):
+        """结果附带标记了关键词的摘要"""
+        alice, bob, _ = users
+        service.send_message(alice, bob, '我想买ＦＡＴＥ的色纸')
+        rows = service.search_messages(bob, 'fate 色纸')
+        assert rows[0]['snippet'] == '我想买[ＦＡＴＥ]的[色纸]'
+
+    def test_index_follows_delete(self, service, users):
+        """删除消息后不再被检索到"""
+        alice, bob, _ = users
+        msg_id = service.send_message(alice, bob, '明天发货')
+        assert service.search_messages(alice, '发货')
+        assert service.delete_message(msg_id, bob)
+        assert service.search_messages(alice, '发货') == []
+
+    def test_service_messages_not_indexed(self, db, service, users):
+        """服务消息(JSON 模板)不进入索引"""
+        alice, bob, _ = users
+        db.execute_insert(
+            "INSERT INTO messages (sender_id, receiver_id, content, msg_type) VALUES (?, ?, ?, 'service')",
+            (alice, bob, '{"key": "order.service_order_created", "params": {}}')
+        )
+        assert service.search_messages(bob, 'order') == []
+        assert db.execute_query("SELECT COUNT(*) AS c FROM messages_fts")[0]['c'] == 0
+
+    def test_plain_connection_can_write_messages(self, db, service, users):
+        """索引由服务层分词写入,未注册 cjk_tokens 的连接也能写入消息"""
+        import sqlite3
+        alice, bob, _ = users
+        msg_id = service.send_message(alice, bob, '明天发货')
+        conn = sqlite3.connect(db.db_path)
+        try:
+            conn.execute(
+                "INSERT INTO messages (sender_id, receiver_id, content) VALUES (?, ?, '外部消息')", (bob, alice)
+            )
+            conn.execute("UPDATE messages SET status = 'read' WHERE msg_id = ?", (msg_id,))
+            conn.commit()
+        finally:
+            conn.close()
+        assert [r['msg_id'] for r in service.search_messages(alice, '明天')] == [msg_id]
+
+    def test_dispatched_notifications_are_indexed(self, db, service, users):
+        """发件箱中的非服务消息投递时写入索引"""
+        from services.notification_dispatcher import NotificationDispatcher
+        alice, bob, _ = users
+        db.execute_insert(
+            "INSERT INTO notification_outbox (sender_id, receiver_id, content, msg_type) VALUES (?, ?, ?, ?)",
+            (alice, bob, '拍卖即将结束', 'text')
+        )
+        db.execute_insert(
+            "INSERT INTO notification_outbox (sender_id, receiver_id, content) VALUES (?, ?, ?)",
+            (alice, bob, '拍卖服务通知')
+        )
+        assert NotificationDispatcher(db).dispatch() == 2
+        assert len(service.search_messages(bob, '拍卖')) == 1
+
+
+class TestConversations:
+    """测试会话摘要表"""
+
+    def _summary(self, db, a, b):
+        lo, hi = min(a, b), max(a, b)
+        rows = db.execute_query(
+            "SELECT last_message_id, unread_lo, unread_hi FROM conversations WHERE user_lo=? AND user_hi=?",
+            (lo, hi)
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        return row['last_message_id'], {lo: row['unread_lo'], hi: row['unread_hi']}
+
+    def test_summary_follows_send_read_delete(self, db, service, users):
+        """发送、已读、删除后摘要与消息表一致"""
+        alice, bob, _ = users
+        m1 = service.send_message(alice, bob, 'hi')
+        m2 = service.send_message(alice, bob, 'there')
+        m3 = service.send_message(bob, alice, 'yo')
+        assert self._summary(db, alice, bob) == (m3, {alice: 1, bob: 2})
+
+        service.mark_as_read(m1, bob)
+        assert self._summary(db, alice, bob) == (m3, {alice: 1, bob: 1})
+        service.mark_conversation_as_read(bob, alice)
+        service.mark_conversation_as_read(bob, alice)
+        assert self._summary(db, alice, bob) == (m3, {alice: 1, bob: 0})
+
+        service.delete_message(m3, alice)
+        assert self._summary(db, alice, bob) == (m2, {alice: 0, bob: 0})
+        service.delete_message(m2, alice)
+        service.delete_message(m1, alice)
+        assert self._summary(db, alice, bob) is None
+
+    def test_inbox_lists_latest_message_per_peer(self, service, users):
+        """收件箱每个联系人一条最新消息,按活跃时间倒序"""
+        alice, bob, carol = users
+        service.send_message(alice, bob, 'b1')
+        service.send_message(carol, alice, 'c1')
+        latest_bob = service.send_message(bob, alice, 'b2')
+        rows = service.get_user_messages(alice)
+        assert [r['content'] for r in rows] == ['b2', 'c1']
+        assert rows[0]['msg_id'] == latest_bob
+        assert [r['content'] for r in service.get_user_messages(carol)] == ['c1']
+
+    def test_inbox_keeps_old_contacts(self, db, service, users):
+        """历史消息很多时也不会丢失较早的联系人"""
+        alice, bob, carol = users
+        service.send_message(carol, alice, 'old contact')
+        with db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO messages (sender_id, receiver_id, content) VALUES (?, ?, ?)",
+                [(bob, alice, f"m{i}") for i in range(1100)]
+            )
+        peers = {r['sender_id'] for r in service.get_user_messages(alice)}
+        assert peers == {bob, carol}
+
+    def test_conversation_cursor(self, db, service, users):
+        """会话消息按游标顺序翻页"""
+        a, b, _ = users
+        for i in range(5):
+            db.execute_insert(
+                "INSERT INTO messages (sender_id, receiver_id, content, created_at) "
+                "VALUES (?, ?, ?, '2025-01-01 00:00:00')",
+                (a if i % 2 else b, b if i % 2 else a, f"m{i}")
+            )
+        first = service.get_conversation(a, b, limit=2)
+        rest = service.get_conversation(a, b, limit=10, cursor=service.conversation_cursor(first[-1]))
+        assert [m['content'] for m in first + rest] == [f"m{i}" for i in range(5)]
+
+
+class TestInbox:
+    """测试收件箱联表查询"""
+
+    def test_inbox_single_query(self, db, service, users, monkeypatch):
+        """50 个联系人的收件箱只需一次查询"""
+        alice = users[0]
+        peers = [
+            db.execute_insert("INSERT INTO users (username, password, email, shop_name) VALUES (?, 'p', ?, ?)",
+                              (f"peer{i}", f"peer{i}@x.com", f"店铺{i}" if i % 2 else None))
+            for i in range(50)
+        ]
+        for peer in peers:
+            service.send_message(peer, alice, 'hello')
+            service.send_message(alice, peer, 'reply')
+            service.send_message(peer, alice, 'again')
+
+        calls = []
+        original = db.execute_query
+        monkeypatch.setattr(db, 'execute_query', lambda q, p=(): calls.append(q) or original(q, p))
+        inbox = service.get_inbox(alice, limit=50)
+        assert len(calls) == 1
+        assert len(inbox) == 50
+
+        newest = inbox[0]
+        assert newest['peer_id'] == peers[-1] and newest['peer_name'] == 'peer49'
+        assert newest['is_seller'] and newest['shop_name'] == '店铺49'
+        assert newest['unread'] == 2
+        assert newest['last']['content'] == 'again' and newest['last']['sender_id'] == peers[-1]
+        assert not inbox[1]['is_seller']
+
+
+class TestReadWatermarks:
+    """测试会话已读水位"""
+
+    def test_mark_backlog_read_is_one_row_write(self, db, service, users):
+        """标记大量未读为已读只写一行,不改动消息行"""
+        alice, bob, _ = users
+        with db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO messages (sender_id, receiver_id, content) VALUES (?, ?, ?)",
+                [(bob, alice, f"m{i}") for i in range(10000)]
+            )
+        assert service.get_unread_count(alice) == 10000
+
+        with db.transaction() as conn:
+            before = conn.total_changes
+            assert service.mark_conversation_as_read(alice, bob)
+            assert conn.total_changes - before == 1
+        assert service.get_unread_count(alice) == 0
+        assert service.mark_conversation_as_read(alice, bob) is False
+        assert db.execute_query("SELECT COUNT(*) AS c FROM messages WHERE status='read'")[0]['c'] == 0
+
+    def test_mark_single_message_moves_watermark(self, service, users):
+        """标记单条消息时之前的消息一并视为已读,之后的仍未读"""
+        alice, bob, carol = users
+        m1 = service.send_message(bob, alice, 'a')
+        m2 = service.send_message(bob, alice, 'b')
+        service.send_message(bob, alice, 'c')
+        service.send_message(carol, alice, 'd')
+        assert service.mark_as_read(m2, bob) is False  # 发送方不能标记
+        assert service.mark_as_read(m2, alice)
+        assert service.get_unread_count(alice) == 2
+        rows = service.get_conversation(alice, bob)
+        assert [r['status'] for r in rows] == ['read', 'read', 'sent']
+        assert service.get_message_by_id(m1).status.value == 'read'
+        # 水位不会后退,已读的消息再次标记返回 False
+        assert service.mark_as_read(m1, alice) is False
+        assert service.get_read_watermarks(alice, bob)[alice] == m2
+
+    def test_stale_message_status_is_ignored(self, db, service, users):
+        """旧数据中的 status / read_at 不再返回,收件箱与单条消息都按已读水位显示"""
+        alice, bob, _ = users
+        m1 = service.send_message(bob, alice, 'a')
+        m2 = service.send_message(bob, alice, 'b')
+        db.execute_update("UPDATE messages SET status = 'read', read_at = CURRENT_TIMESTAMP")
+        last = service.get_inbox(alice)[0]['last']
+        assert last['msg_id'] == m2 and last['status'] != 'read' and 'read_at' not in last
+        assert service.get_message_by_id(m2).status.value != 'read'
+        assert service.get_message_by_id(m2).read_at is None
+
+        assert service.mark_as_read(m2, alice)
+        assert service.get_inbox(alice)[0]['last']['status'] == 'read'
+        assert service.get_inbox(bob)[0]['last']['status'] == 'read'
+        assert service.get_message_by_id(m1).status.value == 'read'
+
+    def test_unread_count_uses_index_range(self, db):
+        """剩余未读数按 (receiver_id, sender_id) 索引做 msg_id 范围计数"""
+        plan = db.execute_query(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM messages WHERE receiver_id=? AND sender_id=? AND msg_id > ?",
+            (1, 2, 0)
+        )
+        assert 'rowid>?' in plan[0]['detail'] and 'USING COVERING INDEX' in plan[0]['detail']
+
+
+class TestServiceMessageTemplates:
+    """测试服务消息模板编码"""
+
+    def test_encode_is_compact_and_renders_per_language(self, service):
+        """服务消息只存模板ID和参数值,显示时按当前语言渲染"""
+        from config.i18n import set_language
+        content = service.templates.encode('order.service_order_shipped',
+                                           {'order_id': 42, 'tracking_number': 'SF\x1f1'})
+        assert content.split('\x1f')[1:] == ['42', 'SF 1']
+        assert 'order' not in content
+        message = {'content': content, 'msg_type': 'service'}
+        try:
+            set_language('en_US')
+            assert service.render_content(message) == 'Order #42 has been shipped, tracking number: SF 1.'
+            set_language('zh_CN')
+            assert service.render_content(message) == '订单 #42 已发货，物流单号: SF 1。'
+        finally:
+            set_language('zh_CN')
+        assert service.render_content({'content': '123', 'msg_type': 'text'}) == '123'
+
+    def test_unknown_key_is_registered(self, db, service):
+        """表中没有的翻译键自动登记新模板"""
+        content = service.templates.encode('order.not_a_template', {'x': 1})
+        assert service.templates.decode(content) == ('order.not_a_template', {'x': '1'})
+        assert db.execute_query("SELECT param_names FROM message_templates WHERE key='order.not_a_template'")[0]['param_names'] == 'x'
+
+    def test_rolled_back_registration_is_not_cached(self, db):
+        """登记模板的事务回滚后缓存中没有该模板,之后登记的翻译键不会与之共用ID"""
+        from services.message_templates import MessageTemplateRegistry
+        registry = MessageTemplateRegistry(db)
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                lost = registry.encode('order.rolled_back_notice', {'n': 1})
+                raise RuntimeError("boom")
+        assert registry.decode(lost) is None
+        content = registry.encode('order.committed_notice', {'n': 2})
+        assert registry.decode(content) == ('order.committed_notice', {'n': '2'})
+        assert registry.decode(lost) == ('order.committed_notice', {'n': '1'})  # ID 已被重用,以表为准
+        assert registry.encode('order.rolled_back_notice', {'n': 3}) != lost
+
+    def test_decode_template_registered_by_another_instance(self, db):
+        """其他实例登记的模板在解码时重新查询模板表"""
+        from services.message_templates import MessageTemplateRegistry
+        reader = MessageTemplateRegistry(db)
+        assert reader.decode(reader.encode('order.service_order_paid', {'order_id': 1}))
+        content = MessageTemplateRegistry(db).encode('order.another_notice', {'n': 5})
+        assert reader.decode(content) == ('order.another_notice', {'n': '5'})
+        assert reader.render(content) != content
+
+    def test_migration_rewrites_legacy_json_rows(self, db, users):
+        """迁移将已有的 JSON 服务消息与待投递通知改写为紧凑格式"""
+        import json
+        alice, bob, _ = users
+        legacy = json.dumps({'key': 'order.service_refund_requested',
+                             'params': {'order_id': 7, 'reason': '损坏'}}, ensure_ascii=False)
+        custom = json.dumps({'key': 'order.custom_notice', 'params': {'n': 3}})
+        with db.transaction() as conn:
+            conn.execute("DROP TABLE message_templates")
+            conn.execute("DELETE FROM schema_migrations WHERE version = 11")
+            conn.execute("INSERT INTO messages (sender_id, receiver_id, content, msg_type) VALUES (?, ?, ?, 'service')",
+                         (alice, bob, legacy))
+            conn.execute("INSERT INTO messages (sender_id, receiver_id, content) VALUES (?, ?, '{\"key\": 1}')",
+                         (alice, bob))
+            conn.execute("INSERT INTO notification_outbox (sender_id, receiver_id, content) VALUES (?, ?, ?)",
+                         (alice, bob, custom))
+        assert db.migrate(verbose=False) == [11]
+
+        service = MessageService(db)
+        rows = db.execute_query("SELECT content, msg_type FROM messages ORDER BY msg_id")
+        assert service.templates.decode(rows[0]['content']) == \
+            ('order.service_refund_requested', {'order_id': '7', 'reason': '损坏'})
+        assert rows[1]['content'] == '{"key": 1}'  # 普通消息不改写
+        outbox = db.execute_query("SELECT content FROM notification_outbox")[0]['content']
+        assert service.templates.decode(outbox) == ('order.custom_notice', {'n': '3'})
+
+    def test_render_cache_hits_until_language_changes(self, db, monkeypatch):
+        """相同模板和参数只翻译一次,切换语言或重新加载翻译后重新渲染"""
+        from config.i18n import I18n, set_language, reload_translations
+        from services.message_templates import MessageTemplateRegistry
+        calls = []
+        original = I18n.translate
+        monkeypatch.setattr(I18n, 'translate', lambda self, key, **kw: calls.append(key) or original(self, key, **kw))
+
+        registry = MessageTemplateRegistry(db, cache_size=2)
+        first = registry.encode('order.service_order_paid', {'order_id': 1})
+        second = registry.encode('order.service_order_paid', {'order_id': 2})
+        try:
+            calls.clear()
+            for _ in range(5):
+                assert registry.render(first) == '订单 #1 已支付，请尽快发货。'
+            assert len(calls) == 1
+            set_language('en_US')
+            assert registry.render(first).startswith('Order #1 ')
+            assert len(calls) == 2
+            reload_translations()
+            registry.render(first)
+            assert len(calls) == 3
+            # 超出容量时淘汰最久未使用的条目
+            registry.render(second)
+            registry.render(registry.encode('order.service_order_paid', {'order_id': 3}))
+            registry.render(second)
+            assert len(calls) == 5
+            registry.render(first)
+            assert len(calls) == 6
+        finally:
+            set_language('zh_CN')
@@ -0,0 +1,223 @@
+import pytest
+import sys
+import os
+import sqlite3
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db_manager import DatabaseManager
+from services.order_service import OrderService
+from services.notification_dispatcher import NotificationDispatcher
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "orders.db"), pool_size=3)
+    yield manager
+    manager.close()
+
+
+def setup_order(db, dispatcher=None, sync_dispatch=True):
+    """创建买家、卖家、商品和一笔待支付订单"""
+    seller = db.execute_insert("INSERT INTO users (username, password, email) VALUES ('s', 'p', 's@x.com')")
+    buyer = db.execute_insert("INSERT INTO users (username, password, email) VALUES ('b', 'p', 'b@x.com')")
+    pid = db.execute_insert(
+        "INSERT INTO products (seller_id, title, price, category, stock) VALUES (?, 't', 5.0, '其他', 10)",
+        (seller,)
+    )
+    service = OrderService(db, dispatcher=dispatcher, sync_dispatch=sync_dispatch)
+    order_id = service.create_order(buyer, pid, 1, 'addr')
+    return service, order_id, buyer, seller
+
+
+class TestCreateOrder:
+    """测试下单的工作单元事务(真实数据库)"""
+
+    def test_create_order_is_atomic(self, db):
+        """订单创建的所有写入在同一事务中提交"""
+        pid = db.execute_insert(
+            "INSERT INTO products (seller_id, title, price, category, stock) VALUES (1, 't', 10.0, '其他', 3)"
+        )
+        buyer = db.execute_insert(
+            "INSERT INTO users (username, password, email) VALUES ('buyer', 'p', 'b@x.com')"
+        )
+        with db.transaction():
+            order_id = OrderService(db, sync_dispatch=True).create_order(buyer, pid, 2, 'addr')
+            # 服务通知与订单在同一事务中写入发件箱
+            assert db.execute_query("SELECT COUNT(*) AS c FROM notification_outbox")[0]['c'] == 1
+        assert order_id is not None
+        assert db.execute_query("SELECT stock FROM products WHERE product_id=?", (pid,))[0]['stock'] == 1
+        # 没有运行中的投递线程,提交后同步投递
+        assert db.execute_query("SELECT COUNT(*) AS c FROM notification_outbox")[0]['c'] == 0
+        assert db.execute_query("SELECT COUNT(*) AS c FROM messages")[0]['c'] == 1
+
+    def test_failed_order_insert_rolls_back_reservation(self, db):
+        """订单写入失败时异常抛出,预占的库存随事务回滚"""
+        pid = db.execute_insert(
+            "INSERT INTO products (seller_id, title, price, category, stock) VALUES (1, 't', 10.0, '其他', 3)"
+        )
+        db.execute_update(
+            "CREATE TRIGGER trg_reject_orders BEFORE INSERT ON orders BEGIN SELECT RAISE(ABORT, 'rejected'); END"
+        )
+        with pytest.raises(sqlite3.IntegrityError):
+            OrderService(db).create_order(1, pid, 2, 'addr')
+        assert db.execute_query("SELECT stock FROM products WHERE product_id=?", (pid,))[0]['stock'] == 3
+        assert db.execute_query("SELECT COUNT(*) AS c FROM notification_outbox")[0]['c'] == 0
+
+
+class TestOrderTransitions:
+    """测试比较并设置的订单状态迁移(真实数据库)"""
+
+    def test_transition_checks_actor_and_status_in_one_statement(self, db):
+        """身份或状态不符时不修改订单"""
+        service, order_id, buyer, seller = setup_order(db)
+        assert service.ship_order(order_id, seller, 'SF1') is False  # 未支付
+        assert service.pay_order(order_id, 'wechat') is True
+        assert service.ship_order(order_id, buyer, 'SF1') is False   # 非卖家
+        assert service.ship_order(order_id, seller, 'SF1') is True
+        order = service.get_order_by_id(order_id)
+        assert order.status.value == 'shipped' and order.tracking_number == 'SF1'
+
+    def test_concurrent_decisions_only_one_wins(self, db):
+        """同时同意和拒绝退款时只有一个操作生效"""
+        service, order_id, buyer, seller = setup_order(db)
+        service.pay_order(order_id, 'wechat')
+        service.request_refund(order_id, buyer, 'r')
+
+        results = []
+        barrier = threading.Barrier(2)
+
+        def decide(fn):
+            barrier.wait()
+            results.append(fn())
+
+        threads = [
+            threading.Thread(target=decide, args=(lambda: service.approve_refund(order_id, seller),)),
+            threading.Thread(target=decide, args=(lambda: service.reject_refund(order_id, seller, 'no'),)),
+        ]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert sorted(results) == [False, True]
+        messages = db.execute_query("SELECT COUNT(*) AS c FROM messages WHERE msg_type='service'")[0]['c']
+        assert messages == 4  # 创建、支付、申请退款、一次审批
+
+
+class TestOrderStatistics:
+    """测试增量维护的订单统计表"""
+
+    def _stats_by_scan(self, db, user_id, role):
+        rows = db.execute_query(
+            f"SELECT status, COUNT(*) AS c, COALESCE(SUM(total_price), 0) AS s "
+            f"FROM orders WHERE {role}_id=? GROUP BY status",
+            (user_id,)
+        )
+        return {r['status']: (r['c'], r['s']) for r in rows}
+
+    def _stats_by_table(self, db, user_id, role):
+        rows = db.execute_query(
+            "SELECT status, order_count, total_amount FROM user_order_stats "
+            "WHERE user_id=? AND role=? AND order_count > 0",
+            (user_id, role)
+        )
+        return {r['status']: (r['order_count'], r['total_amount']) for r in rows}
+
+    def test_counters_follow_transitions(self, db):
+        """下单、状态迁移、删除后计数表与全表扫描结果一致"""
+        service, order_id, buyer, seller = setup_order(db)
+        second = service.create_order(buyer, db.execute_query("SELECT product_id FROM products")[0]['product_id'], 2, 'a')
+        service.pay_order(order_id, 'wechat')
+        service.request_cancel_order(second, buyer, 'r')
+        for user_id, role in ((buyer, 'buyer'), (seller, 'seller')):
+            assert self._stats_by_table(db, user_id, role) == self._stats_by_scan(db, user_id, role)
+
+        stats = service.get_order_statistics(seller, is_seller=True)
+        assert stats['total_orders'] == 2
+        assert stats['by_status']['paid'] == 1 and stats['by_status']['pending'] == 0
+        assert stats['total_revenue'] == 15.0
+        assert service.get_order_statistics(buyer)['total_spent'] == 15.0
+
+        db.execute_delete("DELETE FROM orders WHERE order_id=?", (second,))
+        assert self._stats_by_table(db, buyer, 'buyer') == {'paid': (1, 5.0)}
+
+    def test_rebuild_restores_drifted_counters(self, db):
+        """重建命令修复被篡改的计数"""
+        service, order_id, buyer, seller = setup_order(db)
+        db.execute_update("UPDATE user_order_stats SET order_count = 99")
+        service.rebuild_order_statistics()
+        assert service.get_order_statistics(buyer)['total_orders'] == 1
+        assert self._stats_by_table(db, seller, 'seller') == {'pending': (1, 5.0)}
+
+    def test_falls_back_to_group_by_without_table(self, db):
+        """计数表缺失时退回单次 GROUP BY 查询"""
+        service, order_id, buyer, seller = setup_order(db)
+        with db.transaction() as conn:
+            conn.execute("DROP TABLE user_order_stats")
+        stats = service.get_order_statistics(buyer)
+        assert stats['total_orders'] == 1 and stats['by_status']['pending'] == 1
+
+
+class TestNotificationOutbox:
+    """测试服务通知发件箱与投递"""
+
+    def test_dispatch_moves_outbox_to_messages_once(self, db):
+        """投递后消息写入 messages,发件箱清空,重复投递不产生重复消息"""
+        service, order_id, buyer, seller = setup_order(db)
+        db.execute_update("DELETE FROM messages")
+        for key in ('order.service_order_created', 'order.service_order_paid'):
+            db.execute_insert(
+                "INSERT INTO notification_outbox (sender_id, receiver_id, content) VALUES (?, ?, ?)",
+                (buyer, seller, service.templates.encode(key, {'order_id': order_id}))
+            )
+
+        dispatcher = NotificationDispatcher(db, batch_size=1)
+        assert dispatcher.dispatch() == 2
+        assert dispatcher.dispatch() == 0
+        rows = db.execute_query("SELECT sender_id, receiver_id, msg_type, content FROM messages ORDER BY msg_id")
+        assert [(r['sender_id'], r['receiver_id'], r['msg_type']) for r in rows] == [(buyer, seller, 'service')] * 2
+        assert service.templates.decode(rows[0]['content']) == ('order.service_order_created', {'order_id': str(order_id)})
+        assert db.execute_query("SELECT COUNT(*) AS c FROM notification_outbox")[0]['c'] == 0
+
+    def test_rolled_back_transition_leaves_no_notification(self, db):
+        """事务回滚时通知一并撤销"""
+        service, order_id, buyer, seller = setup_order(db)
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                service.pay_order(order_id, 'wechat')
+                raise RuntimeError("boom")
+        assert db.execute_query("SELECT COUNT(*) AS c FROM notification_outbox")[0]['c'] == 0
+        # 只有下单通知被投递
+        assert db.execute_query("SELECT COUNT(*) AS c FROM messages")[0]['c'] == 1
+
+    def test_background_thread_delivers_and_flushes_on_stop(self, db):
+        """后台线程定时投递,停止时投递剩余通知"""
+        dispatcher = NotificationDispatcher(db, interval=0.05)
+        dispatcher.start()
+        service, order_id, buyer, seller = setup_order(db, dispatcher)
+        service.pay_order(order_id, 'wechat')
+        dispatcher.stop()
+        assert dispatcher.delivered == 2
+        assert db.execute_query("SELECT COUNT(*) AS c FROM messages")[0]['c'] == 2
+
+    def test_delivered_after_commit_without_running_dispatcher(self, db):
+        """投递线程未运行时,通知在最外层事务提交后同步投递,回滚时不投递"""
+        service, order_id, buyer, seller = setup_order(db)
+
+        def count(table):
+            return db.execute_query(f"SELECT COUNT(*) AS c FROM {table}")[0]['c']
+
+        with db.transaction():
+            service.pay_order(order_id, 'wechat')
+            service.ship_order(order_id, seller, 'SF1')
+            assert (count('notification_outbox'), count('messages')) == (2, 1)
+        assert (count('notification_outbox'), count('messages')) == (0, 3)
+
+    def test_not_delivered_synchronously_by_default(self, db):
+        """未开启 sync_dispatch 时通知留在发件箱中,由投递线程投递"""
+        service, order_id, buyer, seller = setup_order(db, sync_dispatch=False)
+        service.pay_order(order_id, 'wechat')
+        assert db.execute_query("SELECT COUNT(*) AS c FROM notification_outbox")[0]['c'] == 2
+        assert db.execute_query("SELECT COUNT(*) AS c FROM messages")[0]['c'] == 0
+        assert NotificationDispatcher(db).dispatch() == 2
@@ -1,7 +1,9 @@
 import pytest
 import sys
 import os
+import re
 from datetime import datetime
+from contextlib import contextmanager
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -16,6 +18,14 @@ class SimpleMockDB:
         self.products = {}
         self.oid_counter = 1
     
+    @contextmanager
+    def transaction(self):
+        yield self
+    
+    def on_commit(self, callback):
+        # 模拟数据库不保存发件箱,无需投递
+        pass
+    
     def execute_query(self, query, params):
         if "SELECT * FROM orders WHERE order_id=?" in query:
             return [self.orders[params[0]]] if params[0] in self.orders else []
@@ -49,35 +59,44 @@ class SimpleMockDB:
             return oid
         return None
     
+    def execute_returning(self, query, params):
+        if "UPDATE orders SET" in query and "RETURNING" in query:
+            # 模拟比较并设置的订单状态迁移
+            m = re.search(r"SET (.*) WHERE order_id=\? AND status IN \(([?, ]*)\)( AND (\w+)=\?)?", query)
+            set_fields = [f.split('=')[0].strip() for f in m.group(1).split(',')]
+            n_status = m.group(2).count('?')
+            values = params[:len(set_fields)]
+            oid = params[len(set_fields)]
+            statuses = params[len(set_fields) + 1:len(set_fields) + 1 + n_status]
+            order = self.orders.get(oid)
+            if not order or order['status'] not in statuses:
+                return []
+            if m.group(4) and order[m.group(4)] != params[-1]:
+                return []
+            for field, value in zip(set_fields, values):
+                order[field] = value
+            return [dict(order)]
+        if "UPDATE products" in query and "SET stock = stock - ?" in query:
+            # 模拟带 stock >= ? 条件的原子扣减
+            qty, pid = params[0], params[2]
+            product = self.products.get(pid)
+            if not product or product.get('status') != 'available' or product['stock'] < qty:
+                return []
+            product['stock'] -= qty
+            if product['stock'] <= 0:
+                product['status'] = 'sold_out'
+            return [dict(product)]
+        return []
+    
     def execute_update(self, query, params):
-        if "UPDATE orders" in query and "WHERE order_id=?" in query:
-            oid = params[-1]
-            if "SET status=?, paid_at=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['paid_at'] = params[1]
-            elif "SET status=?, tracking_number=?, shipped_at=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['tracking_number'] = params[1]
-                self.orders[oid]['shipped_at'] = params[2]
-            elif "SET status=?, completed_at=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['completed_at'] = params[1]
-            elif "SET status=?" in query:
-                self.orders[oid]['status'] = params[0]
-            elif "SET status=?, cancel_reject_reason=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['cancel_reject_reason'] = params[1]
-            elif "SET status=?, refund_reject_reason=?" in query:
-                self.orders[oid]['status'] = params[0]
-                self.orders[oid]['refund_reject_reason'] = params[1]
-            return 1
-        if "UPDATE products SET stock=?" in query:
-            # 记录库存更新
-            if "WHERE product_id=?" in query:
-                pid = params[-1]
-                if pid in self.products:
-                    self.products[pid]['stock'] = params[0]
-            return 1
+        if "UPDATE products" in query and "SET stock = stock + ?" in query:
+            qty, pid = params
+            if pid in self.products:
+                self.products[pid]['stock'] += qty
+                if self.products[pid].get('status') == 'sold_out':
+                    self.products[pid]['status'] = 'available'
+                return 1
+            return 0
         return 0
 
 
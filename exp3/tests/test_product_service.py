@@ -0,0 +1,484 @@
+import pytest
+import sys
+import os
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db_manager import DatabaseManager
+from services.product_service import ProductService
+from services.order_service import OrderService
+from database.text_search import build_match_query
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "products.db"), pool_size=8)
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def service(db):
+    return ProductService(db)
+
+
+def add_user(db, name):
+    return db.execute_insert(
+        "INSERT INTO users (username, password, email) VALUES (?, 'p', ?)", (name, f"{name}@x.com")
+    )
+
+
+def add_product(service, seller_id, **overrides):
+    data = {'title': '测试商品', 'description': 'desc', 'price': 10.0, 'category': '原神', 'stock': 5}
+    data.update(overrides)
+    return service.create_product(seller_id, data)
+
+
+class TestReserveStock:
+    """测试原子库存扣减"""
+
+    def test_reserve_decrements_and_returns_product(self, db, service):
+        """扣减成功返回价格与卖家"""
+        pid = add_product(service, 1, stock=3, price=12.5)
+        reserved = service.reserve_stock(pid, 2)
+        assert reserved['stock'] == 1
+        assert reserved['price'] == 12.5 and reserved['seller_id'] == 1
+        assert reserved['status'] == 'available'
+
+    def test_reserve_last_unit_marks_sold_out(self, db, service):
+        """扣减到0时同一语句切换为售罄"""
+        pid = add_product(service, 1, stock=2)
+        assert service.reserve_stock(pid, 2)['status'] == 'sold_out'
+        assert service.reserve_stock(pid, 1) is None
+
+    def test_reserve_insufficient_stock_changes_nothing(self, db, service):
+        """库存不足时不修改数据"""
+        pid = add_product(service, 1, stock=1)
+        assert service.reserve_stock(pid, 2) is None
+        assert service.reserve_stock(pid, 0) is None
+        assert db.execute_query("SELECT stock FROM products WHERE product_id=?", (pid,))[0]['stock'] == 1
+
+    def test_release_restores_sold_out(self, db, service):
+        """归还库存时售罄商品恢复可售"""
+        pid = add_product(service, 1, stock=1)
+        service.reserve_stock(pid, 1)
+        assert service.release_stock(pid, 1)
+        row = db.execute_query("SELECT stock, status FROM products WHERE product_id=?", (pid,))[0]
+        assert row['stock'] == 1 and row['status'] == 'available'
+
+    def test_concurrent_checkout_never_oversells(self, db, service):
+        """多线程并发下单不超卖"""
+        pid = add_product(service, 1, stock=25)
+        buyers = [add_user(db, f"b{i}") for i in range(8)]
+        orders = OrderService(db)
+        created = []
+        lock = threading.Lock()
+
+        def worker(buyer_id):
+            for _ in range(10):
+                order_id = orders.create_order(buyer_id, pid, 1, 'addr')
+                if order_id:
+                    with lock:
+                        created.append(order_id)
+
+        threads = [threading.Thread(target=worker, args=(b,)) for b in buyers]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        assert len(created) == 25
+        row = db.execute_query("SELECT stock, status FROM products WHERE product_id=?", (pid,))[0]
+        assert row['stock'] == 0 and row['status'] == 'sold_out'
+        assert db.execute_query("SELECT COUNT(*) AS c FROM orders")[0]['c'] == 25
+
+
+class TestKeysetPagination:
+    """测试游标分页"""
+
+    def _walk(self, service, sort_by, per_page=4):
+        seen, cursor = [], None
+        while True:
+            page = service.get_products_by_category('原神', limit=per_page, sort_by=sort_by, cursor=cursor)
+            if not page:
+                return seen
+            seen.extend(p['product_id'] for p in page)
+            cursor = service.page_cursor(page[-1], sort_by)
+
+    def test_cursor_pages_match_full_ordering(self, db, service):
+        """逐页游标遍历与一次性排序结果一致(含重复排序值)"""
+        for i in range(11):
+            add_product(service, 1, price=float(i % 3), stock=1)
+        for pid in (2, 5, 7):
+            db.execute_update("UPDATE products SET view_count = 3 WHERE product_id=?", (pid,))
+        for sort_by in ('newest', 'price_asc', 'price_desc', 'popular'):
+            expected = [p['product_id'] for p in
+                        service.get_products_by_category('原神', limit=100, sort_by=sort_by)]
+            walked = self._walk(service, sort_by)
+            assert walked == expected and len(set(walked)) == 11
+
+    def test_search_products_cursor(self, db, service):
+        """搜索结果翻页不重复不遗漏"""
+        ids = [add_product(service, 1, title=f"手办{i}") for i in range(5)]
+        first = service.search_products(keyword='手办', limit=3)
+        rest = service.search_products(keyword='手办', limit=3, cursor=service.page_cursor(first[-1]))
+        assert sorted(p['product_id'] for p in first + rest) == ids
+
+    def test_invalid_or_mismatched_cursor_returns_empty(self, db, service):
+        """无法解析或排序方式不符的游标不返回数据"""
+        add_product(service, 1)
+        page = service.get_products_by_category('原神', sort_by='newest')
+        cursor = service.page_cursor(page[-1], 'newest')
+        assert service.get_products_by_category('原神', sort_by='price_asc', cursor=cursor) == []
+        assert service.get_products_by_category('原神', cursor='not-a-cursor') == []
+        assert service.get_products_by_category('原神', sort_by='trending', cursor='not-a-cursor') == []
+        assert service.get_products_by_category('原神', sort_by='trending', cursor=cursor) == []
+
+
+class TestFullTextSearch:
+    """测试 FTS5 商品搜索"""
+
+    def test_search_ranks_title_hits_first(self, db, service):
+        """标题命中排在仅描述命中之前"""
+        desc_hit = add_product(service, 1, title='普通商品', description='附赠胡桃亚克力立牌')
+        title_hit = add_product(service, 1, title='胡桃亚克力立牌', description='官方正品')
+        add_product(service, 1, title='无关商品', description='无关描述')
+        results = service.search_products(keyword='亚克力立牌')
+        assert [p['product_id'] for p in results] == [title_hit, desc_hit]
+
+    def test_index_follows_product_writes(self, db, service):
+        """商品新增、修改、删除后索引同步"""
+        pid = add_product(service, 1, title='初音未来手办')
+        assert service.search_products(keyword='初音未来')
+        service.update_product(pid, {'title': '镜音铃手办'})
+        assert service.search_products(keyword='初音未来') == []
+        assert [p['product_id'] for p in service.search_products(keyword='镜音铃')] == [pid]
+        db.execute_delete("DELETE FROM products WHERE product_id=?", (pid,))
+        assert service.search_products(keyword='镜音铃') == []
+
+    def test_plain_connection_can_write_products(self, db, service):
+        """索引由服务层分词写入,未注册 cjk_tokens 的连接也能写入商品"""
+        import sqlite3
+        pid = add_product(service, 1, title='初音未来手办')
+        conn = sqlite3.connect(db.db_path)
+        try:
+            conn.execute("UPDATE products SET title = '镜音铃手办', view_count = 3 WHERE product_id = ?", (pid,))
+            conn.execute(
+                "INSERT INTO products (seller_id, title, description, price, category) "
+                "VALUES (1, '外部商品', '', 1.0, '其他')"
+            )
+            conn.execute("DELETE FROM products WHERE product_id = ?", (pid,))
+            conn.commit()
+        finally:
+            conn.close()
+        assert service.search_products(keyword='初音未来') == []
+
+    def test_search_combines_filters_and_short_terms(self, db, service):
+        """全文检索与分类、价格、短词条件组合"""
+        cheap = add_product(service, 1, title='明日方舟 徽章', price=15.0, category='明日方舟')
+        add_product(service, 1, title='明日方舟 挂画', price=16.0, category='明日方舟')
+        add_product(service, 1, title='明日方舟 徽章', price=80.0, category='明日方舟')
+        other = add_product(service, 1, title='明日方舟 徽章', price=15.0, category='原神')
+        results = service.search_products(keyword='明日方舟 徽章', category='明日方舟', max_price=50)
+        assert [p['product_id'] for p in results] == [cheap]
+        results = service.search_products(keyword='明日方舟 徽章', min_price=10, max_price=20)
+        assert sorted(p['product_id'] for p in results) == [cheap, other]
+
+    def test_relevance_cursor_pages(self, db, service):
+        """相关度排序结果可用游标翻页"""
+        ids = [add_product(service, 1, title=f"间谍过家家 周边{i}") for i in range(7)]
+        seen, cursor = [], None
+        while True:
+            page = service.search_products(keyword='间谍过家家', limit=3, cursor=cursor)
+            if not page:
+                break
+            seen.extend(p['product_id'] for p in page)
+            cursor = service.page_cursor(page[-1])
+        assert sorted(seen) == ids
+
+    def test_short_and_normalized_queries_hit_index(self, db, service):
+        """单字、双字与全角查询通过索引命中"""
+        pid = add_product(service, 1, title='崩坏:星穹铁道 流萤 ＦＩＧＵＲＥ')
+        add_product(service, 1, title='其他商品')
+        for keyword in ('萤', '流萤', '星穹铁道 流萤', 'figure', 'ｆｉｇ'):
+            assert [p['product_id'] for p in service.search_products(keyword=keyword)] == [pid], keyword
+
+    def test_search_uses_fts_index(self, db, service):
+        """关键词搜索走全文索引而不是扫描商品表"""
+        match = build_match_query('星穹铁道 手办')
+        plan = db.execute_query(
+            "EXPLAIN QUERY PLAN SELECT p.product_id FROM products_fts "
+            "JOIN products p ON p.product_id = products_fts.rowid WHERE products_fts MATCH ?",
+            (match,)
+        )
+        details = [row['detail'] for row in plan]
+        assert details[0].startswith('SCAN products_fts VIRTUAL TABLE')
+        assert 'SCAN p' not in details
+
+
+class TestViewCountBuffer:
+    """测试浏览次数写缓冲"""
+
+    def _views(self, db, pid):
+        return db.execute_query("SELECT view_count FROM products WHERE product_id=?", (pid,))[0]['view_count']
+
+    def test_views_are_buffered_and_flushed_in_one_batch(self, db):
+        """浏览只在内存中累加,写回时一次 executemany 更新所有商品"""
+        from services.view_counter import ViewCountBuffer
+        counter = ViewCountBuffer(db, threshold=1000)
+        service = ProductService(db, counter)
+        seller = add_user(db, 'seller')
+        a, b = add_product(service, seller), add_product(service, seller)
+        for _ in range(3):
+            service.get_product_by_id(a)
+        product = service.get_product_by_id(b)
+        assert product.view_count == 1
+        assert service.get_product_by_id(a, increment_view=False).view_count == 3
+        assert self._views(db, a) == 0
+
+        assert counter.flush() == 2
+        assert (self._views(db, a), self._views(db, b)) == (3, 1)
+        assert counter.pending(a) == 0 and counter.flush() == 0
+
+    def test_threshold_and_stop_flush(self, db):
+        """待写入次数达到阈值时立即写回,停止时写回剩余计数"""
+        from services.view_counter import ViewCountBuffer
+        counter = ViewCountBuffer(db, interval=60, threshold=5)
+        service = ProductService(db, counter)
+        pid = add_product(service, add_user(db, 'seller'))
+        counter.start()
+        for _ in range(7):
+            service.get_product_by_id(pid)
+        assert self._views(db, pid) == 5
+        counter.stop()
+        assert self._views(db, pid) == 7
+
+    def test_failed_flush_keeps_counts(self, db, monkeypatch):
+        """写回失败时增量保留在缓冲中"""
+        from services.view_counter import ViewCountBuffer
+        counter = ViewCountBuffer(db, threshold=1000)
+        counter.record(1)
+        monkeypatch.setattr(db, 'transaction', lambda: (_ for _ in ()).throw(RuntimeError('locked')))
+        with pytest.raises(RuntimeError):
+            counter.flush()
+        assert counter.pending(1) == 1
+
+    def test_inflight_counts_stay_pending_until_commit(self, db, monkeypatch):
+        """写回事务提交前,正在写回的增量仍计入 pending,期间新的浏览另行累加"""
+        from contextlib import contextmanager
+        from services.view_counter import ViewCountBuffer
+        counter = ViewCountBuffer(db, threshold=1000)
+        pid = add_product(ProductService(db), add_user(db, 'seller'))
+        counter.record(pid)
+        counter.record(pid)
+        seen = []
+        transaction = db.transaction
+
+        @contextmanager
+        def observed():
+            with transaction() as conn:
+                yield conn
+                counter.record(pid)
+                seen.append(counter.pending(pid))
+
+        monkeypatch.setattr(db, 'transaction', observed)
+        assert counter.flush() == 1
+        assert seen == [3]
+        assert self._views(db, pid) == 2 and counter.pending(pid) == 1
+
+    def test_without_buffer_views_are_written_immediately(self, db, service):
+        """未提供共用缓冲时不创建缓冲,每次浏览直接写入数据库"""
+        pid = add_product(service, add_user(db, 'seller'))
+        assert service.view_counter is None
+        assert service.get_product_by_id(pid).view_count == 1
+        assert service.get_product_by_id(pid).view_count == 2
+        assert self._views(db, pid) == 2
+
+
+class TestTrending:
+    """测试滑动窗口热门榜"""
+
+    def test_window_slides_and_old_activity_expires(self):
+        """最近一小时按分钟计,一天内按小时计,窗口外的事件不再计入"""
+        from services.trending import TrendingTracker
+        tracker = TrendingTracker(top_k=2, favorite_weight=5, day_weight=0.1)
+        now = 1_000_000 * 3600.0
+        tracker.record_view(1, '原神', now)
+        tracker.record_favorite(1, '原神', now)
+        assert tracker.score(1, now) == pytest.approx(6 + 0.6)
+        # 一小时后只剩小时窗口的计数
+        assert tracker.score(1, now + 3600) == pytest.approx(0.6)
+        assert tracker.top('原神', now + 25 * 3600) == []
+        assert tracker._products == {}
+
+    def test_top_k_per_category_and_global(self):
+        """各分类保留前 K 名,全站榜由各分类榜合并"""
+        from services.trending import TrendingTracker
+        tracker = TrendingTracker(top_k=2)
+        now = 1_000_000 * 3600.0
+        for pid, category, views in [(1, 'a', 1), (2, 'a', 3), (3, 'a', 2), (4, 'b', 5)]:
+            for _ in range(views):
+                tracker.record_view(pid, category, now)
+        assert [pid for pid, _ in tracker.top('a', now)] == [2, 3]
+        assert [pid for pid, _ in tracker.top(None, now)] == [4, 2]
+        # 有新事件的分类重新计算
+        for _ in range(3):
+            tracker.record_view(1, 'a', now + 1)
+        assert [pid for pid, _ in tracker.top('a', now + 1)] == [1, 2]
+
+    def test_category_listing_serves_trending_from_memory(self, db, service):
+        """分类列表按近期热门排序,游标按榜单位置翻页,下架商品不显示"""
+        seller = add_user(db, 'seller')
+        buyer = add_user(db, 'buyer')
+        pids = [add_product(service, seller, title=f'商品{i}') for i in range(4)]
+        for pid, views in zip(pids, [1, 4, 2, 3]):
+            for _ in range(views):
+                service.get_product_by_id(pid)
+        service.favorite_product(buyer, pids[0])
+        db.execute_update("UPDATE products SET status='removed' WHERE product_id=?", (pids[3],))
+
+        first = service.get_products_by_category('原神', limit=2, sort_by='trending')
+        assert [p['product_id'] for p in first] == [pids[0], pids[1]]
+        cursor = service.page_cursor(first[-1], 'trending')
+        second = service.get_products_by_category('原神', limit=2, sort_by='trending', cursor=cursor)
+        assert [p['product_id'] for p in second] == [pids[2]]
+        assert service.get_products_by_category('明日方舟', sort_by='trending') == []
+
+
+class TestPopularityScore:
+    """测试预计算的热度列"""
+
+    def _score(self, db, pid):
+        row = db.execute_query("SELECT sales_count, popularity_score FROM products WHERE product_id=?", (pid,))[0]
+        return row['sales_count'], row['popularity_score']
+
+    def test_score_follows_views_favorites_and_completed_sales(self, db, service):
+        """浏览、收藏、成交计数变化时增量更新热度,订单离开完成状态时扣回"""
+        seller, buyer = add_user(db, 'seller'), add_user(db, 'buyer')
+        pid = add_product(service, seller)
+        service.get_product_by_id(pid)
+        service.favorite_product(buyer, pid)
+        assert self._score(db, pid) == (0, 1 + 5)
+
+        order_id = db.execute_insert(
+            "INSERT INTO orders (buyer_id, seller_id, product_id, quantity, total_price, status, shipping_address) "
+            "VALUES (?, ?, ?, 2, 20.0, 'shipped', 'addr')", (buyer, seller, pid)
+        )
+        db.execute_update("UPDATE orders SET status='completed' WHERE order_id=?", (order_id,))
+        assert self._score(db, pid) == (2, 6 + 40)
+        db.execute_update("UPDATE orders SET status='refunded' WHERE order_id=?", (order_id,))
+        assert self._score(db, pid) == (0, 6)
+
+        service.unfavorite_product(buyer, pid)
+        assert self._score(db, pid) == (0, 1)
+
+    def test_reweighting_and_popular_order(self, db, service):
+        """修改权重后全量重算,最受欢迎排序按热度降序"""
+        seller, buyer = add_user(db, 'seller'), add_user(db, 'buyer')
+        viewed, favorited = add_product(service, seller), add_product(service, seller)
+        db.execute_update("UPDATE products SET view_count = 4 WHERE product_id=?", (viewed,))
+        service.favorite_product(buyer, favorited)
+        order = lambda: [p['product_id'] for p in service.get_products_by_category('原神', sort_by='popular')]
+        assert order() == [favorited, viewed]
+        assert service.rebuild_popularity_scores({'views': 2.0, 'favorites': 1.0, 'sales': 0.0}) == 2
+        assert order() == [viewed, favorited]
+        assert self._score(db, viewed) == (0, 8.0)
+
+
+class TestCategoryCounts:
+    """测试分类目录计数表"""
+
+    def _expected(self, db):
+        rows = db.execute_query("SELECT category, status, COUNT(*) AS c FROM products GROUP BY category, status")
+        return {(r['category'], r['status']): r['c'] for r in rows}
+
+    def _actual(self, service):
+        counts = {}
+        for row in service.get_category_counts(include_empty=True):
+            for status in ('available', 'sold_out', 'removed', 'in_auction'):
+                if row[f'{status}_count']:
+                    counts[(row['name'], status)] = row[f'{status}_count']
+        return counts
+
+    def test_counts_follow_create_update_delete(self, db, service):
+        """新增、修改、下架、售罄与删除后计数与实际一致"""
+        from config.settings import PRODUCT_CATEGORIES
+        seller = add_user(db, 'seller')
+        a = add_product(service, seller, category='原神', stock=1)
+        b = add_product(service, seller, category='原神')
+        c = add_product(service, seller, category='明日方舟')
+        add_product(service, seller, category='自定义分类')
+        service.reserve_stock(a, 1)
+        service.update_product(b, {'category': 'Fate'})
+        service.delete_product(c, seller)
+        db.execute_update("DELETE FROM products WHERE product_id=?", (a,))
+        assert self._actual(service) == self._expected(db)
+
+        names = service.get_all_categories()
+        assert names == ['Fate', '自定义分类']
+        all_names = [row['name'] for row in service.get_category_counts(include_empty=True)]
+        assert all_names == PRODUCT_CATEGORIES + ['自定义分类']
+
+    def test_migration_backfills_existing_products(self, db, service):
+        """迁移按已有商品回填计数,目录外的分类追加到末尾"""
+        seller = add_user(db, 'seller')
+        for category in ('原神', '原神', 'zzz', 'aaa'):
+            add_product(service, seller, category=category)
+        with db.transaction() as conn:
+            conn.execute("DROP TABLE categories")
+            conn.execute("DELETE FROM schema_migrations WHERE version = 13")
+        assert db.migrate(verbose=False) == [13]
+        assert self._actual(service) == self._expected(db)
+        assert service.get_all_categories() == ['原神', 'aaa', 'zzz']
+
+
+class TestSearchFacets:
+    """测试搜索分面计数"""
+
+    @pytest.fixture
+    def catalog(self, db, service):
+        seller = add_user(db, 'seller')
+        rows = [('胡桃手办', '原神', 30.0, False), ('胡桃手办 限定', '原神', 120.0, True),
+                ('胡桃手办 复刻', '原神', 600.0, False), ('阿米娅手办', '明日方舟', 80.0, True),
+                ('胡桃抱枕', '原神', 40.0, False)]
+        for title, category, price, auctionable in rows:
+            add_product(service, seller, title=title, category=category, price=price, auctionable=auctionable)
+        return seller
+
+    def _brute_force(self, service, keyword, category=None, min_price=None, max_price=None):
+        return len(service.search_products(keyword=keyword, category=category, min_price=min_price,
+                                           max_price=max_price, limit=1000))
+
+    def test_facets_match_separate_searches(self, service, catalog):
+        """分面计数与逐个筛选条件单独搜索的结果数一致"""
+        products, facets = service.search_products(keyword='手办', min_price=50, limit=2, facets=True)
+        assert len(products) == 2
+        assert facets['total'] == self._brute_force(service, '手办', min_price=50) == 3
+        # 分类计数保留价格条件
+        assert facets['category'] == [
+            {'value': '原神', 'count': self._brute_force(service, '手办', '原神', min_price=50)},
+            {'value': '明日方舟', 'count': self._brute_force(service, '手办', '明日方舟', min_price=50)},
+        ]
+        # 价格区间计数不受价格条件限制
+        assert [b['count'] for b in facets['price']] == [
+            self._brute_force(service, '手办', min_price=low, max_price=(high - 0.01) if high else None)
+            for low, high in [(None, 50), (50, 100), (100, 200), (200, 500), (500, None)]
+        ] == [1, 1, 1, 0, 1]
+        assert facets['auctionable'] == {True: 2, False: 1}
+
+    def test_facets_with_category_and_like_fallback(self, service, catalog):
+        """分类筛选下的价格/拍卖计数,以及无全文检索词时的 LIKE 路径"""
+        _, facets = service.search_products(keyword='胡桃', category='原神', facets=True)
+        assert facets['total'] == 4
+        assert [b['count'] for b in facets['price']] == [2, 0, 1, 0, 1]
+        assert facets['auctionable'] == {True: 1, False: 3}
+
+        _, facets = service.search_products(category='明日方舟', facets=True)
+        assert facets['total'] == 1
+        assert {f['value'] for f in facets['category']} == {'原神', '明日方舟'}
+        assert service.search_products(keyword='不存在', facets=True) == ([], {
+            'total': 0, 'category': [], 'price': [
+                {'min': low, 'max': high, 'count': 0}
+                for low, high in [(None, 50), (50, 100), (100, 200), (200, 500), (500, None)]
+            ], 'auctionable': {True: 0, False: 0}})
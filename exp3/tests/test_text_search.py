@@ -0,0 +1,41 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.text_search import normalize, cjk_tokens, build_match_query
+
+
+class TestCjkTokens:
+    """测试中日韩 n-gram 分词"""
+
+    def test_cjk_runs_become_bigrams_with_tail(self):
+        """连续汉字切为二元组并补末尾单字"""
+        assert cjk_tokens('星穹铁道') == '星穹 穹铁 铁道 道'
+        assert cjk_tokens('猫') == '猫'
+
+    def test_mixed_latin_and_cjk(self):
+        """拉丁词与中日韩片段分别切分,标点作为分隔"""
+        assert cjk_tokens('LoveLive!手办') == 'lovelive 手办 办'
+        assert cjk_tokens('崩坏:星穹铁道') == '崩坏 坏 星穹 穹铁 铁道 道'
+        assert cjk_tokens('初音ミク 1/7') == '初音 音ミ ミク ク 1 7'
+
+    def test_normalization(self):
+        """全角转半角、半角片假名转全角、大小写折叠"""
+        assert normalize('ＦＡＴＥ　１２３') == 'fate 123'
+        assert cjk_tokens('ﾐｸ') == cjk_tokens('ミク')
+        assert cjk_tokens('') == '' and cjk_tokens(None) == ''
+
+
+class TestMatchQuery:
+    """测试查询表达式生成"""
+
+    def test_query_terms(self):
+        """多字片段为二元组短语,单字与拉丁词为前缀匹配"""
+        assert build_match_query('星穹铁道 手办') == '"星穹 穹铁 铁道" "手办"'
+        assert build_match_query('猫 Ｆａｔｅ') == '"猫"* "fate"*'
+
+    def test_no_searchable_characters(self):
+        """只有标点时不生成表达式"""
+        assert build_match_query('!!! ""') is None
+        assert build_match_query('') is None
@@ -228,3 +228,17 @@ class DatabaseConnectionError(DatabaseException):
         else:
             message = f"数据库连接失败: {reason}" if reason else "数据库连接失败"
         super().__init__(message)
+
+
+# ============ 分页相关异常 ============
+
+class InvalidCursorError(AnimeShopException):
+    """无效的分页游标"""
+    def __init__(self, cursor: str = None):
+        self.cursor = cursor
+        i18n = _get_i18n()
+        if i18n:
+            message = i18n.t('common.invalid_cursor', cursor=cursor or '')
+        else:
+            message = f"无效的分页游标: {cursor}" if cursor else "分页游标格式不正确"
+        super().__init__(message)
@@ -0,0 +1,89 @@
+"""
+Pagination - 游标分页工具
+将排序键编码为不透明的游标字符串,用于键集(keyset)分页
+"""
+
+import base64
+import json
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .exceptions import InvalidCursorError
+
+
+def encode_cursor(kind: str, values: Sequence[Any]) -> str:
+    """
+    将排序键编码为游标
+
+    Args:
+        kind: 游标类型(排序方式),解码时校验以防混用
+        values: 最后一行的排序键取值
+
+    Returns:
+        str: URL 安全的游标字符串
+    """
+    payload = json.dumps([kind, list(values)], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, kind: str, size: int) -> List[Any]:
+    """
+    解码游标并校验类型与键个数
+
+    Args:
+        cursor: 游标字符串
+        kind: 期望的游标类型
+        size: 期望的排序键个数
+
+    Returns:
+        List[Any]: 排序键取值
+
+    Raises:
+        InvalidCursorError: 游标无法解析或与当前排序方式不匹配
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_kind, values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursorError(cursor)
+    if cursor_kind != kind or not isinstance(values, list) or len(values) != size:
+        raise InvalidCursorError(cursor)
+    return values
+
+
+def keyset_condition(columns: Sequence[str], descending: bool,
+                     cursor: str, kind: str) -> Tuple[str, List[Any]]:
+    """
+    生成"位于游标之后"的 WHERE 条件
+
+    使用行值比较 (a, b) < (?, ?),可直接利用 (…, a, b) 上的索引定位,
+    翻到任意深的页面代价都与第一页相同。
+
+    Args:
+        columns: 排序列,最后一列须为唯一键
+        descending: 是否降序
+        cursor: 游标字符串
+        kind: 游标类型
+
+    Returns:
+        Tuple[str, List[Any]]: 条件片段与参数
+    """
+    values = decode_cursor(cursor, kind, len(columns))
+    op = '<' if descending else '>'
+    cols = ', '.join(columns)
+    marks = ', '.join('?' * len(columns))
+    return f"({cols}) {op} ({marks})", values
+
+
+def cursor_for(row: Dict, columns: Sequence[str], kind: str) -> str:
+    """
+    根据一页中的最后一行生成下一页游标
+
+    Args:
+        row: 最后一行数据
+        columns: 排序列
+        kind: 游标类型
+
+    Returns:
+        str: 游标字符串
+    """
+    return encode_cursor(kind, [row[c] for c in columns])